@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Compares the two implementations of tokenizer.parseStream() on a tree of
+# .js files (default: the framework classes): tokens per second of each, and
+# whether they produce the same tokens.
+#
+#   bench-tokenizer.py [-r <rounds>] [<dir>]
+##
+
+import sys, os, time, optparse
+import qxenviron
+
+from misc import filetool
+from ecmascript.frontend import tokenizer
+
+
+def readFiles(root):
+    files = []
+    for dirpath, dirs, names in filetool.walk(root):
+        for name in sorted(names):
+            if name.endswith(".js"):
+                path = os.path.join(dirpath, name)
+                files.append((path, filetool.read(path)))
+    return files
+
+
+def bench(parser, files, rounds):
+    best = None
+    for i in range(rounds):
+        numTokens = 0
+        start = time.time()
+        for path, content in files:
+            if content:
+                numTokens += len(parser(content, path))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return numTokens, best
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [<dir>]")
+    parser.add_option("-r", "--rounds", dest="rounds", type="int", default=3, help="best of how many runs (default: 3)")
+    (options, args) = parser.parse_args(sys.argv[1:])
+    root = args[0] if args else os.path.join(qxenviron.scriptDir, os.pardir, os.pardir, os.pardir, "framework", "source", "class")
+
+    files = readFiles(root)
+    print ">>> %d files, %d characters" % (len(files), sum(len(content) for path, content in files))
+
+    results = {}
+    for name in ("parseStreamIter", "parseStreamBatch"):
+        numTokens, elapsed = bench(getattr(tokenizer, name), files, options.rounds)
+        results[name] = elapsed
+        print "  - %-17s %7d tokens in %6.2fs: %8d tokens/s" % (name, numTokens, elapsed, numTokens / elapsed)
+    print "  - speed-up: %.2f" % (results["parseStreamIter"] / results["parseStreamBatch"])
+
+    differ = [path for path, content in files
+              if content and tokenizer.parseStreamIter(content, path) != tokenizer.parseStreamBatch(content, path)]
+    print ">>> %d files with different tokens" % len(differ)
+    for path in differ:
+        print "  - %s" % path
+    return 1 if differ else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print
+        print "Keyboard interrupt!"
+        sys.exit(2)
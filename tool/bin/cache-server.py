@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Runs a shared compile cache server, to be used with the "cache/remote" key
+# of generator jobs, e.g.
+#
+#   "cache" : { "remote" : { "url" : "http://buildhost:8090", "secret-file" : "~/.qxcache-secret" } }
+#
+# where the secret file holds the same shared secret that is passed to the
+# server with --secret-file.
+##
+
+import sys, optparse
+import qxenviron
+
+from generator.runtime.CacheServer import CacheServer
+from generator.runtime.RemoteCache import readSecret
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-p", "--port", dest="port", type="int", default=8090, help="port to listen on (default: 8090)")
+    parser.add_option("-b", "--bind", dest="host", type="string", default="127.0.0.1", help="address to bind to (default: 127.0.0.1)")
+    parser.add_option("-d", "--dir", dest="path", type="string", default="shared-cache", help="directory to keep the cache entries in")
+    parser.add_option("-s", "--secret-file", dest="secretFile", type="string", default=None, help="file with the secret shared with the clients (required)")
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False, help="log requests")
+    (options, args) = parser.parse_args(sys.argv[1:])
+    if not options.secretFile:
+        parser.error("--secret-file is required")
+    secret = readSecret({"secret-file": options.secretFile})
+
+    server = CacheServer((options.host, options.port), options.path, secret, options.verbose)
+    print ">>> Serving shared cache from %s on %s:%d" % (options.path, options.host, options.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print
+        print "Keyboard interrupt!"
+        sys.exit(2)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Compile the CLDR locale files (tool/data/cldr/main/*.xml) into the locale
+# store the generator reads its locale data from (tool/data/cldr/main.dat).
+# Run this after updating the CLDR files.
+#
+# Usage: compile-cldr.py [<directory of locale .xml files>]
+##
+
+import sys, os
+import qxenviron
+from misc import cldr
+
+def main():
+    if len(sys.argv) > 1:
+        xmlDir = sys.argv[1]
+    else:
+        xmlDir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), os.pardir, "data", "cldr", "main")
+    xmlDir = os.path.normpath(xmlDir)
+    count = cldr.compileStore(xmlDir)
+    print "Compiled %d locales into %s" % (count, cldr.storeFile(xmlDir))
+
+
+if __name__ == "__main__":
+    main()
@@ -82,7 +82,8 @@ def main():
 
     # Cache support
     parser.add_option("-c", "--cache", dest="cache", metavar="CACHEPATH", type="string", default="", help="path to cache directory")
-    parser.add_option("--privateskey", dest="privateskey", metavar="CACHEKEY", type="string", default="", help="cache key for privates")
+    parser.add_option("--cache-store", dest="cachestore", metavar="STORETYPE", type="string", default="files", help="cache store type (files|segments)")
+    parser.add_option("--privateskey", dest="privateskey", metavar="CACHEKEY", type="string", default="", help="(ignored; privates are kept in the privates db of the cache)")
     
     
     #
@@ -146,14 +147,11 @@ def main():
         privates = {}
         if options.cache:
             cache = Cache(options.cache, 
-                interruptRegistry=interruptRegistry
+                interruptRegistry=interruptRegistry,
+                **{'cache/store' : options.cachestore}
             )
-            privates, _ = cache.read(options.privateskey)
-            if privates == None:
-                privates = {}
-        privateoptimizer.patch(tree, fileId, privates)
-        if options.cache:
-            cache.write(options.privateskey, privates)
+            privates = cache.privates()
+        privateoptimizer.patch(tree, privates)
          
          
     #
@@ -22,6 +22,14 @@
 
 import sys, os, optparse, string, types, pprint
 import qxenviron
+from generator.runtime import Generatord
+
+if __name__ == '__main__':  # hand over to a generator daemon, before loading everything else
+    retval = Generatord.forward(sys.argv[1:])
+    if retval is not None:
+        sys.exit(retval)
+
+import graph
 from misc.ExtendAction import ExtendAction
 from generator import Context
 from generator.Generator import Generator
@@ -99,6 +107,26 @@ def main():
     global options
     (options, args) = GeneratorArguments(option_class=ExtendAction).parse_args(sys.argv[1:])
 
+    # Daemon mode
+    if options.daemon:
+        console = Log(options.logfile, "info")
+        Context.console = console
+        console.head("Executing: Daemon Mode", True)
+        generatord = Generatord.Generatord(options.config, console, interruptRegistry)
+        console.info("Opening port %s on %s, serving %s ..." % (generatord.servAddr[1],
+            generatord.servAddr[0], generatord.configPath)
+        )
+        generatord.serve(runJobs)
+
+    # CLI mode
+    else:
+        runJobs(options, args)
+
+
+##
+# Run the jobs of a command line. With generatord, this is a request to a
+# generator daemon, which supplies what it has kept from previous requests.
+def runJobs(options, args, generatord=None):
     if args:
         options.jobs = args[0].split(',')
     else:
@@ -126,6 +154,44 @@ def main():
     # Initial user feedback
     appname = ((os.path.dirname(os.path.abspath(options.config)).split(os.sep)))[-1]
     console.head(u"Initializing: %s" % appname.decode('utf-8'), True)
+
+    if generatord:
+        config, expandedjobs = generatord.getConfig(options, args, lambda: loadConfig(options, args, console))
+    else:
+        config, expandedjobs, _ = loadConfig(options, args, console)
+
+    context = {'config': config, 'console':console, 'jobconf':None, 'interruptRegistry':interruptRegistry}
+    Context.config = config # TODO: clean up overlap between context dict and Context module
+
+    # Reset console level
+    console.setLevel(level)
+    console.resetFilter()
+
+    # Processing jobs...
+    for job in expandedjobs:
+        console.head("Executing: %s" % job.name, True)
+        if options.config_verbose:
+            console.setLevel("debug")
+            console.debug("Expanded job config:")
+            console.debug(pprint.pformat(config.getJob(job).getData()))
+            console.setLevel(level)
+
+        ctx = context.copy()
+        ctx['jobconf'] = config.getJob(job)
+        Context.jobconf = ctx['jobconf']
+
+        if generatord:
+            generatord.prepareJob(ctx)
+        generatorObj = Generator(ctx)
+        if generatord:
+            generatord.keepCache(ctx)
+        generatorObj.run()
+
+
+##
+# Load the config and expand the jobs of the command line. Returns the config,
+# the expanded jobs and the config files involved.
+def loadConfig(options, args, console):
     console.info(u"Processing configuration")
     console.debug(u"    file: %s" % options.config)
 
@@ -144,7 +210,8 @@ def main():
     # Resolve "include"-Keys
     console.debug("Resolving config includes...")
     console.indent()
-    config.resolveIncludes()
+    includeTree = graph.digraph()
+    config.resolveIncludes(includeTree)
     console.outdent()
 
     # Check jobs
@@ -154,9 +221,8 @@ def main():
         if default_job:
             options.jobs.append(default_job)
         else:
-            if not options.daemon:
-                listJobs(console, availableJobs, config)
-                sys.exit(1)
+            listJobs(console, availableJobs, config)
+            sys.exit(1)
         
     else:
         for job in options.jobs:
@@ -166,61 +232,30 @@ def main():
                 sys.exit(1)
 
     console.debug(u"Jobs: %s" % ", ".join(options.jobs))
-    context = {'config': config, 'console':console, 'jobconf':None, 'interruptRegistry':interruptRegistry}
-    Context.config = config # TODO: clean up overlap between context dict and Context module
+    Context.config = config
 
-    # CLI mode
-    if not options.daemon:
-        # Resolve "extend"- and "run"-Keys
-        expandedjobs = config.resolveExtendsAndRuns(options.jobs[:])
+    # Resolve "extend"- and "run"-Keys
+    expandedjobs = config.resolveExtendsAndRuns(options.jobs[:])
 
-        # Include system defaults
-        config.includeSystemDefaults(expandedjobs)
-        
-        # Resolve "let"-Keys
-        config.resolveMacros(expandedjobs)
-
-        # Resolve libs/Manifests
-        config.resolveLibs(expandedjobs)
-
-        # To see fully expanded config:
-        #console.info(pprint.pformat(config.get(".")))
-
-        # Do some config schema checking
-        config.checkSchema(expandedjobs, checkJobTypes=True)
-
-        # Clean-up config
-        config.cleanUpJobs(expandedjobs)
+    # Include system defaults
+    config.includeSystemDefaults(expandedjobs)
+    
+    # Resolve "let"-Keys
+    config.resolveMacros(expandedjobs)
 
-        # Reset console level
-        console.setLevel(level)
-        console.resetFilter()
+    # Resolve libs/Manifests
+    config.resolveLibs(expandedjobs)
 
-        # Processing jobs...
-        for job in expandedjobs:
-            console.head("Executing: %s" % job.name, True)
-            if options.config_verbose:
-                console.setLevel("debug")
-                console.debug("Expanded job config:")
-                console.debug(pprint.pformat(config.getJob(job).getData()))
-                console.setLevel(level)
+    # To see fully expanded config:
+    #console.info(pprint.pformat(config.get(".")))
 
-            ctx = context.copy()
-            ctx['jobconf'] = config.getJob(job)
-            Context.jobconf = ctx['jobconf']
+    # Do some config schema checking
+    config.checkSchema(expandedjobs, checkJobTypes=True)
 
-            generatorObj = Generator(ctx)
-            generatorObj.run()
+    # Clean-up config
+    config.cleanUpJobs(expandedjobs)
 
-    # Daemon mode
-    else: 
-        from generator.runtime.Generatord import Generatord
-        console.head("Executing: Daemon Mode", True)
-        generatord = Generatord(context)
-        console.info("Opening port %s on %s, serving in background..." % (generatord.servAddr[1], 
-            generatord.servAddr[0] if generatord.servAddr[0] else 'localhost')
-        )
-        generatord.serve()
+    return config, expandedjobs, includeTree.nodes()
 
 
 if __name__ == '__main__':
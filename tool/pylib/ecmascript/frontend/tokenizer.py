@@ -25,6 +25,12 @@
 # literals, such as strings, comments and regular expression literals, and to
 # turn all tokens into dicts suitable for the consumption of the treegenerator
 # parser module.
+#
+# There are two implementations of parseStream() that produce the same tokens:
+# parseStreamBatch() scans a whole file in one loop, with strings, comments
+# and regexps handled in-line (the default), parseStreamIter() is the original
+# one that pulls Scanner.Token objects through a coroutine and an LQueue. See
+# tool/admin/bin/bench-tokenizer.py for a comparison of both.
 ##
 
 import sys, re
@@ -58,6 +64,274 @@ def scanner_slice(self, a, b):
 ##
 # Interface function
 def parseStream(content, uniqueId=""):
+    if batchMode:
+        return parseStreamBatch(content, uniqueId)
+    else:
+        return parseStreamIter(content, uniqueId)
+
+batchMode = True
+
+
+##
+# Batch scanner: turns the low-level lexems of a whole file into tokens, with
+# no intermediate objects. Lexems are plain tuples (name, value, spos, len).
+#
+# It mimics the coroutine-based scanning of parseStreamIter() exactly, down
+# to the line and column numbers (which don't account for line breaks in
+# strings) and to the lexems peeked by restLineIsEmpty(), which are scanned
+# in the normal mode.
+class BatchScanner(object):
+
+    patt      = Scanner.Scanner.patt
+    stringEnd = Scanner.Scanner.stringEnd
+
+    def __init__(self, content):
+        self.content = content
+        self.pos     = 0
+        self.pending = []     # lexems scanned ahead
+        self.eof     = False
+
+    ##
+    # the next lexem, scanned in the mode for delimiter (see Scanner.Scanner)
+    def next(self, delimiter=None):
+        if self.pending:
+            return self.pending.pop(0)
+        content = self.content
+        pos     = self.pos
+        if pos >= len(content):
+            if self.eof:
+                raise StopIteration
+            self.eof = True
+            return ('eof', '', pos, 0)
+        if delimiter:
+            mo = self.stringEnd[delimiter].search(content, pos)
+        else:
+            mo = self.patt.match(content, pos)
+        if not mo:
+            raise SyntaxError("Unable to tokenize text starting with: \"%s\"" % content[pos:pos+200])
+        if mo.start() != pos:
+            raise RuntimeError("(This should never happen). There is a scan gap AFTER:\n \"%s\"\nAND BEFORE:\n \"%s\"" % (content[pos-100:pos], content[mo.start():mo.start()+100]))
+        self.pos = mo.end()
+        return (mo.lastgroup, mo.group(), pos, self.pos - pos)
+
+    ##
+    # position and matcher to continue scanning normal lexems with
+    def resume(self):
+        return self.pos, self.patt.scanner(self.content, self.pos).match
+
+    def peek(self, n=1):
+        lexems = []
+        try:
+            while len(lexems) < n:
+                lexems.append(self.next())
+        except StopIteration:
+            pass
+        self.pending[0:0] = lexems
+        return lexems
+
+    def string(self, quote):
+        result = []
+        while True:
+            part = self.next(quote)[1]
+            result.append(part)
+            if not Scanner.is_last_escaped(part):  # be aware of escaped quotes
+                break
+        return u"".join(result)
+
+    def regexp(self):
+        # leading '/' is already consumed
+        result = []
+        while True:
+            value = self.next()[1]
+            result.append(value)
+            if value.endswith("/"):   # check for end of regexp
+                rexp = "".join(result)
+                # make sure "/" is not escaped, ie. preceded by an odd number of "\"
+                if not Scanner.is_last_escaped(rexp):
+                    break
+        # regexp modifiers
+        if self.peek()[0][0] == "ident":
+            rexp += self.next()[1]
+        return rexp
+
+    def commentI(self):
+        return self.next('\n')[1]
+
+    def commentM(self):
+        result = []
+        while True:
+            part = self.next(r'\*/')[1]
+            result.append(part)
+            if not Scanner.is_last_escaped(part):
+                break
+        return u"".join(result)
+
+    def restLineIsEmpty(self):
+        lexems = self.peek(2)
+        return lexems[0][0] == 'nl' or (lexems[0][0] == 'white' and lexems[1][0] == 'nl')
+
+
+# {value: (type, detail)} of operators, keywords and builtins, in the order of
+# precedence of parseStreamIter()
+_wordTokens = dict((word, ('builtin', '')) for word in lang.BUILTIN)
+_wordTokens.update((word, ('reserved', detail)) for word, detail in lang.RESERVED.items())
+_wordTokens.update((word, ('token', detail)) for word, detail in lang.TOKENS.items())
+_numberDetails = {'float' : 'float', 'hexnum' : 'int', 'number' : 'int'}
+_regexpPrecursors = ('RP', 'RB')  # ")", "]": a "/" after them is a division
+
+
+def parseStreamBatch(content, uniqueId=""):
+    tokens   = []
+    append   = tokens.append
+    line     = 1
+    sol      = 0  # index of start-of-line
+    scanner  = BatchScanner(content)
+    pending  = scanner.pending
+    pos, match = scanner.resume()
+    wordTokens = _wordTokens
+    while True:
+        # normal lexems are scanned right here; the scanner takes over for
+        # the rest (pending lexems, strings, comments, ..., end of file)
+        mo = None if pending else match()
+        if mo is not None:
+            name = mo.lastgroup
+            spos = pos
+            pos  = mo.end()
+            if name == 'white':
+                continue
+            value  = mo.group()
+            length = pos - spos
+        else:
+            scanner.pos = pos
+            try:
+                name, value, spos, length = scanner.next()
+            except StopIteration:
+                break
+            pos, match = scanner.resume()
+            # white space
+            if name == 'white':
+                continue
+
+        token = {
+            "source" : value,
+            "detail" : "",
+            "line"   : line,
+            "column" : spos - sol + 1,
+            "id"     : uniqueId
+            }
+
+        # line break
+        if name == 'nl':
+            token['type']   = 'eol'
+            token['source'] = ''
+            line += 1
+            sol  = spos + length
+
+        # numbers
+        elif name in _numberDetails:
+            token['type']   = 'number'
+            token['detail'] = _numberDetails[name]
+
+        # end of file
+        elif name == 'eof':
+            token['type'] = 'eof'
+
+        # string
+        elif value == '"' or value == "'":
+            token['type']   = 'string'
+            token['detail'] = 'doublequotes' if value == '"' else 'singlequotes'
+            try:
+                scanner.pos = pos
+                source = scanner.string(value)
+                pos, match = scanner.resume()
+            except SyntaxException, e:
+                desc = e.args[0] + " starting with %r..." % (value + e.args[1])[:20]
+                raiseSyntaxException(token, desc)
+            token['source'] = source[:-1]
+            # adapt line number -- this assumes multi-line strings are not generally out
+            line += source.count("\n")
+
+        # division, div-assignment, regexp
+        elif value == '/' or value == '/=':
+            if (not tokens or (
+                    tokens[-1]['type']   != 'number' and
+                    tokens[-1]['detail'] not in _regexpPrecursors and
+                    tokens[-1]['type']   != 'name')):
+                token['type']   = 'regexp'
+                scanner.pos = pos
+                token['source'] = value + scanner.regexp()
+                pos, match = scanner.resume()
+            else:
+                token['type']   = 'token'
+                token['detail'] = lang.TOKENS[value]
+
+        # comment, inline
+        elif value == '//':
+            if not tokens or not is_last_escaped_token(tokens):
+                token['type']   = 'comment'
+                scanner.pos = pos
+                token['source'] = value + scanner.commentI()
+                pos, match = scanner.resume()
+                token['begin']  = not hasLeadingContent(tokens)
+                token['end']    = True
+                token['connection'] = "before" if token['begin'] else "after"
+                token['multiline']  = False
+                token['detail'] = 'inline'
+            else:
+                print >> sys.stderr, "Inline comment out of context"
+
+        # comment, multiline
+        elif value == '/*':
+            if not tokens or not is_last_escaped_token(tokens):
+                token['type'] = 'comment'
+                scanner.pos = pos
+                try:
+                    commnt = scanner.commentM()
+                except SyntaxException, e:
+                    desc = e.args[0] + " starting with \"%r...\"" % (value + e.args[1])[:20]
+                    raiseSyntaxException(token, desc)
+                commnt = alignMultiLines(commnt, token['column'])
+                token['source'] = value + commnt
+                token['detail'] = comment.getFormat(token['source'])
+                token['begin']  = not hasLeadingContent(tokens)
+                token['end']    = scanner.restLineIsEmpty()
+                pos, match = scanner.resume()
+                if token['begin']:
+                    token['source'] = comment.outdent(token['source'], 0)
+                token['source'] = comment.correct(token['source'])
+                if token['end'] and not token['begin']:
+                    token['connection'] = "after"
+                else:
+                    token['connection'] = "before"
+                # adapt line number
+                linecnt = token['source'].count("\n")
+                line += linecnt
+                token['multiline'] = linecnt > 0
+            else:
+                print >> sys.stderr, "Multiline comment out of context"
+
+        # operators, keywords, builtins
+        elif value in wordTokens:
+            token['type'], token['detail'] = wordTokens[value]
+
+        # identifier
+        elif value[:2] == "__":
+            token['type']   = 'name'
+            token['detail'] = 'private'
+        elif value[0] == "_":
+            token['type']   = 'name'
+            token['detail'] = 'protected'
+        else:
+            token['type']   = 'name'
+            token['detail'] = 'public'
+
+        append(token)
+    return tokens
+
+
+##
+# Coroutine-based implementation of parseStream()
+def parseStreamIter(content, uniqueId=""):
     tokens = []
     line = column = 1
     sol = 0  # index of start-of-line
@@ -62,40 +62,110 @@ class NodeAccessException (Exception):
         self.node = node
 
 
+##
+# Nodes are kept small, as there are lots of them (a million for the framework
+# classes), and whole trees go into the cache:
+#  - __slots__ instead of a per-node __dict__,
+#  - interned type names,
+#  - "line" and "column", which nearly every node has, are stored inline; all
+#    other attributes go into a dict that only exists when needed,
+#  - pickling uses a compact tuple state and leaves out the parent links,
+#    which are restored from the children.
+# .attributes is still available as a dict, but is a copy if the node has
+# a line or column.
+
 class Node(object):
 
+    __slots__ = ('type', 'parent', 'children', 'dep', '_line', '_column', '_attrs')
+
     def __init__ (self, ntype):
-        self.type = ntype
+        self.type = intern(ntype) if type(ntype) is str else ntype
         self.parent = None
         self.children = []
-        self.attributes = {}
         self.dep = None # a potential DependencyItem()
+        self._line = None
+        self._column = None
+        self._attrs = None  # {key: value} of the other attributes
 
     def __str__(self):
         return nodeToXmlStringNR(self)
 
 
+    ##
+    # pickling: provide state
+    def __getstate__(self):
+        return (self.type, self.children or None, self._attrs, self._line, self._column, self.dep)
+
+
+    ##
+    # unpickling: update state
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # pickled by the former __dict__ based Node
+            attrs = dict(state.get('attributes', {}))
+            state = (state['type'], state['children'], attrs or None, attrs.pop('line', None),
+                     attrs.pop('column', None), state.get('dep'))
+        ntype, children, self._attrs, self._line, self._column, self.dep = state
+        self.type = intern(ntype) if type(ntype) is str else ntype
+        self.parent = None
+        self.children = children or []
+        for child in self.children:
+            child.parent = self
+
+
+    ##
+    # shallow copy, sharing children and attributes (like a copy of the former
+    # __dict__ based Node)
+    def __copy__(self):
+        clone_ = Node.__new__(Node)
+        clone_.type, clone_.parent, clone_.children, clone_.dep = self.type, self.parent, self.children, self.dep
+        clone_._line, clone_._column, clone_._attrs = self._line, self._column, self._attrs
+        return clone_
+
+
+    def _getAttributes(self):
+        if self._line is None and self._column is None:
+            if self._attrs is None:
+                self._attrs = {}
+            return self._attrs
+        attributes = dict(self._attrs) if self._attrs else {}
+        if self._line is not None:
+            attributes["line"] = self._line
+        if self._column is not None:
+            attributes["column"] = self._column
+        return attributes
+
+    attributes = property(_getAttributes)
+
+
     def hasAttributes(self):
         #return hasattr(self, "attributes")
         # ApiLoader._isNodeIdentical() needs this len() check
         # TODO: remove commented calls to hasAttributes() and hasattr(self,attributes)
-        return len(self.attributes)
+        return (len(self._attrs) if self._attrs else 0) + (self._line is not None) + (self._column is not None)
 
     def set(self, key, value):
         """Sets an attribute"""
         if not isinstance(value, (basestring, int, long, float, complex, bool)):
             raise NodeAccessException("'value' is no string or number: " + str(value), self)
-        #if not self.hasAttributes():
-        if False:
-            self.attributes = {}
-        self.attributes[key] = value
+        if key == "line":
+            self._line = value
+        elif key == "column":
+            self._column = value
+        elif self._attrs is None:
+            self._attrs = {key: value}
+        else:
+            self._attrs[key] = value
         return self
 
     def get(self, key, mandatory = True):
-        value = None
-        #if hasattr(self, "attributes") and key in self.attributes:
-        if key in self.attributes:
-            value = self.attributes[key]
+        if key == "line":
+            value = self._line
+        elif key == "column":
+            value = self._column
+        elif self._attrs:
+            value = self._attrs.get(key)
+        else:
+            value = None
 
         if value != None:
             return value
@@ -103,18 +173,19 @@ class Node(object):
             raise NodeAccessException("Node " + self.type + " has no attribute " + key, self)
 
     def remove(self, key):
-        if not key in self.attributes:
-            return
-
-        del self.attributes[key]
-        if len(self.attributes) == 0:
-            del self.attributes
+        if key == "line":
+            self._line = None
+        elif key == "column":
+            self._column = None
+        elif self._attrs and key in self._attrs:
+            del self._attrs[key]
+            if len(self._attrs) == 0:
+                self._attrs = None
 
     def clone(self):
         clone_ = copy.copy(self)
-        #if hasattr(self, "attributes"):
-        if True:
-            clone_.attributes = copy.copy(self.attributes)
+        if self._attrs is not None:
+            clone_._attrs = copy.copy(self._attrs)
         return clone_
 
     def hasParent(self):
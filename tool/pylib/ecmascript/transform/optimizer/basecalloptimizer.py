@@ -24,6 +24,7 @@
 import re, sys, types
 
 from ecmascript.frontend import tree, treeutil
+from ecmascript.transform.optimizer import visitor
 
 ##
 # Run through all the qx.*.define nodes of a tree. This will cover multiple
@@ -97,25 +98,8 @@ def optimizeConstruct(node, superClass, methodName, classDefNodes):
         if not (complete and varName == "this.base"):
             return 0
 
-        call = node.parent.parent
-
-        try:
-            firstArgName = treeutil.selectNode(call, "params/1/identifier/@name")
-        except tree.NodeAccessException:
+        if patchCall(node.parent.parent, superClass, methodName) is None:
             return 0
-
-        if firstArgName != "arguments":
-            return 0
-
-        # "construct"
-        if methodName == "construct":
-            newCall = treeutil.compileString("%s.call()" % superClass)
-        # "member"
-        else:
-            newCall = treeutil.compileString("%s.prototype.%s.call()" % (superClass, methodName))
-        newCall.replaceChild(newCall.getChild("params"), call.getChild("params")) # replace with old arglist
-        treeutil.selectNode(newCall, "params/1/identifier").set("name", "this")   # arguments -> this
-        call.parent.replaceChild(call, newCall)
         patchCount += 1
 
     # Handle Children
@@ -126,6 +110,89 @@ def optimizeConstruct(node, superClass, methodName, classDefNodes):
     return patchCount
 
 
+##
+# Replace a this.base(arguments, ...) call with a direct call of the super
+# class's method; returns the new call node, or None if the call is not of
+# this form
+
+def patchCall(call, superClass, methodName):
+    try:
+        firstArgName = treeutil.selectNode(call, "params/1/identifier/@name")
+    except tree.NodeAccessException:
+        return None
+
+    if firstArgName != "arguments":
+        return None
+
+    # "construct"
+    if methodName == "construct":
+        newCall = treeutil.compileString("%s.call()" % superClass)
+    # "member"
+    else:
+        newCall = treeutil.compileString("%s.prototype.%s.call()" % (superClass, methodName))
+    newCall.replaceChild(newCall.getChild("params"), call.getChild("params")) # replace with old arglist
+    treeutil.selectNode(newCall, "params/1/identifier").set("name", "this")   # arguments -> this
+    call.parent.replaceChild(call, newCall)
+    return newCall
+
+
+DefineNames = set(x + ".define" for x in treeutil.DefiningClasses)
+
+##
+# patch() as a visitor.Visitor. Methods are registered when their qx.*.define
+# is visited; a this.base() call is patched for the nearest method it is in,
+# unless there is a (nested) qx.*.define in between.
+
+class BaseCallVisitor(visitor.Visitor):
+
+    name = "basecalls"
+
+    def __init__(self):
+        self.patchCount = 0
+        self._defines   = set()  # ids of qx.*.define call nodes
+        self._methods   = {}     # {id(method node): (super class, method name)}
+
+    def visit_call(self, node):
+        operand = node.getChild("operand", False)
+        variable = operand.getChild("variable", False) if operand else None
+        if not variable:
+            return
+        try:
+            varName, complete = treeutil.assembleVariable(variable)
+        except tree.NodeAccessException:
+            return
+
+        if varName in DefineNames:
+            self._defines.add(id(node))
+            self._addMethods(node)
+
+        elif complete and varName == "this.base":
+            ancestor = node.parent
+            while ancestor is not None and id(ancestor) not in self._defines:
+                if id(ancestor) in self._methods:
+                    superClass, methodName = self._methods[id(ancestor)]
+                    newCall = patchCall(node, superClass, methodName)
+                    if newCall is not None:
+                        self.patchCount += 1
+                    return newCall
+                ancestor = ancestor.parent
+
+    def _addMethods(self, classDefine):
+        try:
+            classMap = treeutil.getClassMap(classDefine)
+        except tree.NodeAccessException:
+            return
+        if "extend" not in classMap or classMap["extend"].type != "variable":
+            return
+        superClass = treeutil.assembleVariable(classMap["extend"])[0]
+        if "construct" in classMap:
+            self._methods[id(classMap["construct"])] = (superClass, "construct")
+        members = classMap.get("members", {})
+        assert isinstance(members, types.DictType)
+        for methodName, methodNode in members.items():
+            self._methods[id(methodNode)] = (superClass, methodName)
+
+
 if __name__ == "__main__":
     cls = """qx.Class.define("qx.Car", {
       extend: qx.core.Object,
@@ -22,8 +22,13 @@
 import os, sys, re, types
 from ecmascript.frontend import treeutil
 
+##
+# Remove the features of classObj that are no longer referenced from tree.
+# Returns the ids of the classes whose features have lost references by that.
+#
 def patch(tree, classObj, featureMap):
     
+    touched = set()
     feature_names = featureMap[classObj.id]
     # get class map
     qxDefine = treeutil.findQxDefine(tree)
@@ -44,13 +49,16 @@ def patch(tree, classObj, featureMap):
                     if feature in feature_names:
                         del featureMap[classObj.id][feature]
                     # decrease the ref counts of the contained dependees
-                    decrementFromCode(classObj, node, featureMap)
+                    touched.update(decrementFromCode(classObj, node, featureMap))
+    return touched
 
 ##
 # Use this if a syntax tree is being removed from the build, to decrement its
-# dependencies.
+# dependencies. Returns the ids of the classes whose features have been
+# decremented.
 #
 def decrementFromCode(classObj, node, featureMap):
+    touched = set()
     deps = []
     classObj._analyzeClassDepsNode(node, deps, inLoadContext=False)
         # TODO: this is expensive (re-calculating deps)!
@@ -61,6 +69,8 @@ def decrementFromCode(classObj, node, featureMap):
         if depItem.name in featureMap and depItem.attribute in featureMap[depItem.name]:
             depFeature = featureMap[depItem.name][depItem.attribute]
             res = depFeature.decref(depItem.requestor, depItem.line)  # decrease reference count
+            touched.add(depItem.name)
             if not res:
                 #print "Warning could not remove '%s:%s' from '%s:%s'" % (depItem.requestor, depItem.line, depItem.name, depItem.attribute)
                 pass
+    return touched
@@ -22,12 +22,12 @@
 
 import os, sys, re, types
 from misc.util import convert
+from ecmascript.transform.optimizer import visitor
 
-#names = {}  # names = { "<classId>:<private>" : "<repl>", ...}
+#names = {}  # names = { "<private>" : "<repl>", ...}
 #used = {}   # used  = { "<private>" : [ "<classId>", ...], ...} -- only maintained for debug() function, not relevant for optimization
 
-#privatesCacheId = "privates-%s" % self._context['config']._fname  # use path to main config file for context
-privatesCacheId = "privates"  # use a site-wide privates db
+# the site-wide privates db is kept by generator.runtime.Cache, see privates()
 
 #def load(data):
 #    global names
@@ -56,13 +56,13 @@ def debug():
             print
 
 
-def patch(tree, id, _globalPrivs=None):
+def patch(tree, _globalPrivs=None):
     if _globalPrivs == None:
         globalPrivs = names
     else:
         globalPrivs = _globalPrivs
     # Look for privates
-    privates = lookup(id, tree, {}, globalPrivs)
+    privates = allocate(lookup(tree, []), globalPrivs)
     
     # Fast path. Return if no privates defined
     if len(privates) == 0:
@@ -73,19 +73,45 @@ def patch(tree, id, _globalPrivs=None):
     update(tree, privates)
     
     
-def crypt(id, name, privmap):
-    combined = "%s:%s" % (id, name)
-    if combined in privmap:
-        return privmap[combined]
+##
+# Map the private names of a class to their replacements, in the given order.
+# globalPrivs is either the privates map, or an object with an allocate()
+# method that does the mapping (see generator.runtime.PrivatesDb).
+#
+# There is a single namespace for the privates of all classes: a private name
+# gets the same replacement in every class that uses it, so code referring to
+# the privates of another class (e.g. in a mixin) still works.
+def allocate(names, globalPrivs):
+    if hasattr(globalPrivs, "allocate"):
+        return globalPrivs.allocate(names)
+    privates = {}
+    for name in names:
+        privates[name] = crypt(name, globalPrivs)
+    return privates
+
+
+def crypt(name, privmap):
+    if name in privmap:
+        return privmap[name]
 
     repl = "__%s" % convert(len(privmap))
-    privmap[combined] = repl
+    privmap[name] = repl
 
     return repl
         
     
-def lookup(id, node, privates, globalPrivs):
-    # privates = { "<private>" : "<repl>", ... }
+def lookup(node, names):
+    # names = [ "<private>", ... ], in order of appearance
+    lookupNode(node, names)
+
+    if node.hasChildren():
+        for child in node.children:
+            lookup(child, names)
+        
+    return names
+
+
+def lookupNode(node, names):
     name = None
     
     if node.type == "definition":
@@ -103,26 +129,24 @@ def lookup(id, node, privates, globalPrivs):
                 if last.type == "identifier":
                     name = last.get("name")
         
-    if name and name.startswith("__") and not name in privates:
-        privates[name] = crypt(id, name, globalPrivs)
+    if name and name.startswith("__") and not name in names:
+        names.append(name)
         
         #if not name in used:
         #    used[name] = [id]
         #elif not id in used[name]:
         #    used[name].append(id)
 
-    if node.hasChildren():
-        for child in node.children:
-            lookup(id, child, privates, globalPrivs)
-        
-    return privates
-
 
 def update(node, privates):
     if node.hasChildren():
         for child in node.children:
             update(child, privates)
             
+    updateNode(node, privates)
+
+
+def updateNode(node, privates):
     name = None
             
     if node.type == "definition":
@@ -166,3 +190,51 @@ def update(node, privates):
     
     elif node.type == "constant":
         name = node.set("value", repl)    
+
+
+##
+# lookup() as a visitor.Visitor; collects the private names in 'names'
+
+class LookupVisitor(visitor.Visitor):
+
+    name = "privates"
+
+    def __init__(self):
+        self.names = []
+
+    def visit_definition(self, node):
+        lookupNode(node, self.names)
+
+    visit_keyvalue = visit_assignment = visit_definition
+
+
+##
+# update() as a visitor.Visitor. Other visitors of the same walk might look at
+# the name assigned to in an 'assignment' node (see stringoptimizer.check()),
+# so that name is replaced when the assignment is visited.
+
+class UpdateVisitor(visitor.Visitor):
+
+    name = "privates"
+
+    def __init__(self, privates):
+        self._privates = privates
+        self._updated  = set()  # ids of identifiers already replaced
+
+    def visit_assignment(self, node):
+        left = node.getChild("left", False)
+        var  = left.getChild("variable", False) if left else None
+        if var and var.hasChildren():
+            last = var.getLastChild()
+            if last.type == "identifier":
+                updateNode(last, self._privates)
+                self._updated.add(id(last))
+
+    def visit_identifier(self, node):
+        if id(node) not in self._updated:
+            updateNode(node, self._privates)
+
+    def visit_definition(self, node):
+        updateNode(node, self._privates)
+
+    visit_keyvalue = visit_constant = visit_definition
@@ -21,53 +21,89 @@
 ################################################################################
 
 from ecmascript.frontend import tree, treeutil
+from ecmascript.transform.optimizer import visitor
 
 def search(node, verbose=False):
     return search_loop(node, {}, verbose)
 
 
 def search_loop(node, stringMap={}, verbose=False):
-    if node.type == "call":
-        oper = node.getChild("operand", False)
+    if node.type == "call" and isLocaleDefine(node):
+        return stringMap
 
-        if oper:
-            variable = oper.getChild("variable", False)
+    if node.type == "constant" and node.get("constantType") == "string":
+        count(node, stringMap, verbose)
 
-            if variable:
-                try:
-                    variableName = (treeutil.assembleVariable(variable))[0]
-                except tree.NodeAccessException:
-                    variableName = None
+    if check(node, verbose):
+        for child in node.children:
+            search_loop(child, stringMap, verbose)
 
-                # Don't extract from locales
-                if variableName == "qx.locale.Locale.define" or variableName == "qx.Locale.define":
-                    return stringMap
+    return stringMap
 
-    if node.type == "constant" and node.get("constantType") == "string":
-        if verbose:
-            pvalue = node.get("value")
-            if isinstance(pvalue, unicode):
-                pvalue = pvalue.encode("utf-8")
-            print "      - Found: '%s'" % pvalue
 
-        if node.get("detail") == "singlequotes":
-            quote = "'"
-        elif node.get("detail") == "doublequotes":
-            quote = '"'
+# Don't extract from locales
+def isLocaleDefine(node):
+    oper = node.getChild("operand", False)
 
-        value = "%s%s%s" % (quote, node.get("value"), quote)
+    if oper:
+        variable = oper.getChild("variable", False)
 
-        if value in stringMap:
-            stringMap[value] += 1
-        else:
-            stringMap[value] = 1
+        if variable:
+            try:
+                variableName = (treeutil.assembleVariable(variable))[0]
+            except tree.NodeAccessException:
+                variableName = None
 
-    if check(node, verbose):
-        for child in node.children:
-            search_loop(child, stringMap, verbose)
+            if variableName == "qx.locale.Locale.define" or variableName == "qx.Locale.define":
+                return True
 
-    return stringMap
+    return False
+
+
+def count(node, stringMap, verbose=False):
+    if verbose:
+        pvalue = node.get("value")
+        if isinstance(pvalue, unicode):
+            pvalue = pvalue.encode("utf-8")
+        print "      - Found: '%s'" % pvalue
+
+    if node.get("detail") == "singlequotes":
+        quote = "'"
+    elif node.get("detail") == "doublequotes":
+        quote = '"'
+
+    value = "%s%s%s" % (quote, node.get("value"), quote)
+
+    if value in stringMap:
+        stringMap[value] += 1
+    else:
+        stringMap[value] = 1
+
+
+##
+# search() as a visitor.Visitor; counts the strings in 'stringMap'
+
+class SearchVisitor(visitor.Visitor):
+
+    name = "strings"
+
+    def __init__(self):
+        self.stringMap = {}
+
+    def visit_call(self, node):
+        if isLocaleDefine(node) or not check(node, False):
+            return False
+
+    def visit_constant(self, node):
+        if node.get("constantType") == "string":
+            count(node, self.stringMap)
+        return False  # no children
+
+    def visit_assignment(self, node):
+        if not check(node, False):
+            return False
 
+    visit_keyvalue = visit_assignment
 
 
 def check(node, verbose=True):
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Runs several optimizers over a syntax tree in a single traversal.
+#
+# An optimizer taking part provides a Visitor, with a visit_<type>(node)
+# method for each node type it is interested in. walk() visits the nodes
+# parents first, and calls the handlers of all visitors for a node in the
+# order the visitors are given. A handler returns
+#   - None, to go on as usual,
+#   - False, to not descend into the node's children (for this visitor only),
+#   - a Node, which it has put into the tree in place of the node; the
+#     remaining handlers and the traversal go on with that node.
+#
+# The time spent in each walk() (and in optimizer runs wrapped with timed())
+# is summed up in 'stats', by pass name.
+##
+
+import time
+
+stats = {}  # {pass name: [runs, seconds]}
+
+
+class Visitor(object):
+
+    name = "visitor"  # name of the optimization, for the stats
+
+    def nodeTypes(self):
+        return [name[6:] for name in dir(self) if name.startswith("visit_")]
+
+
+##
+# Traverse the tree once, for all the visitors
+
+def walk(node, visitors):
+    if not visitors:
+        return
+    handlers = {}  # {node type: [(visitor bit, handler)]}
+    for pos, visitor in enumerate(visitors):
+        for ntype in visitor.nodeTypes():
+            handlers.setdefault(ntype, []).append((1 << pos, getattr(visitor, "visit_" + ntype)))
+    start = time.time()
+    stack = [(iter((node,)), (1 << len(visitors)) - 1)]  # (siblings to visit, active visitor bits)
+    while stack:
+        siblings, active = stack[-1]
+        for node in siblings:
+            nodeActive = active
+            if node.type in handlers:
+                for bit, handler in handlers[node.type]:
+                    if nodeActive & bit:
+                        res = handler(node)
+                        if res is False:
+                            nodeActive &= ~bit
+                        elif res is not None:
+                            node = res
+            if node.children and nodeActive:
+                stack.append((iter(node.children[:]), nodeActive))
+                break
+        else:
+            stack.pop()
+    _count("+".join(visitor.name for visitor in visitors), start)
+
+
+##
+# Run an optimizer that does its own traversal, counting its time under name
+
+def timed(name, func, *args):
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        _count(name, start)
+
+
+def _count(name, start):
+    entry = stats.setdefault(name, [0, 0.0])
+    entry[0] += 1
+    entry[1] += time.time() - start
+
+
+def statsString():
+    return "; ".join("%s: %d runs, %.2fs" % (name, runs, secs)
+                     for name, (runs, secs) in sorted(stats.items()))
@@ -28,7 +28,7 @@ import functools, codecs, operator, time
 import graph
 
 from misc                            import filetool, textutil, util, Path, json, copytool
-from ecmascript.transform.optimizer  import privateoptimizer
+from ecmascript.transform.optimizer  import privateoptimizer, visitor
 from misc.ExtMap                     import ExtMap
 from generator.code.Class            import Class, CompileOptions
 from generator.code.DependencyLoader import DependencyLoader
@@ -62,6 +62,7 @@ class Generator(object):
         self._settings  = {}
         self.approot    = None
         self._classesObj= {} # {'cid':generator.code.Class}
+        self._depLoader = None
 
         if 'cache' in context:  # in case the Generator want to use a common cache object
             self._cache = context['cache']
@@ -73,6 +74,11 @@ class Generator(object):
                 'console' : context['console'],
                 'cache/downloads' : self._job.get("cache/downloads", cache_path + "/downloads"),
                 'cache/invalidate-on-tool-change' : self._job.get('cache/invalidate-on-tool-change', False),
+                'cache/store' : self._job.get('cache/store', 'files'),
+                'cache/store-options' : self._job.get('cache/store-options', {}),
+                'cache/memory' : self._job.get('cache/memory', {}),
+                'cache/invalidate-by' : self._job.get('cache/invalidate-by', 'mtime'),
+                'cache/remote' : self._job.get('cache/remote', None),
             })
             context['cache'] = self._cache
 
@@ -415,6 +421,9 @@ class Generator(object):
              self._translations,
              self._libraries)     = self.scanLibrary(config.get("library", []))
 
+            # classes kept in memory from an earlier job still refer to its runtime infos
+            for clazz in self._classesObj.values():
+                clazz.context.update(console=self._console, cache=self._cache, jobconf=self._job)
 
             # create tool chain instances
             self._locale         = Locale(self._context, self._classesObj, self._translations, self._cache, self._console, )
@@ -514,6 +523,15 @@ class Generator(object):
             # Processing all combinations of variants
             environData = getVariants("environment")   # e.g. {'qx.debug':false, 'qx.aspects':[true,false]}
             variantSets  = util.computeCombinations(environData) # e.g. [{'qx.debug':'on','qx.aspects':'on'},...]
+
+            # Variant sets that select the same code in all the classes of the
+            # build (as none of them uses a key the sets differ in) form a group,
+            # and share the class list and feature map of its first set, and the
+            # compiled code (see CodeGenerator.compileClasses()). Everything per
+            # class (trees, deps, compiled classes) is shared anyway, by the
+            # projection of the variant set on the class' keys.
+            variantGroups = []  # [(group number, variants, classes, featureMap)]
+
             for variantSetNum, variantset in enumerate(variantSets):
 
                 # some console output
@@ -539,17 +557,31 @@ class Generator(object):
                     ):
                     script.variants = {}
 
-                # get current class list
-                script.classes = computeClassList(includeWithDeps, excludeWithDeps, 
-                                   includeNoDeps, script.variants, script=script, verifyDeps=True)
-                # keep the list of class objects in sync
-                script.classesObj = [self._classesObj[id] for id in script.classes]
-
-                if "statics" in script.optimize:
-                    featureMap = self._depLoader.registerDependeeFeatures(script.classesObj, script.variants, script.buildType)
-                    script._featureMap = featureMap
+                for group, variants, classes, featureMap in variantGroups:
+                    if self._depLoader.variantsAgree(classes, variants, script.variants):
+                        self._console.info("Re-using classes of variant set %s" % (group+1))
+                        script.variantsGroup = group
+                        script.classes       = classes[:]
+                        script.classesObj    = [self._classesObj[id] for id in script.classes]
+                        script._featureMap   = DependencyLoader.copyFeatureMap(featureMap)
+                        break
                 else:
-                    script._featureMap = {}
+                    # get current class list
+                    script.classes = computeClassList(includeWithDeps, excludeWithDeps, 
+                                       includeNoDeps, script.variants, script=script, verifyDeps=True)
+                    # keep the list of class objects in sync
+                    script.classesObj = [self._classesObj[id] for id in script.classes]
+
+                    if "statics" in script.optimize:
+                        featureMap = self._depLoader.registerDependeeFeatures(script.classesObj, script.variants, script.buildType)
+                        script._featureMap = featureMap
+                    else:
+                        script._featureMap = {}
+
+                    if len(variantSets) > 1:
+                        script.variantsGroup = variantSetNum
+                        variantGroups.append((variantSetNum, script.variants, script.classes[:],
+                                              DependencyLoader.copyFeatureMap(script._featureMap)))
 
                 # prepare 'script' object
                 if set(("compile", "log")).intersection(jobTriggers):
@@ -573,6 +605,15 @@ class Generator(object):
                     self.runLogUnusedClasses(script)
                     self.runLogResources(script)
                 
+        if self._depLoader:
+            self._depLoader.flush()
+        self._cache.flush()
+        self._console.debug("Memory cache: %s" % self._cache.memoryStats())
+        if self._cache.remoteStats():
+            self._console.debug("Shared cache: %s" % self._cache.remoteStats())
+        if visitor.stats:
+            self._console.debug("Optimizer passes: %s" % visitor.statsString())
+
         elapsedsecs = time.time() - starttime
         self._console.info("Done (%dm%05.2f)" % (int(elapsedsecs/60), elapsedsecs % 60))
 
@@ -1358,7 +1399,7 @@ class Generator(object):
                     self._console.info("Existing directory: %s" % isDir)
                     if isDir:
                         self._console.info("Cache file revision: %d" % self._cache.getCacheFileVersion())
-                        self._console.info("Elements in cache: %d" % len(os.listdir(compDir)))
+                        self._console.info("Elements in cache: %d" % self._cache.count())
                     self._console.outdent()
                 if 'downloads' in cacheCfg:
                     downDir = self._config.absPath(cacheCfg['downloads'])
@@ -1512,6 +1553,16 @@ class Generator(object):
 
             return imgDict
 
+        ##
+        # write a generated file, unless it already has this content (so its
+        # time stamp stays, and nothing that depends on it is re-done)
+        def saveIfChanged(fname, content):
+            if os.path.isfile(fname) and filetool.read(fname) == content:
+                self._console.debug("file %s is up to date" % fname)
+            else:
+                self._console.debug("writing file %s" % fname)
+                filetool.save(fname, content)
+
         # ----------------------------------------------------------------------
 
         if not self._job.get("combine-images", False):
@@ -1522,12 +1573,13 @@ class Generator(object):
         self._imageClipper   = ImageClipping(self._console, self._cache)
 
         images = self._job.get("combine-images/images", {})
+        combinations = []  # [(image, imageId, clippedImages, combtype)]
+        specs        = []  # [(image, input, layout, combtype)], for ImageClipping.combineImages()
         for image, imgspec in images.iteritems():
             self._console.info("Creating image %s" % image)
             self._console.indent()
             imageId= getImageId(image, imgspec.get('prefix', []))
             image  = self._config.absPath(image)  # abs output path
-            config = {}
 
             # create a dict of clipped image objects - for later look-up
             clippedImages = getClippedImagesDict(imgspec)
@@ -1543,9 +1595,18 @@ class Generator(object):
 
             # get type of combined image (png, base64, ...)
             combtype = "base64" if image.endswith(".b64.json") else "extension"
-            
-            # create the combined image
-            subconfigs = self._imageClipper.combine(image, input, layout, combtype)
+
+            combinations.append((image, imageId, clippedImages, combtype))
+            specs.append((image, input, layout, combtype))
+            self._console.outdent()
+
+        # create the combined images
+        numProcs = self._job.get("run-time/num-processes", 0)
+        allSubconfigs = self._imageClipper.combineImages(specs, numProcs)
+
+        for (image, imageId, clippedImages, combtype), subconfigs in zip(combinations, allSubconfigs):
+            self._console.indent()
+            config = {}
 
             # for the meta information, go through the list of returned subconfigs (one per clipped image)
             for sub in subconfigs:
@@ -1562,8 +1623,7 @@ class Generator(object):
                 bname = bname[:ri]
             bname += '.meta'
             meta_fname = os.path.join(os.path.dirname(image), bname)
-            self._console.debug("writing meta file %s" % meta_fname)
-            filetool.save(meta_fname, json.dumps(config, ensure_ascii=False, sort_keys=True))
+            saveIfChanged(meta_fname, json.dumps(config, ensure_ascii=False, sort_keys=True))
             self._console.outdent()
 
             # handle base64 type, need to write "combined image" to file
@@ -1578,7 +1638,7 @@ class Generator(object):
                     subMap['encoding'] = sub['encoding']
                     subMap['data']     = sub['data']
                     combinedMap[subId] = subMap
-                filetool.save(image, json.dumpsCode(combinedMap))
+                saveIfChanged(image, json.dumpsCode(combinedMap))
             
         self._console.outdent()
 
@@ -1914,16 +1974,16 @@ class Generator(object):
 
         for libObj in libraryKey:
 
-            checkFile, fsTime = libObj.mostRecentlyChangedFile()
             cacheId   = "lib-%s" % libObj.manifest
             checkObj, cacheTime  = self._cache.read(cacheId, memory=True)
-            if checkObj:
+            if checkObj and getattr(checkObj, 'manifestStamp', None) == libObj.manifestStamp:
                 libObj = checkObj  # continue with cached obj
-            # need re-scan?
-            if not checkObj or cacheTime < fsTime:
-                self._console.debug("Re-scanning lib %s" % libObj.path)
-                libObj.scan(cacheTime)
+            # catch up with the file system
+            if libObj.scan():
+                self._console.debug("Re-scanned lib %s" % libObj.path)
                 self._cache.write(cacheId, libObj, memory=True)
+            if self._cache.isResident():
+                libObj.watch()
 
             namespace = libObj.getNamespace()
             namespaces.append(namespace)
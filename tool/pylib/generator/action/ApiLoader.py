@@ -64,7 +64,7 @@ class ApiLoader(object):
             self._console.error("Error in API data of class: %s" % fileId)
             data = None
         
-        self._cache.write(cacheId, data)
+        self._cache.write(cacheId, data, dependsOn=filePath)
         return data
 
 
@@ -82,6 +82,7 @@ class Locale(object):
         # else collect cldr data
         self._console.indent()
         root = os.path.join(filetool.root(), os.pardir, "data", "cldr", "main")
+        store = cldr.getStore(root)  # precompiled locale data, see cldr.compileStore()
 
         newlocales = targetLocales
         for locale in targetLocales:
@@ -99,11 +100,13 @@ class Locale(object):
             locFile = os.path.join(root, "%s.xml" % locale)
             cacheId = "locale-%s-%s" % (root, locale)
 
-            locDat, _ = self._cache.read(cacheId, locFile)
+            locDat = store.get(locale, locFile)
+            if locDat == None:
+                locDat, _ = self._cache.read(cacheId, locFile)
             if locDat == None:
                 self._console.debug("Processing locale: %s" % locale)
                 locDat = cldr.parseCldrFile(locFile)
-                self._cache.write(cacheId, locDat)
+                self._cache.write(cacheId, locDat, dependsOn=locFile)
 
             data[entry] = locDat
 
@@ -278,7 +281,7 @@ class Locale(object):
                 po, _ = self._cache.read(cacheId, path, memory=True)
                 if po == None:
                     po = polib.pofile(path)
-                    self._cache.write(cacheId, po, memory=True)
+                    self._cache.write(cacheId, po, memory=True, dependsOn=path)
                 extractTranslations(pot, po)
 
             poentries = pot.translated_entries()
@@ -141,7 +141,7 @@ class Class(Resource, MClassHints, MClassI18N, MClassDependencies, MClassCode, M
                     data = classInfo[k][0]['load']
                     print (sorted(data, key=str))
                     print "len:", len(data)
-        cache.write(self.cacheId, classInfo, memory=True)
+        cache.write(self.cacheId, classInfo, memory=True, dependsOn=self.path)
 
 
     def foo(s,t):
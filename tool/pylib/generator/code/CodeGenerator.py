@@ -22,7 +22,6 @@
 
 import os, sys, string, types, re, zlib, time
 import urllib, urlparse, optparse, pprint, copy
-import graph
 
 from generator.config.Lang      import Key
 from generator.code.Part        import Part
@@ -33,7 +32,7 @@ import generator.resource.Library # just need the .Library type
 from ecmascript.frontend        import treegenerator, treegenerator_new_ast
 from ecmascript.backend         import pretty
 from ecmascript.backend.Packer  import Packer
-from ecmascript.transform.optimizer    import privateoptimizer
+from ecmascript.transform.optimizer    import privateoptimizer, featureoptimizer, visitor
 from misc                       import filetool, json, Path, securehash as sha, util
 from misc.ExtMap                import ExtMap
 from misc.Path                  import OsPath, Uri
@@ -54,6 +53,7 @@ class CodeGenerator(object):
         self._settings     = settings
         self._locale     = locale
         self._classes = classes
+        self._compiledCode = {}  # compileClasses() results, re-used by variant sets of the same group
 
         console = console_
         cache   = cache_
@@ -400,183 +400,18 @@ class CodeGenerator(object):
             return data
 
 
-        # - _compileClassesMP stuff --------------------------------------
-
-        def _compileClassesMP(classes, compConf, log_progress, maxproc=8):
-            # experimental
-            # improve by incorporating cache handling, as done in getCompiled()
-            # hangs on Windows in the last call to reap_processes from the main loop
-
-            def reap_processes(wait=False):
-                # reap the current processes (wait==False: if they are finished)
-                #print "-- entering reap_processes with len: %d" % len(processes)
-                reaped  = False
-                counter = 0
-                while True:
-                    for pos, pid in enumerate(processes.keys()):
-                        if not wait and pid.poll() == None:  # None = process hasn't terminated
-                            #print pid.poll()
-                            continue
-                        #print "checking pos: %d" % pos
-                        #self._console.progress(pos, length)
-                        output, errout = pid.communicate()
-                        rcode = pid.returncode
-                        cpos = processes[pid][0]
-                        if rcode == 0:
-                            #tf   = processes[pid][1].read()
-                            #print output[:30]
-                            #print tf[:30]
-                            contA[cpos][CONTENT] = output.decode('utf-8')
-                            #contA[cpos] = tf
-                        else:
-                            raise RuntimeError("Problems compiling %s: %s" % (classes[cpos], errout))
-                        #print "-- terminating process for class: %s" % classes[cpos]
-                        del processes[pid]
-                        reaped = True
-
-                    if reaped: break
-                    else:
-                        #print "-- waiting for some process to terminate"
-                        if counter > 100: # arbitrary limit, to break deadlocks because of full pipes
-                            #print "-- switching to wait=True"
-                            wait = True
-                        else:
-                            counter += 1
-                        time.sleep(.050)
-
-                #print "-- leaving reap_processes with len: %d" % len(processes)
-                return
-
-            # -----------------------------------------------------------------
-
-            variants = compConf.variantset
-            optimize = compConf.optimize
-            format_  = compConf.format
-            import subprocess
-            contA = {}
-            CACHEID = 0
-            INCACHE = 1
-            CONTENT = 2
-            processes = {}
-            length = len(classes)
-
-            #self._console.debug("Compiling classes using %d sub-processes" % maxproc)
-
-            # go through classes, start individual compiles, collect results
-            for pos, clazz in enumerate(classes):
-                log_progress()
-                contA[pos] = {}
-                contA[pos][INCACHE] = False
-                if len(processes) > maxproc:
-                    reap_processes()  # collect finished processes' results to make room
-
-                cacheId, content = _checkCache(clazz, variants, optimize, format_)
-                contA[pos][CACHEID] = cacheId
-                if content:
-                    contA[pos][CONTENT] = content
-                    contA[pos][INCACHE] = True
-                    continue
-                cmd = _getCompileCommand(clazz, variants, optimize, format_)
-                #print cmd
-                tf = os.tmpfile()
-                #print "-- starting process for class: %s" % clazz
-                pid = subprocess.Popen(
-                            cmd, shell=True,
-                            stdout=subprocess.PIPE,
-                            #stdout=tf,
-                            stderr=subprocess.PIPE,
-                            universal_newlines=True)
-                processes[pid] = (pos, tf)
-
-            # collect outstanding processes
-            if len(processes):
-                #print "++ cleaning up processes"
-                reap_processes(wait=True)
-
-            # join single results in one string
-            content = u''
-            for i in sorted(contA.keys()):
-                #print i, contA[i][:30]
-                classStuff = contA[i]
-                content += classStuff[CONTENT]
-                if not classStuff[INCACHE]:
-                    self._cache.write(classStuff[CACHEID], classStuff[CONTENT])
-
-            return content
-
-
-        def _getCompileCommand(clazz, variants, optimize, format_):
-
-            def getToolBinPath():
-                path = sys.argv[0]
-                path = os.path.abspath(os.path.normpath(os.path.dirname(path)))
-                return path
-
-            m   = {}
-            cmd = ""
-            toolBinPath      = getToolBinPath()
-            m['compilePath'] = os.path.join(toolBinPath, "compile.py -q")
-            m['filePath']    = os.path.normpath(clazz.path)
-            # optimizations
-            optis = []
-            for opti in optimize:
-                optis.append("--" + opti)
-            m['optimizations'] = " ".join(optis)
-            # variants
-            varis = []
-            for vari in variants:
-                varis.append("--variant=" + vari + ":" + json.dumps(variants[vari]))
-            m['variants'] = " ".join(varis)
-            m['cache'] = "-c " + self._cache._path  # Cache needs context object, interrupt handler,...
-            # compile.py could read the next from privateoptimizer module directly
-            m['privateskey'] = "--privateskey " + '"' + privateoptimizer.privatesCacheId + '"'
-
-            cmd = "%(compilePath)s %(optimizations)s %(variants)s %(cache)s %(privateskey)s %(filePath)s" % m
-            return cmd
-
-
-        def _checkCache(clazz, variants, optimize, format_=False):
-            filePath = clazz.path
-
-            classVariants     = clazz.classVariants()
-            relevantVariants  = Class.projectClassVariantsToCurrent(classVariants, variants)
-            variantsId = util.toString(relevantVariants)
-
-            optimizeId = generateOptimizeId(optimize)
-
-            cacheId = "compiled-%s-%s-%s-%s" % (filePath, variantsId, optimizeId, format_)
-            compiled, _ = self._cache.read(cacheId, filePath)
-
-            return cacheId, compiled
-
-
-        def generateOptimizeId(optimize):
-            optimize = copy.copy(optimize)
-            optimize.sort()
-            return "[%s]" % ("-".join(optimize))
-
-        # - end: _compileClassesMP stuff --------------------------------
 
         ##
         # process "statics" optimization
         #
+        # Unreferenced features are pruned from the class trees, which drops the
+        # references of their code in turn, and classes whose features are not
+        # used from outside are removed altogether. A class is only looked at
+        # again when one of its features has lost a reference (worklist), until
+        # there is nothing left to remove. Finally, classes not reachable from
+        # the head classes of the parts are removed.
         def optimizeDeadCode(classList, featureMap, compConf, treegen, log_progress):
             
-            ##
-            # define a criterion when optimization is saturated
-            # (here: when nullrefs hasn't changed in 4 times)
-            def atLimit(featureMap, lmin=[]):
-                # array of (class.id, feature) the feature ref count of which is 0
-                nullrefs = [(cls, feat) for cls in featureMap 
-                                for feat in featureMap[cls] if not featureMap[cls][feat].hasref()]
-                cmin = len(nullrefs)
-                lmin.append(cmin)
-                # use the last 4 length values
-                if len(lmin)>3 and all([x==cmin for x in lmin[-4:]]):
-                    return True
-                else:
-                    return False
-
             ##
             # print features with external usages
             def debugFeatureMap(featureMap):
@@ -587,12 +422,6 @@ class CodeGenerator(object):
                         ext_refs = set(["%s:%s" % (ref.requestor, ref.line) for ref in features[feat]._refs if ref.requestor != key])
                         print "\t", feat, ":", features[feat]._ref_cnt, "%r" % list(ext_refs)
 
-            # a class list that skips the head classes
-            def classlistiter():
-                for c in classList:
-                    if c.id not in head_classes:
-                        yield c
-
             def external_use(clazz, featureMap):
                 ext_use = False
                 class_features = featureMap[clazz.id]
@@ -606,27 +435,48 @@ class CodeGenerator(object):
                             break
                 return ext_use
 
-            def remove_class_refs(clazz, featureMap):
-                for key in featureMap:
-                    for feat in featureMap[key]:
-                        uf = featureMap[key][feat]
+            ##
+            # {requestor: set([(classId, feature)])}, the features a class references
+            def features_used_by(featureMap):
+                used_by = {}
+                for cls in featureMap:
+                    for feat in featureMap[cls]:
+                        for dep in featureMap[cls][feat]._refs:
+                            used_by.setdefault(dep.requestor, set()).add((cls, feat))
+                return used_by
+
+            ##
+            # drop the references of a class from the features it uses; returns
+            # the ids of the classes that have lost references
+            def remove_class_refs(clazz, featureMap, used_by):
+                touched = set()
+                for cls, feat in used_by.get(clazz.id, ()):
+                    if cls in featureMap and feat in featureMap[cls]:
+                        uf = featureMap[cls][feat]
                         for ref in uf._refs[:]:
                             if ref.requestor == clazz.id:
                                 uf.decref(clazz.id)
+                                touched.add(cls)
+                return touched
 
+            ##
+            # remove the classes that cannot be reached from the head classes
+            # through "using" edges (featureMap is a used-by mapping)
             def check_reachability_graph(head_classes, featureMap, classList):
-                gr = graph.digraph()
-                [gr.add_node(s) for s in featureMap.keys()]  # assert featureMap.keys() == [classList.id's]
-                # add "using" edges (featureMap is a used-by mapping)
+                uses = {}  # {cls: set(classes cls uses)}
                 for cls in featureMap:
-                    other_using = [dep.name for x in featureMap for y in featureMap[x] for dep in featureMap[x][y]._refs if dep.requestor==cls and dep.name!=cls]
-                    for other in other_using:
-                        gr.add_edge(cls, other)
-                        log_progress()
-                access_matrix = gr.accessibility()
-                reachable_nodes = set()
-                for head_class in head_classes:
-                    reachable_nodes.update(access_matrix[head_class])
+                    for feat in featureMap[cls]:
+                        for dep in featureMap[cls][feat]._refs:
+                            if dep.requestor != cls and dep.requestor in featureMap:
+                                uses.setdefault(dep.requestor, set()).add(cls)
+                    log_progress()
+                reachable_nodes = set(head_classes)
+                agenda = list(head_classes)
+                while agenda:
+                    for other in uses.get(agenda.pop(), ()):
+                        if other not in reachable_nodes:
+                            reachable_nodes.add(other)
+                            agenda.append(other)
                 # purge unreachable nodes
                 for cls in classList[:]:
                     if cls.id not in reachable_nodes:
@@ -647,31 +497,41 @@ class CodeGenerator(object):
                 if "variants" in compConf.optimize:
                     clazz._tmp_tree = clazz.optimize(None, ["variants"], compConf.variantset) # using None allows us to re-used a cached tree
 
-            # then, prune as long as we have ref counts == 0 on features
-            while True:
-                # break the loop if we are not making any more progress ("fixed point")
-                if atLimit(featureMap):
-                    break
+            # start out with all classes except the head classes
+            worklist = [clazz for clazz in classList if clazz.id not in head_classes]
+            worklist.reverse()  # popping from the end, so classes are visited in classList order
+            pending  = set(clazz.id for clazz in worklist)
+            classesById = dict((clazz.id, clazz) for clazz in worklist)
+            used_by = features_used_by(featureMap)
+
+            # then, prune as long as there are classes with lost references
+            while worklist:
+                clazz = worklist.pop()
+                pending.discard(clazz.id)
+                touched = set()
+
+                # (a) first, remove the class' unused features
+                if clazz.type == 'static' and clazz.id in featureMap:
+                    touched.update(visitor.timed("statics", featureoptimizer.patch, clazz._tmp_tree, clazz, featureMap))
+                log_progress()
 
-                # (a) first, let clazz.optimize remove those features
-                for clazz in classlistiter():
-                    clazz._tmp_tree = clazz.optimize(clazz._tmp_tree, ["statics"], featureMap=featureMap)
-                    log_progress()
+                # (b) then, remove the class if it is unused
+                if clazz.id in featureMap:
+                    if (not featureMap[clazz.id]   # no feature is used
+                        or not external_use(clazz, featureMap)  # features only used by the class itself
+                       ):
+                        classList.remove(clazz)
+                        del featureMap[clazz.id]
+                        touched.update(remove_class_refs(clazz, featureMap, used_by)) # remove all the class's UsedFeature entries as well
+                        log_progress()
+                        #self._console.info("removing %s" % clazz.id)
 
-                # (b) then, remove entire unused classes from classlist
-                for clazz in classlistiter():
-                    if clazz.id in featureMap:
-                        if (not featureMap[clazz.id]   # no feature is used
-                            or not external_use(clazz, featureMap)  # features only used by the class itself
-                           ):
-                            classList.remove(clazz)
-                            del featureMap[clazz.id]
-                            remove_class_refs(clazz, featureMap) # remove all the class's UsedFeature entries as well
-                            log_progress()
-                            #self._console.info("removing %s" % clazz.id)
-
-                # removing entire classes might remove dependencies of construct, defer, extend, etc,
-                # so this might have again zero'ed usage counts of remaining features, so we have to loop
+                # removing features or entire classes might have zero'ed usage counts
+                # of other classes' features, so they have to be looked at again
+                for classId in touched:
+                    if classId in featureMap and classId in classesById and classId not in pending:
+                        pending.add(classId)
+                        worklist.append(classesById[classId])
 
             # Lastly, when we cannot reduce anymore by looking at feature usage,
             # check reachability graph of head classes
@@ -693,8 +553,20 @@ class CodeGenerator(object):
             return classList
 
 
+        ##
+        # returns the code of the classes, as a list of chunks (one per class)
         def compileClasses(classList, compConf, log_progress=lambda:None):
+            # variant sets of a group compile their classes to the same code
+            if script.variantsGroup is not None:
+                codeId = (script.variantsGroup, tuple(clazz.id for clazz in classList),
+                          tuple(compConf.optimize), compConf.format)
+                if codeId in self._compiledCode:
+                    return self._compiledCode[codeId]
+            else:
+                codeId = None
             num_proc = self._job.get('run-time/num-processes', 0)
+            if not hasattr(os, "fork"):  # CompilePool relies on forked workers
+                num_proc = 0
             result = []
             # do "statics" optimization out of line
             if "statics" in compConf.optimize:
@@ -711,7 +583,6 @@ class CodeGenerator(object):
                     result.append(code)
                     #clazz._tmp_tree = None # reset _tmp_tree
                     log_progress()
-                result = u''.join(result)
             else:
                 if num_proc == 0:
                     for clazz in classList:
@@ -719,11 +590,15 @@ class CodeGenerator(object):
                         code = clazz.getCode(compConf, treegen=treegenerator, featuremap=script._featureMap) # choose parser frontend
                         result.append(code)
                         log_progress()
-                    result =  u''.join(result)
                 else:
                     # multi-core version
-                    result =  _compileClassesMP(classList, compConf, log_progress, num_proc)
+                    if self._compilePool is None:
+                        from generator.code.CompilePool import CompilePool  # uses multiprocessing, Python 2.6+
+                        self._compilePool = CompilePool(self._classes, self._cache, self._console, num_proc)
+                    result = self._compilePool.compile(classList, compConf, log_progress)
 
+            if codeId is not None:
+                self._compiledCode[codeId] = result
             return result
 
 
@@ -740,20 +615,15 @@ class CodeGenerator(object):
         # Return the list of constructed URIs.
         def compileAndWritePackage(package, compConf, allClassVariants):
 
-            def compiledFilename(compiled):
-                hash_ = sha.getHash(compiled)[:12]
-                fname = self._resolveFileName(script.baseScriptPath, script.variants, {}, "")
-                fname = self._fileNameWithHash(fname, hash_)
-                return fname
-
             def compileAndAdd(compiled_classes, package_uris, prelude='', wrap=''):
                 compiled = compileClasses(compiled_classes, compOptions, log_progress)
                 if wrap:
-                    compiled = wrap % compiled
+                    wrapBefore, wrapAfter = wrap.split("%s", 1)
+                    compiled = [wrapBefore] + compiled + [wrapAfter]
                 if prelude:
-                    compiled = prelude + compiled
-                filename = compiledFilename(compiled)
-                self.writePackage(compiled, filename, script)
+                    compiled = [prelude] + compiled
+                fname = self._resolveFileName(script.baseScriptPath, script.variants, {}, "")
+                filename = self.writePackageChunks(compiled, fname, script)
                 filename = OsPath(os.path.basename(filename))
                 shortUri = Uri(filename.toUri())
                 entry = "%s:%s" % ("__out__", shortUri.encodedValue())
@@ -928,8 +798,14 @@ class CodeGenerator(object):
                             package.classes.remove(clz)
 
             # write packages to disk
-            for packageIndex, package in enumerate(packages):
-                package = compileAndWritePackage(package, compConf, allClassVariants)
+            self._compilePool = None  # started on demand by compileClasses()
+            try:
+                for packageIndex, package in enumerate(packages):
+                    package = compileAndWritePackage(package, compConf, allClassVariants)
+            finally:
+                if self._compilePool:
+                    self._compilePool.close()
+                    self._compilePool = None
 
             #self._console.outdent()
             self._console.dotclear()
@@ -1307,6 +1183,25 @@ class CodeGenerator(object):
             filetool.save(filePath, content)
 
 
+    ##
+    # Like writePackage(), but streams the content to disk chunk by chunk, and
+    # names the file after its hash (see _fileNameWithHash()), as compiled
+    # packages are. Returns the file path.
+
+    def writePackageChunks(self, chunks, filePath, script):
+        writer = filetool.StreamWriter(os.path.dirname(filePath), compress=script.scriptCompress)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except:
+            writer.abort()
+            raise
+        filePath = self._fileNameWithHash(filePath, writer.hexdigest()[:12])
+        console.debug("Writing script file %s" % filePath)
+        writer.close(filePath)
+        return filePath
+
+
 
 
 # Helper class for string.Template, to overwrite the placeholder introducing delimiter
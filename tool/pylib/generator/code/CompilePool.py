@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Worker processes to compile classes in parallel (job key
+# 'run-time/num-processes').
+#
+# The workers are forked once per pool, so they share the Class objects and
+# the cache with the generator process. They receive (position, classId,
+# CompileOptions) tasks and send back the compiled code, which compile()
+# assembles in class order. Classes that are in the cache are not handed out
+# at all; workers write what they compile to the (on-disk) cache as usual,
+# and share the replacements of private names through the cache's
+# generator.runtime.PrivatesDb.
+##
+
+import os, sys, signal, traceback, Queue
+import multiprocessing
+
+
+class CompilePool(object):
+
+    def __init__(self, classes, cache, console, numProcs):
+        self._classes  = classes   # {classId: Class}
+        self._cache    = cache
+        self._console  = console
+        self._tasks    = multiprocessing.Queue()
+        self._results  = multiprocessing.Queue()
+        self._workers  = []
+        self._console.debug("Starting %d compile processes" % numProcs)
+        for i in range(numProcs):
+            worker = multiprocessing.Process(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+
+    ##
+    # Compile classes; returns their code, as a list in the given order
+
+    def compile(self, classes, compOptions, log_progress=lambda:None):
+        result  = [None] * len(classes)
+        pending = 0
+        for pos, clazz in enumerate(classes):
+            result[pos] = clazz.getCachedCode(compOptions)
+            if result[pos] is None:
+                self._tasks.put((pos, clazz.id, compOptions))
+                pending += 1
+            else:
+                log_progress()
+
+        try:
+            while pending:
+                msg = self._receive()
+                if msg[0] == "code":
+                    _, pos, code = msg
+                    result[pos] = code
+                    pending -= 1
+                    log_progress()
+                else:
+                    _, pos, errmsg = msg
+                    raise RuntimeError("Problems compiling %s: %s" % (classes[pos].id, errmsg))
+        except:
+            self.terminate()  # don't wait for the outstanding tasks
+            raise
+
+        return result
+
+
+    def _receive(self):
+        while True:
+            try:
+                return self._results.get(timeout=1)
+            except Queue.Empty:
+                if not self._workers or not all(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError("A compile process terminated unexpectedly")
+
+
+    ##
+    # Shut down the workers; they flush their cache writes before exiting
+
+    def close(self):
+        for worker in self._workers:
+            if worker.is_alive():
+                self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+
+    def terminate(self):
+        for worker in self._workers:
+            worker.terminate()
+            worker.join()
+        self._workers = []
+
+
+    # -- Worker side -----------------------------------------------------------
+
+    def _work(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the generator process handles interrupts
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            pos, classId, compOptions = task
+            try:
+                code = self._classes[classId].getCode(compOptions)
+                self._results.put(("code", pos, code))
+            except Exception, e:
+                self._results.put(("error", pos, traceback.format_exc()))
+        self._cache.flush()
+
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# A project-wide index of the class dependencies, for the dependency walks
+# of DependencyLoader (class lists, sorting) and PartBuilder.
+#
+# Nodes are the classes, edges their load and run dependencies as computed
+# by Class.getCombinedDeps(). The edges of a class are kept per projection
+# of the variant set on the class' environment keys (see
+# Class.classVariants()), i.e. annotated with the variant conditions they
+# hold for, so all variant sets agreeing on these keys share them.
+#
+# A node records the stamp of its class (m_time, or digest in content mode)
+# and the edges the stamps of the classes their transitive load deps were
+# collected through. When a class changes, only its own node, and the edges
+# going through it, are recomputed; everything else is answered from the
+# index, which is read once per job instead of a class cache object per
+# class and query.
+#
+# index = {
+#   <class path> : {
+#     'stamp'    : <stamp of the class>,
+#     'variants' : ["qx.debug", ...],    # environment keys of the class
+#     'edges'    : {
+#       <projected variants> : (
+#         (("qx.core.Object", "my.Class", 12, True), ...),  # load deps (name, requestor, line, isLoadDep)
+#         (("qx.ui.core.Widget", "my.Class", 37, False), ...), # run deps
+#         ("qx.bom.Foo", ...),                   # ignored names
+#         {"qx.core.Property": <stamp>, ...},    # classes of transitive load deps
+#       )
+#     }
+#   }
+# }
+##
+
+import re
+
+from misc                       import util
+from misc.securehash            import sha_construct
+from ecmascript.frontend        import lang
+from generator.code.Class       import Class
+
+class DependencyIndex(object):
+
+    def __init__(self, classesObj, cache, console, jobconf):
+        self._classesObj = classesObj
+        self._cache   = cache
+        self._console = console
+        self._jobconf = jobconf
+        self._require = jobconf.get("require", {})
+        self._use     = jobconf.get("use", {})
+        libPaths      = sorted(lib.path for lib in jobconf.get("library", []))
+        self._cacheId = "depindex-%s" % sha_construct(u"|".join(libPaths).encode("utf-8")).hexdigest()
+        self._index   = None   # see above; read on first use
+        self._changed = False
+        self._stamps  = {}     # {classId: stamp}, for the current run
+        self._deps    = {}     # {(classId, variants): deps}, answered in the current run
+        self._known   = set(lang.BUILTIN + ["clazz"])
+
+
+    ##
+    # The dependencies of a class under a variant set, like
+    # Class.getCombinedDeps(), but with class names instead of DependencyItems:
+    #
+    # ({
+    #   'load'      : ["qx.core.Object", ...],
+    #   'run'       : [...],
+    #   'isLoadDep' : set([...]),      # load deps detected in load context (DependencyItem.isLoadDep)
+    #   'ignore'    : set(["qx.bom.Foo", ...]),
+    #   'unknown'   : [("foo.Bar", requestor, line), ...]  # deps that are not known classes
+    #   'skip'      : set([...]),      # ignored and unknown names
+    # }, cached)
+
+    def getDeps(self, classId, variants):
+        classObj = self._classesObj[classId]
+        node     = self._getNode(classObj)
+        key      = util.toString(Class.projectClassVariantsToCurrent(node['variants'], variants))
+        depsKey  = (classId, key)
+        if depsKey in self._deps:
+            return self._deps[depsKey], True
+
+        edges  = node['edges'].get(key)
+        cached = edges is not None and self._edgesAreFresh(edges)
+        if not cached:
+            edges = self._computeEdges(classObj, variants)
+            node['edges'][key] = edges
+            self._changed = True
+
+        deps = self._makeDeps(classId, edges)
+        self._deps[depsKey] = deps
+        return deps, cached
+
+
+    ##
+    # The environment keys a class uses (see Class.classVariants())
+
+    def classVariants(self, classId):
+        return self._getNode(self._classesObj[classId])['variants']
+
+
+    ##
+    # Write the index back to the cache, if it has been extended (at the end
+    # of a job, see DependencyLoader.flush())
+
+    def flush(self):
+        if self._changed:
+            self._cache.write(self._cacheId, self._index, memory=True)
+            self._changed = False
+
+
+    def _getNode(self, classObj):
+        if self._index is None:
+            self._index, _ = self._cache.read(self._cacheId, memory=True)
+            if self._index is None:
+                self._index = {}
+        node = self._index.get(classObj.path)
+        stamp = self._stamp(classObj.id)
+        if node is None or node['stamp'] != stamp:
+            node = {
+                'stamp'    : stamp,
+                'variants' : classObj.classVariants(),
+                'edges'    : {},
+            }
+            self._index[classObj.path] = node
+            self._changed = True
+        return node
+
+
+    def _stamp(self, classId):
+        if classId not in self._stamps:
+            classObj = self._classesObj[classId]
+            if self._cache.isContentMode():
+                self._stamps[classId] = classObj.digest()
+            else:
+                self._stamps[classId] = classObj.m_time()
+        return self._stamps[classId]
+
+
+    def _edgesAreFresh(self, edges):
+        for classId, stamp in edges[3].iteritems():
+            if classId not in self._classesObj or self._stamp(classId) != stamp:
+                self._console.debug("Invalidating dep index entry, as %s has changed" % classId)
+                return False
+        return True
+
+
+    def _computeEdges(self, classObj, variants):
+        # config deps are added in _makeDeps(), so the index is independent of them
+        deps, _ = classObj.getCombinedDeps(self._classesObj, variants, {}, projectClassNames=False)
+        via = {}
+        for dep in deps['load']:
+            if dep.requestor != classObj.id and dep.name in self._classesObj:
+                via[dep.name] = self._stamp(dep.name)
+        return (
+            self._dedup(deps['load']),
+            self._dedup(deps['run']),
+            tuple(dep.name for dep in deps['ignore']),
+            via,
+        )
+
+
+    ##
+    # First occurrence of each class, as with getCombinedDeps(projectClassNames=True)
+
+    def _dedup(self, deps):
+        result = []
+        seen   = set()
+        for dep in deps:
+            if dep.name not in seen:
+                seen.add(dep.name)
+                result.append((dep.name, dep.requestor, dep.line, dep.isLoadDep))
+        return tuple(result)
+
+
+    def _makeDeps(self, classId, edges):
+        load, run, ignore, _ = edges
+        load = list(load)
+        run  = list(run)
+        if classId in self._require:
+            load.extend((x, "|config|", -1, False) for x in self._require[classId])
+        if classId in self._use:
+            run.extend((x, "|config|", -1, False) for x in self._use[classId])
+        unknown = [dep[:3] for dep in load + run if not self.isKnownClass(dep[0])]
+        return {
+            'load'      : [dep[0] for dep in load],
+            'run'       : [dep[0] for dep in run],
+            'isLoadDep' : set(dep[0] for dep in edges[0] if dep[3]),
+            'ignore'    : set(ignore),
+            'unknown'   : unknown,
+            'skip'      : set(ignore).union(dep[0] for dep in unknown),
+        }
+
+
+    ##
+    # whether classId can be considered a known class
+
+    def isKnownClass(self, classId):
+        if classId in self._classesObj or classId in self._known:
+            return True
+        elif re.match(r'this\b', classId):
+            return True
+        return False
@@ -47,6 +47,7 @@ from misc                       import util
 from ecmascript.frontend        import lang
 from generator.code.Class       import Class, DependencyError, CompileOptions
 from generator.code.DependencyItem  import DependencyItem
+from generator.code.DependencyIndex import DependencyIndex
 
 class DependencyLoader(object):
 
@@ -59,6 +60,15 @@ class DependencyLoader(object):
         self._require = require
         self._use     = use
         self.counter  = 0
+        self._index   = DependencyIndex(classesObj, cache, console, self._jobconf)
+
+
+    ##
+    # Write the dependency index back to the cache; once per job, as the
+    # index is written as a whole
+
+    def flush(self):
+        self._index.flush()
 
 
     ##
@@ -125,109 +135,102 @@ class DependencyLoader(object):
     def classlistFromInclude(self, includeWithDeps, excludeWithDeps, variants, 
                              verifyDeps=False, script=None, allowBlockLoaddeps=True):
 
-        def classlistFromClassRecursive(depsItem, excludeWithDeps, variants, result, warn_deps, loadDepsChain, allowBlockLoaddeps=True):
+        def classlistFromClassRecursive(classId, isLoadDep, excludeWithDeps, variants, result, warn_deps, loadDepsChain, allowBlockLoaddeps=True):
             # support blocking
-            if depsItem.name in excludeWithDeps:
-                if depsItem.isLoadDep and not allowBlockLoaddeps:
+            if classId in excludeWithDeps:
+                if isLoadDep and not allowBlockLoaddeps:
                     raise DependencyError()
                 return
 
             # check if already in
-            if depsItem.name in resultNames:  # string compares are perceivably faster than object compares (as DependencyItem defines __eq__)
+            if classId in resultNames:
                 return
 
             # reading dependencies
-            self._console.debug("Gathering dependencies: %s" % depsItem.name)
-            self._console.indent()
-            classObj = self._classesObj[depsItem.name] # get class from depsItem
-            deps, cached = classObj.getCombinedDeps(self._classesObj, variants, self._jobconf, genProxy=genProxyIter.next())
-            self._console.outdent()
+            self._console.debug("Gathering dependencies: %s" % classId)
+            deps, cached = self._index.getDeps(classId, variants)
             if logInfos: self._console.dot("%s" % "." if cached else "*")
 
             # and evaluate them
-            deps["warn"] = self._checkDepsAreKnown(deps)  # add 'warn' key to deps
-            ignore_names = [x.name for x in deps["ignore"]]
             if verifyDeps:
-                for dep in deps["warn"]:
-                    if dep.name not in ignore_names:
+                for dep in deps["unknown"]:
+                    if dep[0] not in deps["ignore"]:
                         warn_deps.append(dep)
 
             # process lists
             try:
-                skipNames = [x.name for x in deps["warn"] + deps["ignore"]]
+                skipNames = deps["skip"]
 
                 # cycle detection
-                assert depsItem.name not in loadDepsChain
-                loadDepsChain.append(depsItem.name)
+                assert classId not in loadDepsChain
+                loadDepsChain.append(classId)
   
-                for subitem in deps["load"]:
+                for depId in deps["load"]:
                     # cycle check
-                    if subitem.name in loadDepsChain:
-                        self._console.warn("Detected circular dependency between: %s and %s" % (depsItem.name, subitem.name))
+                    if depId in loadDepsChain:
+                        self._console.warn("Detected circular dependency between: %s and %s" % (classId, depId))
                         self._console.indent()
                         self._console.debug("currently explored dependency path: %r" % loadDepsChain)
                         self._console.outdent()
                         raise RuntimeError("Circular class dependencies")
-                    if subitem.name not in resultNames and subitem.name not in skipNames:
-                        classlistFromClassRecursive(subitem, excludeWithDeps, variants, result, warn_deps, loadDepsChain, allowBlockLoaddeps)
+                    if depId not in resultNames and depId not in skipNames:
+                        classlistFromClassRecursive(depId, depId in deps["isLoadDep"], excludeWithDeps, variants, result, warn_deps, loadDepsChain, allowBlockLoaddeps)
 
                 ##
                 # putting this here allows expanding and partially sorting of the class
                 # list in one go
-                if depsItem.name not in resultNames:
-                    result.append(depsItem)
-                    resultNames.append(depsItem.name)
+                if classId not in resultNames:
+                    result.append(classId)
+                    resultNames.add(classId)
                 
                 # cycle check
-                loadDepsChain.remove(depsItem.name)
+                loadDepsChain.remove(classId)
 
-                for subitem in deps["run"]:
-                    if subitem.name not in resultNames and subitem.name not in skipNames:
-                        classlistFromClassRecursive(subitem, excludeWithDeps, variants, result, warn_deps, [], allowBlockLoaddeps)
+                for depId in deps["run"]:
+                    if depId not in resultNames and depId not in skipNames:
+                        classlistFromClassRecursive(depId, False, excludeWithDeps, variants, result, warn_deps, [], allowBlockLoaddeps)
 
             except DependencyError, detail:
-                raise ValueError("Attempt to block load-time dependency of class %s to %s" % (depsItem.name, subitem.name))
+                raise ValueError("Attempt to block load-time dependency of class %s to %s" % (classId, depId))
 
             except NameError, detail:
-                raise NameError("Could not resolve dependencies of class: %s \n%s" % (depsItem.name, detail))
+                raise NameError("Could not resolve dependencies of class: %s \n%s" % (classId, detail))
 
             return
 
 
-        def classlistFromClassIterative(depsItem, excludeWithDeps, variants, result, warn_deps, loadDepsChain, allowBlockLoaddeps=True):
+        def classlistFromClassIterative(classId, excludeWithDeps, variants, result, warn_deps, loadDepsChain, allowBlockLoaddeps=True):
 
-            def processNode(depsItem):
-                if depsItem.name in resultNames:
+            def processNode(classId):
+                if classId in resultNames:
                     node = None
                 else:
-                    result.append(depsItem)
-                    resultNames.append(depsItem.name)
-                    node = depsItem
+                    result.append(classId)
+                    resultNames.add(classId)
+                    node = classId
                 return node
 
-            def getNodeChildren(depsItem):
-                deps, cached = self._classesObj[depsItem.name].getCombinedDeps(self._classesObj, variants, self._jobconf, genProxy=genProxyIter.next())
+            def getNodeChildren(classId):
+                deps, cached = self._index.getDeps(classId, variants)
 
                 # and evaluate them
-                deps["warn"] = self._checkDepsAreKnown(deps)  # add 'warn' key to deps
-                ignore_names = [x.name for x in deps["ignore"]]
                 if verifyDeps:
-                    for dep in deps["warn"]:
-                        if dep.name not in ignore_names:
+                    for dep in deps["unknown"]:
+                        if dep[0] not in deps["ignore"]:
                             warn_deps.append(dep)
 
-                skipNames = [x.name for x in deps["warn"] + deps["ignore"]]
+                skipNames = deps["skip"]
                 result = []
-                for dep in deps['load'] + deps['run']:
-                    if dep.name in skipNames or dep.name in resultNames:
+                for depId in deps['load'] + deps['run']:
+                    if depId in skipNames or depId in resultNames:
                         continue
-                    result.append(dep)
+                    result.append(depId)
 
                 return result  # returns *all* deps (load, run, ...)
 
             # ---------------------------------------------------------------------
 
-            self.agendaSearch([depsItem], processNode, getNodeChildren, mode="bf")
+            self.agendaSearch([classId], processNode, getNodeChildren, mode="bf")
 
             return
 
@@ -240,20 +243,6 @@ class DependencyLoader(object):
         ignored_names = set()
         firstTime = [True]
 
-        # Pyro servers
-        #import Pyro.core
-        #genProxies = [
-        #    Pyro.core.getProxyForURI("PYRONAME://genworker0"),
-        #    Pyro.core.getProxyForURI("PYRONAME://genworker1"),
-        #    Pyro.core.getProxyForURI("PYRONAME://genworker2"),
-        #    Pyro.core.getProxyForURI("PYRONAME://genworker3"),
-        #    Pyro.core.getProxyForURI("PYRONAME://genworker4"),
-        #    Pyro.core.getProxyForURI("PYRONAME://genworker5"),
-        #]
-        import itertools
-        #genProxyIter = itertools.cycle(genProxies)
-        genProxyIter = itertools.repeat(None)
-
 
         # No dependency calculation
         if len(includeWithDeps) == 0:
@@ -272,14 +261,13 @@ class DependencyLoader(object):
             # Multiple loop over class list calculation
             processedEnvironment = False
             result      = []          # reset any previous results for this iteration
-            resultNames = []
+            resultNames = set()
 
             # calculate class list recursively
             for item in includeWithDeps:
-                depsItem = DependencyItem(item, '', '|config|')
                 # calculate dependencies and add required classes
-                classlistFromClassRecursive(depsItem, excludeWithDeps, variants, result, warn_deps, [], allowBlockLoaddeps)
-                #classlistFromClassIterative(depsItem, excludeWithDeps, variants, result, warn_deps, [], allowBlockLoaddeps)
+                classlistFromClassRecursive(item, False, excludeWithDeps, variants, result, warn_deps, [], allowBlockLoaddeps)
+                #classlistFromClassIterative(item, excludeWithDeps, variants, result, warn_deps, [], allowBlockLoaddeps)
 
             self._console.dotclear()
                     
@@ -287,9 +275,6 @@ class DependencyLoader(object):
                 #self._console.nl()
                 pass
 
-            # extract names of depsItems
-            result = [x.name for x in result]
-
         # warn about unknown references
         # add the list of name spaces of the selected classes
         for classid in result:
@@ -298,34 +283,38 @@ class DependencyLoader(object):
                 continue # not interested in bare class names
             classnamespace = classid[:nsindex]
             ignored_names.add(classnamespace)
-        for dep in warn_deps:
-            if dep.name not in ignored_names:
-                self._console.warn("Hint: Unknown global symbol referenced: %s (%s:%s)" % (dep.name, dep.requestor, dep.line))
+        for name, requestor, line in warn_deps:
+            if name not in ignored_names:
+                self._console.warn("Hint: Unknown global symbol referenced: %s (%s:%s)" % (name, requestor, line))
 
 
         return result
 
 
-    def _checkDepsAreKnown(self, deps,):
-        # check the shallow deps are known classes
-        new_warn = []
-        for dep in deps["load"] + deps["run"]:
-            if not self._isKnownClass(dep.name):
-                new_warn.append(dep)
-        return new_warn
+    ##
+    # The dependencies of a class under a variant set, from the dependency
+    # index (see generator.code.DependencyIndex.getDeps())
+
+    def getDeps(self, classId, variants):
+        deps, _ = self._index.getDeps(classId, variants)
+        return deps
 
 
-    def _isKnownClass(self, classId):
-        # check whether classId can be considered a known class
-        if classId in lang.BUILTIN + ["clazz"]:
-            return True
-        elif classId in self._classesObj:
-            return True
-        elif re.match(r'this\b', classId):
+    ##
+    # Whether two variant sets select the same code in all the classes of
+    # classList, i.e. none of the classes uses a key the sets differ in
+
+    def variantsAgree(self, classList, variantsA, variantsB):
+        keys = set(key for key in set(variantsA) | set(variantsB)
+                   if key not in variantsA or key not in variantsB or variantsA[key] != variantsB[key])
+        if not keys:
             return True
-        return False
+        for classId in classList:
+            if keys.intersection(self._index.classVariants(classId)):
+                return False
+        return True
+
 
-    
     def agendaSearch(self, agenda, processNode, getNodeChildren, mode="df"):
         while agenda:
             node = agenda.pop(0)
@@ -369,11 +358,11 @@ class DependencyLoader(object):
     def sortClassesRec(self, classList, variants, buildType=""):
 
         def sortClassesRecurser(classId, classListSorted, path):
-            if classId in classListSorted:
+            if classId in sortedSet:
                 return
 
             # reading dependencies
-            deps, cached = self._classesObj[classId].getCombinedDeps(self._classesObj, variants, self._jobconf)
+            deps, cached = self._index.getDeps(classId, variants)
 
             if self._console.getLevel() is "info":
                 self._console.dot("%s" % "." if cached else "*")
@@ -383,9 +372,8 @@ class DependencyLoader(object):
                 path.append(classId)
 
             # process loadtime requirements
-            for dep in deps["load"]:
-                dep_name = dep.name
-                if dep_name in classList and not dep_name in classListSorted:
+            for dep_name in deps["load"]:
+                if dep_name in classSet and not dep_name in sortedSet:
                     if dep_name in path:
                         self._console.warn("Detected circular dependency between: %s and %s" % (classId, dep_name))
                         self._console.indent()
@@ -395,18 +383,21 @@ class DependencyLoader(object):
                     else:
                         sortClassesRecurser(dep_name, classListSorted, path)
 
-            if not classId in classListSorted:
+            if not classId in sortedSet:
                 # remove element from path
                 path.remove(classId)
 
                 # print "Add: %s" % classId
                 classListSorted.append(classId)
+                sortedSet.add(classId)
 
             return
 
         # ---------------------------------
 
         classListSorted = []
+        sortedSet = set()
+        classSet  = set(classList)
         path   = []
 
         for classId in classList:
@@ -424,11 +415,11 @@ class DependencyLoader(object):
         gr.add_nodes(classList)
 
         # for each load dependency add a directed edge
+        classSet = set(classList)
         for classId in classList:
-            deps, _ = self._classesObj[classId].getCombinedDeps(variants, self._jobconf)
-            for dep in deps["load"]:
-                depClassId = dep.name
-                if depClassId in classList:
+            deps, _ = self._index.getDeps(classId, variants)
+            for depClassId in deps["load"]:
+                if depClassId in classSet:
                     gr.add_edge(depClassId, classId)
 
         # cycle check?
@@ -475,6 +466,16 @@ class DependencyLoader(object):
         return featureMap
 
 
+    ##
+    # A copy of a featureMap that can be modified (as the "statics"
+    # optimization does) without affecting the original
+
+    @staticmethod
+    def copyFeatureMap(featureMap):
+        return dict((classId, dict((feature, usedFeature.copy()) for feature, usedFeature in features.iteritems()))
+                    for classId, features in featureMap.iteritems())
+
+
 ##
 # Helper class, to represent reference counts in the FeatureMap
 #
@@ -494,6 +495,12 @@ class UsedFeature(object):
         s._refs.append(dep)
         s._ref_cnt += 1
 
+    def copy(s):
+        other = UsedFeature.__new__(UsedFeature)
+        other._ref_cnt = s._ref_cnt
+        other._refs = s._refs[:]
+        return other
+
     #def incref(s):
     #    s._ref_cnt += 1
 
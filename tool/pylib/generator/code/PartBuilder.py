@@ -39,6 +39,7 @@ class PartBuilder(object):
     def __init__(self, console, depLoader):
         self._console   = console
         self._depLoader = depLoader
+        self._classPackage = {}  # {classId: Package}, the package of each class; kept up to date in merges
 
 
     ##
@@ -151,7 +152,7 @@ class PartBuilder(object):
         self._console.info("Verifying parts  ", feed=False)
         self._console.indent()
         bomb_on_error = self._jobconf.get("packages/verifier-bombs-on-error", True)
-        allpartsclasses = []
+        allpartsclasses = set()
         classesObj = dict((cls.id, cls) for cls in script.classesObj)
 
         # 5) Check consistency between package.part_mask and part.packages
@@ -173,16 +174,16 @@ class PartBuilder(object):
             self._console.dot()
             self._console.indent()
             # get set of current classes in this part
-            classList = []
+            classIndex = {}   # {classId: position in the part}
             classPackage = []
             for packageIdx, package in enumerate(part.packages): # TODO: not sure this is sorted
                 for pos,classId in enumerate(x.id for x in package.classes):
-                    classList.append(classId)
+                    classIndex.setdefault(classId, len(classPackage))
                     classPackage.append((package.id,pos))
-            allpartsclasses.extend(classList)
+            allpartsclasses.update(classIndex)
             # 1) Check the initial part defining classes are included (trivial sanity)
             for classId in part.initial_deps:
-                if classId not in classList:
+                if classId not in classIndex:
                     handleError("Defining class not included in part: '%s'" % (classId,))
                     
             # 2) Check individual class deps are fullfilled in part
@@ -192,16 +193,15 @@ class PartBuilder(object):
             for packageIdx, package in enumerate(part.packages):
                 for clazz in package.classes:
                     classIdx   += 1
-                    classDeps, _   = clazz.getCombinedDeps(script.classesAll, script.variants, script.jobconfig)
-                    loadDeps    = set(x.name for x in classDeps['load'])
-                    ignoreDeps  = set(x.name for x in classDeps['ignore'])
+                    classDeps   = self._depLoader.getDeps(clazz.id, script.variants)
+                    loadDeps    = set(classDeps['load'])
+                    ignoreDeps  = classDeps['ignore']
                     # we cannot enforce runDeps here, as e.g. the 'boot'
                     # part necessarily lacks classes from subsequent parts
                     # (that's the whole point of parts)
                     for depsId in loadDeps.difference(ignoreDeps):
-                        try:
-                            depsIdx = classList.index(depsId)
-                        except ValueError:
+                        depsIdx = classIndex.get(depsId)
+                        if depsIdx is None:
                             handleError("Unfullfilled dependency of class '%s'[%d,%d]: '%s'" % 
                                (clazz.id, package.id, classIdx, depsId))
                             continue
@@ -256,7 +256,7 @@ class PartBuilder(object):
     def _getPartDeps(self, script, smartExclude):
         parts    = script.parts
         variants = script.variants
-        globalClassList = [x.id for x in script.classesObj]
+        globalClassList = set(x.id for x in script.classesObj)
 
         self._console.debug("")
         self._console.info("Assembling parts")
@@ -331,6 +331,7 @@ class PartBuilder(object):
                 # store classId with this package
                 #packages[pkgId].classes.append(classId)
                 packages[pkgId].classes.append(classesObj[classId])
+                self._classPackage[classId] = packages[pkgId]
             return packages.values()
 
         # ---------------------------------------------------------------
@@ -339,6 +340,7 @@ class PartBuilder(object):
 
         parts = script.parts.values()
         classesObj = dict((cls.id, cls) for cls in script.classesObj)
+        self._classPackage = {}
         # generate list of all classes from the part dependencies
         allClasses = getClassesFromParts(parts)
 
@@ -357,15 +359,14 @@ class PartBuilder(object):
             # get all direct (load)deps of this package
             allDeps = set(())
             for clazz in package.classes:
-                classDeps, _ = clazz.getCombinedDeps(script.classesAll, script.variants, script.jobconfig)
-                loadDeps = set(x.name for x in classDeps['load'])
-                allDeps.update(loadDeps)
+                classDeps = self._depLoader.getDeps(clazz.id, script.variants)
+                allDeps.update(classDeps['load'])
 
             # record the other packages in which these classes are contained
             for classId in allDeps:
-                for otherpackage in packages:
-                    if otherpackage != package and classId in (x.id for x in otherpackage.classes):
-                        package.packageDeps.add(otherpackage)
+                otherpackage = self._classPackage.get(classId)
+                if otherpackage is not None and otherpackage != package:
+                    package.packageDeps.add(otherpackage)
          
         self._console.outdent()
         return packages
@@ -652,6 +653,8 @@ class PartBuilder(object):
         def mergeContAndDeps(fromPackage, toPackage):
             # Merging package content
             toPackage.classes.extend(fromPackage.classes)
+            for clazz in fromPackage.classes:
+                self._classPackage[clazz.id] = toPackage
             # Merging package dependencies
             depsDelta = fromPackage.packageDeps.difference(set((toPackage,))) # make sure toPackage is not included
             self._console.debug("Adding packages dependencies to target package: %s" % (map(str, sorted([x.id for x in depsDelta])),))
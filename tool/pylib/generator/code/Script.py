@@ -41,6 +41,7 @@ class Script(object):
         self.classesAll = {}   # all known classes, from all involved libs, {"cid":generator.code.Class}
         self.jobconfig  = None # Job() config object
         self.variants   = {}   # current variant set
+        self.variantsGroup = None  # number of the first variant set selecting the same code (see Generator.run())
         self.environment= {}   # dito. i know, shame for violating DRY, but the above is to control compilation, this one is not
         self.optimize   = []   # optimize settings
         self.parts      = {}   # parts defined by the configuration (if any); {part.name : Part()}
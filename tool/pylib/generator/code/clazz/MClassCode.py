@@ -23,7 +23,7 @@
 # generator.code.Class Mixin: class code (tree and compile)
 ##
 
-import sys, os, types, re, string, copy
+import sys, os, types, re, string, copy, zlib
 from ecmascript.backend.Packer      import Packer
 from ecmascript.backend             import pretty
 from ecmascript.frontend import treeutil, tokenizer
@@ -31,7 +31,7 @@ from ecmascript.frontend import treegenerator
 #from ecmascript.frontend import treegenerator_new_ast as treegenerator
 from ecmascript.transform.optimizer import variantoptimizer, variableoptimizer, commentoptimizer
 from ecmascript.transform.optimizer import stringoptimizer, basecalloptimizer, privateoptimizer
-from ecmascript.transform.optimizer import featureoptimizer
+from ecmascript.transform.optimizer import featureoptimizer, visitor
 from misc import util, filetool
 
 
@@ -50,12 +50,11 @@ class MClassCode(object):
 
         cache = self.context['cache']
         console = self.context['console']
-        tradeSpaceForSpeed = False  # Caution: setting this to True seems to make builds slower, at least on some platforms!?
         cacheId = "tree%s-%s-%s" % (treegen.tag, self.path, util.toString({}))
         self.treeId = cacheId
 
         # Lookup for unoptimized tree
-        tree, _ = cache.read(cacheId, self.path, memory=tradeSpaceForSpeed)
+        tree, _ = cache.read(cacheId, self.path, memory=True)  # trees are copied on read, see Cache.memcache
 
         # Tree still undefined?, create it!
         if tree == None or force:
@@ -72,7 +71,7 @@ class MClassCode(object):
 
             # store unoptimized tree
             #print "Caching %s" % cacheId
-            cache.write(cacheId, tree, memory=tradeSpaceForSpeed)
+            cache.write(cacheId, tree, memory=True, dependsOn=self.path)
 
             console.outdent()
         return tree
@@ -173,17 +172,12 @@ class MClassCode(object):
             optimize          = compOptions.optimize
             variants          = compOptions.variantset
             format_           = compOptions.format
-            classVariants     = self.classVariants()
-            # relevantVariants is the intersection between the variant set of this job
-            # and the variant keys actually used in the class
-            relevantVariants  = self.projectClassVariantsToCurrent(classVariants, variants)
-            variantsId        = util.toString(relevantVariants)
-            optimizeId        = self._optimizeId(optimize)
             cache             = self.context["cache"]
 
-            # Caution: Sharing cache id with TreeCompiler
-            cacheId = "compiled-%s-%s-%s-%s" % (self.path, variantsId, optimizeId, format_)
-            compiled, _ = cache.read(cacheId, self.path)
+            shared            = self._isShareable(optimize)
+
+            cacheId = self._compiledCacheId(compOptions)
+            compiled, _ = cache.read(cacheId, self.path, shared=shared)
 
             if compiled == None:
                 tree = self.optimize(None, optimize, variants, featuremap)
@@ -195,11 +189,37 @@ class MClassCode(object):
                     compiled = self.serializeCondensed(tree, format_)
 
                 if not "statics" in optimize:
-                    cache.write(cacheId, compiled)
+                    cache.write(cacheId, compiled, dependsOn=self.path, shared=shared)
+                    # record the sizes with it (see getCompiledSizes())
+                    cache.write(self._compiledCacheId(compOptions, "compiledsize"), self._codeSizes(compiled),
+                                memory=True, dependsOn=self.path, shared=shared)
 
         return compiled
 
 
+    ##
+    # Like getCode(), but returns None for code that is not in the cache,
+    # rather than compiling it
+    def getCachedCode(self, compOptions):
+        if not compOptions.optimize:
+            return self.getCode(compOptions)
+        compiled, _ = self.context["cache"].read(self._compiledCacheId(compOptions), self.path,
+                                                 shared=self._isShareable(compOptions.optimize))
+        return compiled
+
+
+    def _compiledCacheId(self, compOptions, prefix="compiled"):
+        classVariants     = self.classVariants()
+        # relevantVariants is the intersection between the variant set of this job
+        # and the variant keys actually used in the class
+        relevantVariants  = self.projectClassVariantsToCurrent(classVariants, compOptions.variantset)
+        variantsId        = util.toString(relevantVariants)
+        optimizeId        = self._optimizeId(compOptions.optimize)
+
+        # Caution: Sharing cache id with TreeCompiler
+        return "%s-%s-%s-%s-%s" % (prefix, self.path, variantsId, optimizeId, compOptions.format)
+
+
     ##
     # Interface to ecmascript.backend
     def serializeCondensed(self, tree, format_=False):
@@ -224,17 +244,6 @@ class MClassCode(object):
     #
     def optimize(self, p_tree=None, p_optimize=[], variantSet={}, featureMap={}):
 
-        def load_privates():
-            cacheId  = privateoptimizer.privatesCacheId
-            privates, _ = cache.read(cacheId, keepLock=True)
-            if privates == None:
-                privates = {}
-            return privates
-
-        def write_privates(globalprivs):
-            cacheId  = privateoptimizer.privatesCacheId
-            cache.write(cacheId, globalprivs)  # removes lock by default
-
         def getTreeCacheId(optimize=[], variantSet={}):
             classVariants = self.classVariants()
             relevantVariants = self.projectClassVariantsToCurrent(classVariants, variantSet)
@@ -242,16 +251,21 @@ class MClassCode(object):
                 treegenerator.tag, # TODO: hard-coded treegen.tag
                 self.path, self._optimizeId(optimize), util.toString(relevantVariants))
 
+        ##
+        # The optimizations that do their own traversal run one after the other;
+        # those that provide a visitor share the walks their ordering permits:
+        # 'basecalls' with looking up privates, replacing privates with
+        # collecting strings.
         def optimizeTree(tree):
 
             try:
                 if ["comments"] == optimize:
                     # do a mere comment stripping
-                    commentoptimizer.patch(tree)
+                    visitor.timed("comments", commentoptimizer.patch, tree)
 
                 # "variants" prunes parts of the tree, so all subsequent optimizations benefit
                 if "variants" in optimize:
-                    variantoptimizer.search(tree, variantSet, self.id)
+                    visitor.timed("variants", variantoptimizer.search, tree, variantSet, self.id)
 
                 # 'statics' has to come before 'privates', as it needs the original key names in tree
                 # if features should be removed recursively, this has to be controlled on the calling
@@ -260,21 +274,30 @@ class MClassCode(object):
                     if not featureMap:
                         console.warn("Empty feature map passed to static methods optimization; skipping")
                     elif self.type == 'static' and self.id in featureMap:
-                        featureoptimizer.patch(tree, self, featureMap)
+                        visitor.timed("statics", featureoptimizer.patch, tree, self, featureMap)
 
+                visitors = []
                 if "basecalls" in optimize:
-                    basecalloptimizer.patch(tree)
-
+                    visitors.append(basecalloptimizer.BaseCallVisitor())
                 if "privates" in optimize:
-                    privatesMap = load_privates()
-                    privateoptimizer.patch(tree, id, privatesMap)
-                    write_privates(privatesMap)
+                    lookup = privateoptimizer.LookupVisitor()
+                    visitors.append(lookup)
+                visitor.walk(tree, visitors)
+
+                visitors = []
+                if "privates" in optimize and lookup.names:
+                    replacements = privateoptimizer.allocate(lookup.names, cache.privates())
+                    visitors.append(privateoptimizer.UpdateVisitor(replacements))
+                if "strings" in optimize:
+                    strings = stringoptimizer.SearchVisitor()
+                    visitors.append(strings)
+                visitor.walk(tree, visitors)
 
                 if "strings" in optimize:
-                    tree = self._stringOptimizer(tree)
+                    tree = self._stringOptimizer(tree, strings.stringMap)
 
                 if "variables" in optimize:
-                    variableoptimizer.search(tree)
+                    visitor.timed("variables", variableoptimizer.search, tree)
             except Exception, e:
                 raise RuntimeError("Problem optimizing %s; probably a syntax problem?!" % self.id)
 
@@ -309,13 +332,14 @@ class MClassCode(object):
         # else we're working on the class tree, and can cache
         else:
             cacheId = getTreeCacheId(optimize, variantSet)
-            result, modtime = cache.read(cacheId, self.path)
+            shared  = self._isShareable(optimize)
+            result, modtime = cache.read(cacheId, self.path, shared=shared)
 
             if result == None:
                 result = getBestMatchingTree()
                 result = optimizeTree(result)
                 if not "statics" in optimize:  # can't cache static optimized trees
-                    cache.write(cacheId, result)
+                    cache.write(cacheId, result, dependsOn=self.path, shared=shared)
 
         return result
 
@@ -329,14 +353,23 @@ class MClassCode(object):
         return "[%s]" % ("-".join(optimize))
 
 
-    def _stringOptimizer(self, tree):
-        stringMap = stringoptimizer.search(tree)
+    ##
+    # Whether code optimized this way may go to the shared cache; names of
+    # privates are allocated from the local privates DB, so other workspaces
+    # might have given them different names
+    def _isShareable(self, optimize):
+        return "privates" not in optimize
+
+
+    def _stringOptimizer(self, tree, stringMap=None):
+        if stringMap is None:
+            stringMap = stringoptimizer.search(tree)
 
         if len(stringMap) == 0:
             return tree
 
         stringList = stringoptimizer.sort(stringMap)
-        stringoptimizer.replace(tree, stringList)
+        visitor.timed("strings-replace", stringoptimizer.replace, tree, stringList)
 
         # Build JS string fragments
         stringStart = "(function(){"
@@ -362,10 +395,45 @@ class MClassCode(object):
 
     ##
     # Convenience method for length of compiled class
-    # (Might become necessary if I want to cache the length).
     def getCompiledSize(self, compOptions, treegen=treegenerator, featuremap={}):
-        code = self.getCode(compOptions, treegen, featuremap)
-        return len(code)
+        if not self._sizeIsCached(compOptions):
+            return len(self.getCode(compOptions, treegen, featuremap))
+        return self.getCompiledSizes(compOptions, treegen, featuremap)[0]
+
+
+    ##
+    # Sizes of the compiled class, as (length, estimated gzip'ed length).
+    # They are recorded in the cache along with the compiled code (see
+    # getCode()), so the code itself is only compiled (or read) if the class
+    # hasn't been compiled with these options before.
+    def getCompiledSizes(self, compOptions, treegen=treegenerator, featuremap={}):
+        if not self._sizeIsCached(compOptions):
+            return self._codeSizes(self.getCode(compOptions, treegen, featuremap))
+
+        cache  = self.context["cache"]
+        sizeId = self._compiledCacheId(compOptions, "compiledsize")
+        shared = self._isShareable(compOptions.optimize)
+        sizes, _ = cache.read(sizeId, self.path, memory=True, shared=shared)
+        if sizes is None:
+            code = self.getCachedCode(compOptions)
+            if code is None:
+                code = self.getCode(compOptions, treegen, featuremap)  # records the sizes, too
+                sizes, _ = cache.read(sizeId, self.path, memory=True, shared=shared)
+            if sizes is None:
+                sizes = self._codeSizes(code)
+                cache.write(sizeId, sizes, memory=True, dependsOn=self.path, shared=shared)
+        return sizes
+
+
+    ##
+    # Source code is not compiled, and "statics" code depends on the feature map,
+    # so neither is cached
+    def _sizeIsCached(self, compOptions):
+        return compOptions.optimize and "statics" not in compOptions.optimize
+
+
+    def _codeSizes(self, code):
+        return (len(code), len(zlib.compress(code.encode("utf-8"))))
 
 
 
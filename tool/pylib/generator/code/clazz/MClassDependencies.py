@@ -33,6 +33,9 @@ from misc import util
 
 ClassesAll = None # {'cid':generator.code.Class}
 
+MethodDepsChanged = {}    # {'cid': (generator.code.Class, method deps)}, see flushMethodDeps()
+NoVariant = "<not set>"   # value of environment keys that are not in the variant set
+
 QXGLOBALS = [
     #"clazz",
     "qxvariants",
@@ -150,16 +153,31 @@ class MClassDependencies(object):
             return deps
 
 
+        ##
+        # Add the recursive load deps to the shallow ones. The order has to be
+        # stable, as it decides the order of the classes in the output: the
+        # shallow deps as they occur in the code, followed by the recursive
+        # ones of each, sorted (they come as sets, whose order differs with
+        # whether they were computed or taken from the cache).
         def buildTransitiveDeps(shallowDeps):
-            newLoad = set(shallowDeps['load'])
+            newLoad = []
+            seen = set()
+            def add(dep):
+                if dep not in seen:
+                    seen.add(dep)
+                    newLoad.append(dep)
+
+            for dep in shallowDeps['load']:
+                add(dep)
             classMaps = {}
             for dep in shallowDeps['load']:
                 if dep.needsRecursion:
                     recDeps = self.getTransitiveDeps(dep, variantSet, classMaps, force=force)  # need variantSet here (not relevantVariants), as the recursive deps might depend on any of those
-                    for recdep in recDeps:
+                    for recdep in sorted(recDeps, key=lambda d: (d.name, d.attribute, d.requestor, d.line)):
                         recdep.isLoadDep = True # all these become load dependencies
-                    newLoad.update(recDeps)
-            shallowDeps['load'] = list(newLoad)
+                        add(recdep)
+            self.flushMethodDeps()
+            shallowDeps['load'] = newLoad
 
             return shallowDeps
 
@@ -167,7 +185,7 @@ class MClassDependencies(object):
         ##
         # Check wether load dependencies are fresh which are included following
         # a depsItem.needsRecursion of the current class
-        def transitiveDepsAreFresh(depsStruct, cacheModTime):
+        def transitiveDepsAreFresh(depsStruct, cacheModTime, depDigests):
             result = True
             if cacheModTime is None:  # TODO: this can currently only occur with a Cache.memcache result
                 result = False
@@ -176,7 +194,12 @@ class MClassDependencies(object):
                     if dep.requestor != self.id: # this was included through a recursive traversal
                         if dep.name in ClassesAll:
                             classObj = ClassesAll[dep.name]
-                            if cacheModTime < classObj.m_time():
+                            if depDigests is not None:  # content mode
+                                if depDigests.get(dep.name) != classObj.digest():
+                                    console.debug("Invalidating dep cache for %s, as %s has changed" % (self.id, classObj.id))
+                                    result = False
+                                    break
+                            elif cacheModTime < classObj.m_time():
                             #if cacheModTime < classObj.library.mostRecentlyChangedFile()[1]:
                                 console.debug("Invalidating dep cache for %s, as %s is newer" % (self.id, classObj.id))
                                 result = False
@@ -191,6 +214,19 @@ class MClassDependencies(object):
                                 # have access to the script here in Class.
             
             return result
+
+        ##
+        # In content mode, record the digests of the classes that were
+        # included through recursive traversal, for transitiveDepsAreFresh()
+        def transitiveDepDigests(depsStruct):
+            if not self.context['cache'].isContentMode():
+                return None
+            digests = {}
+            for dep in depsStruct["load"]:
+                if dep.requestor != self.id and dep.name in ClassesAll:
+                    digests[dep.name] = ClassesAll[dep.name].digest()
+            return digests
+
         # -- Main ---------------------------------------------------------
 
         # handles cache and invokes worker function
@@ -203,16 +239,22 @@ class MClassDependencies(object):
         cached           = True
 
         classInfo, classInfoMTime = self._getClassCache()
-        (deps, cacheModTime) =  classInfo[cacheId] if cacheId in classInfo else (None,None)
+        depsEntry = classInfo.get(cacheId, (None, None))
+        (deps, cacheModTime) = depsEntry[:2]
+        depDigests = depsEntry[2] if len(depsEntry) > 2 else None  # (deps, time, digests) in content mode
 
         if (deps == None
           or force == True
-          or not transitiveDepsAreFresh(deps, cacheModTime)):
+          or not transitiveDepsAreFresh(deps, cacheModTime, depDigests)):
             cached = False
             deps = buildShallowDeps(tree)
             deps = buildTransitiveDeps(deps)
             if not tree: # don't cache for a passed-in tree
-                classInfo[cacheId] = (deps, time.time())
+                depDigests = transitiveDepDigests(deps)
+                if depDigests is None:
+                    classInfo[cacheId] = (deps, time.time())
+                else:
+                    classInfo[cacheId] = (deps, time.time(), depDigests)
                 self._writeClassCache(classInfo)
         
         return deps, cached
@@ -644,10 +686,16 @@ class MClassDependencies(object):
     # @out <string> class that defines method
     # @out <tree>   tree node value of methodId in the class map
 
-    def findClassForFeature(self, featureId, variants, classMaps):
+    #
+    # @param consulted  set to add the ids of the classes inspected to
+    # @param unresolved set to add the ids of unknown classes looked for to
+
+    def findClassForFeature(self, featureId, variants, classMaps, consulted=None, unresolved=None):
 
         # get the method name
         clazzId = self.id
+        if consulted is not None:
+            consulted.add(self.id)
         if  featureId == u'':  # corner case: bare class reference outside "new ..."
             return clazzId, featureId
         # TODO: The next doesn't provide much, qx.Class.getInstance has no new dependencies
@@ -664,6 +712,8 @@ class MClassDependencies(object):
         if clazzId not in ClassesAll: # can't further process non-qooxdoo classes
             # TODO: maybe this should better use something like isInterestingIdentifier()
             # to invoke the same machinery for filtering references like in other places
+            if unresolved is not None:
+                unresolved.add(clazzId)
             return None, None
 
         # early return if class id is finalized
@@ -699,8 +749,10 @@ class MClassDependencies(object):
             if featureId == "base":
                 classId = parents[0]  # first entry must be super-class
                 if classId in ClassesAll:
-                    return ClassesAll[classId].findClassForFeature('construct', variants, classMaps)
+                    return ClassesAll[classId].findClassForFeature('construct', variants, classMaps, consulted, unresolved)
                 else:
+                    if unresolved is not None:
+                        unresolved.add(classId)
                     return None, None
         includeVal = classMap.get('include', None)
         if includeVal:
@@ -728,9 +780,11 @@ class MClassDependencies(object):
         # go through all ancestors
         for parClass in parents:
             if parClass not in ClassesAll:
+                if unresolved is not None:
+                    unresolved.add(parClass)
                 continue
             parClassObj = ClassesAll[parClass]
-            rclass, keyval = parClassObj.findClassForFeature(featureId, variants, classMaps)
+            rclass, keyval = parClassObj.findClassForFeature(featureId, variants, classMaps, consulted, unresolved)
             if rclass:
                 return rclass, keyval
         return None, None
@@ -794,9 +848,15 @@ class MClassDependencies(object):
     #   - recurse on dependencies of defining class#method, adding them to the
     #     current dependencies
     #
-    # currently only a thin wrapper around its recursive sibling, getTransitiveDepsR
+    # Results are kept per class and method (see _methodDepsEntry()), together
+    # with the environment keys and classes that were consulted to compute
+    # them, so they are re-used for any variant set that agrees on those keys.
+    #
+    # @param usage  accumulator {'keys': set(), 'classes': set(), 'unknown': set()}
+    #               for the environment keys and classes the result depends on,
+    #               and the ids of the unknown classes it ran into
 
-    def getTransitiveDeps(self, depsItem, variants, classMaps, checkSet=None, force=False):
+    def getTransitiveDeps(self, depsItem, variants, classMaps, checkSet=None, force=False, usage=None):
 
         ##
         # find dependencies of a method <methodId> that has been referenced from
@@ -804,53 +864,60 @@ class MClassDependencies(object):
         #
         # @param deps accumulator variable set((c1,m1), (c2,m2),...)
         
-        def getTransitiveDepsR(dependencyItem, variantString, totalDeps):
+        def getTransitiveDepsR(dependencyItem, totalDeps, usage):
 
             # We don't add the in-param to the global result
             classId  = dependencyItem.name
             methodId = dependencyItem.attribute
             function_pruned = False
 
-            cacheId = "methoddeps-%r-%r-%r" % (classId, methodId, variantString)
-                # The bad thing here is that 'variantString' contains environment setting
-                # that normally have no influence on the dependencies (like
-                # 'qx.Application'). So cached deps are rejected for no reason (ex.
-                # building the demos of Demobrowser). But I cannot easily apply
-                # variant-projection here, as it only proves that the current class is
-                # independent of a specific environement key; but its recursive deps could
-                # well be. Fix: Get the shallow deps of the current method from cache, and then get the
-                # trans. deps of those items. They then could appy the same reasoning.
-            if not force:
-                # Check cache
-                cachedDeps, _ = cache.read(cacheId)  # no use to put this into a file, due to transitive dependencies to other files
-                if cachedDeps != None:
-                    console.debug("using cached result")
-                    #print "\nusing cached result for", classId, methodId
-                    return cachedDeps
-
-            # Need to calculate deps
-            console.dot("_")
-
             # Check known class
             if classId not in ClassesAll:
                 console.debug("Skipping unknown class of dependency: %s#%s (%s:%d)" % (classId, methodId,
                               dependencyItem.requestor, dependencyItem.line))
+                usage['unknown'].add(classId)
                 return set()
 
             # Check other class
             elif classId != self.id:
                 classObj = ClassesAll[classId]
-                otherdeps = classObj.getTransitiveDeps(dependencyItem, variants, classMaps, totalDeps, force)
+                otherdeps = classObj.getTransitiveDeps(dependencyItem, variants, classMaps, totalDeps, force, usage)
                 return otherdeps
 
+            if not force:
+                # Check cache
+                cached = self._methodDepsEntry(methodId, variants)
+                if cached != None:
+                    console.debug("using cached result")
+                    cachedDeps, keys, classes, unknown = cached
+                    usage['keys'].update(keys)
+                    usage['classes'].update(classes)
+                    usage['unknown'].update(unknown)
+                    return cachedDeps
+
+            # Need to calculate deps
+            console.dot("_")
+            myUsage = {'keys': set(), 'classes': set(), 'unknown': set()}
+
+            def done(result):
+                for key in usage:
+                    usage[key].update(myUsage[key])
+                return result
+
             # Check own hierarchy
-            defClassId, attribNode = self.findClassForFeature(methodId, variants, classMaps)
+            consulted = set()
+            defClassId, attribNode = self.findClassForFeature(methodId, variants, classMaps, consulted, myUsage['unknown'])
+            myUsage['classes'].update(consulted)
+            for clazzId in consulted:
+                myUsage['keys'].update(ClassesAll[clazzId].classVariants())
 
             # lookup error
             if not defClassId or defClassId not in ClassesAll:
+                if defClassId:
+                    myUsage['unknown'].add(defClassId)
                 console.debug("Skipping unknown definition of dependency: %s#%s (%s:%d)" % (classId, 
                               methodId, dependencyItem.requestor, dependencyItem.line))
-                return set()
+                return done(set())
             
             defDepsItem = DependencyItem(defClassId, methodId, classId)
             if dependencyItem.isCall:
@@ -861,9 +928,9 @@ class MClassDependencies(object):
             if defClassId != classId:
                 self.resultAdd(defDepsItem, localDeps)
                 defClass = ClassesAll[defClassId]
-                otherdeps = defClass.getTransitiveDeps(defDepsItem, variants, classMaps, totalDeps, force)
+                otherdeps = defClass.getTransitiveDeps(defDepsItem, variants, classMaps, totalDeps, force, myUsage)
                 localDeps.update(otherdeps)
-                return localDeps
+                return done(localDeps)
 
             # Process own deps
             console.debug("%s#%s dependencies:" % (classId, methodId))
@@ -894,7 +961,7 @@ class MClassDependencies(object):
                             continue
                         if self.resultAdd(depsItem, localDeps):
                             # Recurse dependencies
-                            downstreamDeps = getTransitiveDepsR(depsItem, variants, totalDeps.union(localDeps))
+                            downstreamDeps = getTransitiveDepsR(depsItem, totalDeps.union(localDeps), myUsage)
                             localDeps.update(downstreamDeps)
 
             # Cache update
@@ -902,22 +969,98 @@ class MClassDependencies(object):
             #       when the function is passed as a ref, rather than called (s. above
             #       around 'attribNode.getChild("function",...)')
             if not function_pruned:
-                cache.write(cacheId, localDeps, memory=True, writeToFile=False)
+                self._addMethodDepsEntry(methodId, variants, localDeps, myUsage)
              
             console.outdent()
-            return localDeps
+            return done(localDeps)
 
         # -- getTransitiveDeps -------------------------------------------------
 
-        cache = self.context['cache']
         console = self.context['console']
         checkset = checkSet or set()
-        variantString = util.toString(variants)
-        deps = getTransitiveDepsR(depsItem, variantString, checkset) # checkset is currently not used, leaving it for now
+        if usage is None:
+            usage = {'keys': set(), 'classes': set(), 'unknown': set()}
+        deps = getTransitiveDepsR(depsItem, checkset, usage) # checkset is currently not used, leaving it for now
 
         return deps
 
 
+    ##
+    # The cached transitive deps of a method, for the given variant set, as
+    # (deps, keys, classes, unknown), or None. A class keeps the entries of all
+    # its methods in one cache object, {method: [(projection, deps, classes,
+    # unknown, time, digests)]}, where classes are the (id, path) of the
+    # consulted classes. An entry applies if the variant set matches its
+    # projection on the environment keys it was computed with, none of the
+    # consulted classes has changed or moved since, and none of the unknown
+    # classes it ran into has turned up.
+
+    MethodDepsPerMethod = 8  # entries kept for different projections
+
+    def _methodDepsEntry(self, methodId, variants):
+        for entry in self._getMethodDeps().get(methodId, ()):
+            projection, deps, classes, unknown, computed, digests = entry
+            if any(variants.get(key, NoVariant) != value for key, value in projection):
+                continue
+            if not self._methodDepsAreFresh(classes, unknown, computed, digests):
+                continue
+            return deps, [key for key, value in projection], [clazzId for clazzId, path in classes], unknown
+        return None
+
+
+    def _methodDepsAreFresh(self, classes, unknown, computed, digests):
+        for clazzId, path in classes:
+            if clazzId not in ClassesAll:
+                return False
+            classObj = ClassesAll[clazzId]
+            if classObj.path != path:
+                return False
+            if digests is not None:  # content mode
+                if digests.get(clazzId) != classObj.digest():
+                    return False
+            elif computed < classObj.m_time():
+                return False
+        for name in unknown:
+            # unknown names are unsplit references, like "a.b.C.FOO" for a missing class a.b.C
+            parts = name.split(".")
+            if any(".".join(parts[:i]) in ClassesAll for i in range(1, len(parts) + 1)):
+                return False
+        return True
+
+
+    def _addMethodDepsEntry(self, methodId, variants, deps, usage):
+        methodDeps = self._getMethodDeps()
+        projection = tuple(sorted((key, variants.get(key, NoVariant)) for key in usage['keys']))
+        classes    = tuple(sorted((clazzId, ClassesAll[clazzId].path) for clazzId in usage['classes']))
+        unknown    = tuple(sorted(usage['unknown']))
+        if self.context['cache'].isContentMode():
+            digests = dict((clazzId, ClassesAll[clazzId].digest()) for clazzId, path in classes)
+        else:
+            digests = None
+        entries = [x for x in methodDeps.get(methodId, []) if x[0] != projection]
+        entries.append((projection, deps, classes, unknown, time.time(), digests))
+        methodDeps[methodId] = entries[-self.MethodDepsPerMethod:]
+        MethodDepsChanged[self.id] = (self, methodDeps)
+
+
+    def _getMethodDeps(self):
+        if self.id in MethodDepsChanged:
+            return MethodDepsChanged[self.id][1]
+        methodDeps, _ = self.context['cache'].read("methoddeps-%s" % self.path, self.path, memory=True)
+        return methodDeps if methodDeps is not None else {}
+
+
+    ##
+    # Write the method deps that have changed to the cache
+
+    @staticmethod
+    def flushMethodDeps():
+        for classObj, methodDeps in MethodDepsChanged.values():
+            classObj.context['cache'].write("methoddeps-%s" % classObj.path, methodDeps, memory=True,
+                                            dependsOn=classObj.path)
+        MethodDepsChanged.clear()
+
+
 
 ##
 # #ignore hints can have globs (like 'qx.test.*')
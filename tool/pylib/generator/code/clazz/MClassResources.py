@@ -25,7 +25,6 @@
 
 import sys, os, types, re, string, copy
 from generator.resource.AssetHint   import AssetHint
-from generator.resource.CombinedImage    import CombinedImage
 from generator import Context
 from misc import util
 from misc.securehash import sha_construct
@@ -61,6 +60,7 @@ class MClassResources(object):
                     assethint.clazz = self
                     assethint.expanded = e
                     assethint.regex = re.compile(e)
+                    assethint.prefix = AssetHint.pathPrefix(e)
                     if assethint not in iresult:
                         iresult.append(assethint)
             self._assetRegex[macroskey] = iresult
@@ -109,14 +109,6 @@ class MClassResources(object):
     @staticmethod
     def mapResourcesToClasses(libs, classes, assetMacros={}):
         
-        # Resource list
-        resources = []
-        for libObj in libs:
-            resources.extend(libObj.getResources()) # weightedness of same res id through order of script.libraries
-        # remove unwanted files
-        exclpatt = re.compile("\.(?:meta|py)$", re.I)
-        resources = [res for res in resources if not exclpatt.search(res.id)]
-        
         # Asset pattern list  -- this is basically an optimization, to condense
         # asset patterns
         #assetMacros = self._genobj._job.get('asset-let',{})
@@ -125,19 +117,19 @@ class MClassResources(object):
             assetHints.extend(clazz.getAssets(assetMacros))
             clazz.resources = set() #TODO: they might be filled by previous jobs, with different libs
 
-        # Go through resources and asset patterns
-        for res in resources:
+        # Go through asset patterns and the resources (and embedded images of
+        # combined images) below their path prefix; the resource index of a lib
+        # leaves out unwanted files (.meta, .py)
+        for libObj in libs:
+            resIndex = libObj.getResourceIndex()
+            candidates = {}  # {prefix: [(resId, res)]}
             for hint in assetHints:
-                # add direct matches
-                if hint.regex.match(res.id):
-                    hint.seen = True
-                    hint.clazz.resources.add(res)
-                # add matches of embedded images
-                if isinstance(res, CombinedImage):
-                    for embed in res.embeds:
-                        if hint.regex.match(embed.id):
-                            hint.seen = True
-                            hint.clazz.resources.add(res)
+                if hint.prefix not in candidates:
+                    candidates[hint.prefix] = resIndex.valuesBelow(hint.prefix)
+                for resId, res in candidates[hint.prefix]:
+                    if hint.regex.match(resId):
+                        hint.seen = True
+                        hint.clazz.resources.add(res)
 
         # Now that the resource mapping is done, check if we have unfullfilled hints
         for hint in assetHints:
@@ -48,7 +48,8 @@ Arguments:
         self.add_option("-l", "--logfile", dest="logfile", metavar="FILENAME", default=None, type="string", help="log file")
         self.add_option("-s", "--stacktrace", action="store_true", dest="stacktrace", default=False, help="enable stack traces on fatal exceptions")
         self.add_option("-m", "--macro", dest="letmacros", metavar="KEY:VAL", action="map", type="string", default={}, help="define/overwrite a global 'let' macro KEY with value VAL")
-        self.add_option("-d", "--daemon", dest="daemon", action="store_true", default=False, help="(EXPERIMENTAL - DON'T USE) puts the generator in daemon mode")
+        self.add_option("-d", "--daemon", dest="daemon", action="store_true", default=False, help="run as a daemon for the config file; later invocations for the same config file are handed over to it")
+        self.add_option("--no-daemon", dest="no_daemon", action="store_true", default=False, help="run locally, even if a daemon is serving the config file")
         
         # Dynamic options (currently not supported)
         #self.add_option("--setting", action="extend", dest="settings", metavar="KEY:VALUE", type="string", default=[], help="Used settings")
@@ -81,6 +81,7 @@ class Key(object):
                 "provider"      : types.DictType,
                 "require"       : types.DictType,
                 RUN_KEY         : types.ListType,
+                "run-time"      : types.DictType,
                 "settings"      : types.DictType,
                 "shell"         : types.DictType,
                 "slice-images"  : types.DictType,
@@ -20,15 +20,38 @@
 ################################################################################
 
 
+import re
+
 class AssetHint(object):
-    __slots__ = ("source", "expanded", "regex", "clazz", "seen")
+    __slots__ = ("source", "expanded", "regex", "prefix", "clazz", "seen")
 
     def __init__ (self, source=""):
         self.source   = source  # "qx/icon/${qx.icontheme}/32/*"
         self.expanded = u""   # "qx/icon/Tango/32/.*"
         self.regex    = None  # re.compile("qx/icon/Tango/32/.*")
+        self.prefix   = u""   # "qx/icon/Tango/32", see pathPrefix()
         self.clazz    = None  # classObj that uses this hint
         self.seen     = False # whether a resource has matched this hint
 
+    _regexChars = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+    ##
+    # Returns the leading path segments of an expanded hint that are plain
+    # text, so that every resource id the hint matches lies below them
+    # ("qx/icon/Tango/32/.*" -> "qx/icon/Tango/32"; "" if there are none).
+    @staticmethod
+    def pathPrefix(expanded):
+        if "|" in expanded:  # alternatives
+            return u""
+        mo = AssetHint._regexChars.search(expanded)
+        if mo:
+            literal = expanded[:mo.start()]
+            if mo.group() in "*+?{":  # quantifier of the last char
+                literal = literal[:-1]
+        else:
+            literal = expanded
+        pos = literal.rfind("/")
+        return literal[:pos] if pos > -1 else u""
+
     def __eq__ (self, other):
         return self.expanded == other.expanded
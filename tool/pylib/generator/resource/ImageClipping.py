@@ -33,10 +33,24 @@
 #</pre>
 ##
 
-import sys, os, glob, shutil, tempfile
+import sys, os, glob, shutil, tempfile, signal
 
 from misc                      import filetool
 from generator.resource.Image  import Image
+from generator.resource.Raster import Raster, RasterError
+from generator.runtime.FileDigests import FileDigests
+
+##
+# Combined images are written by forked processes if 'run-time/num-processes'
+# is set (see ImageClipping.combineImages())
+
+def _initCombineWorker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the generator process handles interrupts
+
+
+def _writeCombined(task):
+    config, combined, orientation, changed = task
+    ImageClipping.writeCombined(config, combined, orientation, changed)
 
 
 class ImageClipping(object):
@@ -62,92 +76,203 @@ class ImageClipping(object):
         else:
             single_border = False
 
-        # split
+        # split into regions: (width, height, left, top, file suffix)
+        regions = []
         if single_border:
-            os.system(crop_cmd % (source_file, border, border, 0, 0, dest_file + "-tl.png"))
-            os.system(crop_cmd % (source_file, border, border, border, 0, dest_file + "-t.png"))
-            os.system(crop_cmd % (source_file, border, border, width-border, 0, dest_file + "-tr.png"))
+            regions.append((border, border, 0, 0, "-tl.png"))
+            regions.append((border, border, border, 0, "-t.png"))
+            regions.append((border, border, width-border, 0, "-tr.png"))
     
-            os.system(crop_cmd % (source_file, border, height-2*border, 0, border, dest_file + "-l.png"))
+            regions.append((border, height-2*border, 0, border, "-l.png"))
             if trim_width:
-                os.system(crop_cmd % (source_file, min(20, width-2*border), height-2*border, border, border, dest_file + "-c.png"))            
+                regions.append((min(20, width-2*border), height-2*border, border, border, "-c.png"))
             else:
-                os.system(crop_cmd % (source_file, width-2*border, height-2*border, border, border, dest_file + "-c.png"))
-            os.system(crop_cmd % (source_file, border, height-2*border, width-border, border, dest_file + "-r.png"))
+                regions.append((width-2*border, height-2*border, border, border, "-c.png"))
+            regions.append((border, height-2*border, width-border, border, "-r.png"))
     
-            os.system(crop_cmd % (source_file, border, border, 0, height-border, dest_file + "-bl.png"))
-            os.system(crop_cmd % (source_file, border, border, border, height-border, dest_file + "-b.png"))
-            os.system(crop_cmd % (source_file, border, border, width-border, height-border, dest_file + "-br.png"))
+            regions.append((border, border, 0, height-border, "-bl.png"))
+            regions.append((border, border, border, height-border, "-b.png"))
+            regions.append((border, border, width-border, height-border, "-br.png"))
         else:
             if border[0] > 0 and border[3] > 0:
-                os.system(crop_cmd % (source_file, border[3], border[0], 0, 0, dest_file + "-tl.png"))
+                regions.append((border[3], border[0], 0, 0, "-tl.png"))
             if border[0] > 0:
-                os.system(crop_cmd % (source_file, width - border[3] - border[1], border[0], border[3], 0, dest_file + "-t.png"))
+                regions.append((width - border[3] - border[1], border[0], border[3], 0, "-t.png"))
             if border[0] > 0 and border[1] > 0:
-                os.system(crop_cmd % (source_file, border[1], border[0], width - border[1], 0, dest_file + "-tr.png"))
-            if border[3] > 0:            
-                os.system(crop_cmd % (source_file, border[3], height - border[0] - border[2], 0, border[0], dest_file + "-l.png"))
+                regions.append((border[1], border[0], width - border[1], 0, "-tr.png"))
+            if border[3] > 0:
+                regions.append((border[3], height - border[0] - border[2], 0, border[0], "-l.png"))
             if trim_width:
-                os.system(crop_cmd % (source_file, min(20, width- border[3] - border[1]), height - border[0] - border[2], border[3], border[0], dest_file + "-c.png"))            
+                regions.append((min(20, width- border[3] - border[1]), height - border[0] - border[2], border[3], border[0], "-c.png"))
             else:
-                os.system(crop_cmd % (source_file, width- border[3] - border[1], height - border[0] - border[2], border[3], border[0], dest_file + "-c.png"))
+                regions.append((width- border[3] - border[1], height - border[0] - border[2], border[3], border[0], "-c.png"))
             if border[1] > 0:
-                os.system(crop_cmd % (source_file, border[1], height - border[0] - border[2], width - border[1], border[0], dest_file + "-r.png"))
+                regions.append((border[1], height - border[0] - border[2], width - border[1], border[0], "-r.png"))
             if border[2] > 0 and border[3] > 0:
-                os.system(crop_cmd % (source_file, border[3], border[2], 0, height - border[2], dest_file + "-bl.png"))
+                regions.append((border[3], border[2], 0, height - border[2], "-bl.png"))
             if border[2] > 0:
-                os.system(crop_cmd % (source_file, width- border[3] - border[1], border[2], border[3], height - border[2], dest_file + "-b.png"))
+                regions.append((width- border[3] - border[1], border[2], border[3], height - border[2], "-b.png"))
             if border[2] > 0 and border[1] > 0:
-                os.system(crop_cmd % (source_file, border[1], border[2], width - border[1], height - border[2], dest_file + "-br.png"))
+                regions.append((border[1], border[2], width - border[1], height - border[2], "-br.png"))
+
+        # nothing to do if the source and the regions are the same as last time
+        cacheId = "slice-%s" % dest_file
+        cached, _ = self._cache.read(cacheId, source_file)
+        outputs = [dest_file + region[4] for region in regions] + [dest_file + ".png"]
+        if cached == regions and all(os.path.exists(x) for x in outputs):
+            self._console.debug("Slices of %s are up to date" % source_file)
+            return
+
+        try:
+            raster = Raster.read(source_file)
+        except RasterError:
+            raster = None  # leave it to ImageMagick
+        for reg_width, reg_height, left, top, suffix in regions:
+            if raster:
+                clip = raster.crop(reg_width, reg_height, left, top)
+                if clip.width and clip.height:
+                    clip.write(dest_file + suffix)
+                else:
+                    self._console.warn("Empty region %sx%s+%s+%s in %s, skipping" % (
+                        reg_width, reg_height, left, top, source_file))
+            else:
+                os.system(crop_cmd % (source_file, reg_width, reg_height, left, top, dest_file + suffix))
         
         # for css3, the original images are used
         shutil.copyfile(source_file, dest_file + ".png")
+        self._cache.write(cacheId, regions, dependsOn=source_file)
 
 
     def combine(self, combined, files, horizontal, type="extension"):
-        self._console.indent()
-        if horizontal:
-            orientation = "x1"
-        else:
-            orientation = "1x"
-
-        # combine
-        config = []
-        clips = []
-        top = 0
-        left = 0
-        allfiles = []
-        for file in files:
-            allfiles.extend(glob.glob(file))
-        #self._console.debug("Combining the following images: %r" % allfiles)
-        for file in allfiles:
-            if not os.path.exists(file):
-                self._console.warn("Non-existing file spec, skipping: %s" % file)
-                continue
-            clips.append(file)
-            imginfo = Image(file).getInfoMap()
-            width, height = imginfo['width'], imginfo['height']
-            config.append({'file':file, 'combined':combined, 'left': -left,
-                           'top': -top, 'width':width, 'height':height, 'type':imginfo['type']})
+        return self.combineImages([(combined, files, horizontal, type)])[0]
+
+
+    ##
+    # Create the combined images of specs [(combined, files, horizontal, type)],
+    # and return the config of each (see combine()). The images can be written
+    # in parallel, by numProcs processes.
+    #
+    # The inputs of each combined image (files, sizes, digests, orientation)
+    # are recorded in the cache; a combined image is only written again if
+    # they, or the image itself, have changed since.
+    def combineImages(self, specs, numProcs=0):
+        configs = []
+        tasks   = []  # [(config, combined, orientation, changed files)]
+        inputs  = []  # [(combined, inputs)], of the tasks
+        for combined, files, horizontal, type in specs:
+            self._console.indent()
             if horizontal:
-                left += width
+                orientation = "x1"
             else:
-                top += height
+                orientation = "1x"
 
-        if len(clips) == 0:
-            self._console.warn("No images to combine; skipping")
+            # combine
+            config = []
+            clips = []
+            top = 0
+            left = 0
+            allfiles = []
+            for file in files:
+                allfiles.extend(glob.glob(file))
+            #self._console.debug("Combining the following images: %r" % allfiles)
+            for file in allfiles:
+                if not os.path.exists(file):
+                    self._console.warn("Non-existing file spec, skipping: %s" % file)
+                    continue
+                clips.append(file)
+                imginfo = Image(file).getInfoMap()
+                width, height = imginfo['width'], imginfo['height']
+                config.append({'file':file, 'combined':combined, 'left': -left,
+                               'top': -top, 'width':width, 'height':height, 'type':imginfo['type']})
+                if horizontal:
+                    left += width
+                else:
+                    top += height
+
+            if len(clips) == 0:
+                self._console.warn("No images to combine; skipping")
+            else:
+                filetool.directory(os.path.dirname(combined))
+                if type == "extension":
+                    imgInputs = (orientation, [(clip['file'], clip['width'], clip['height'],
+                                                FileDigests.compute(clip['file'])) for clip in config])
+                    changed = self._changedInputs(combined, imgInputs)
+                    if changed == []:
+                        self._console.debug("Combined image is up to date: %s" % combined)
+                    else:
+                        tasks.append((config, combined, orientation, changed))
+                        inputs.append((combined, imgInputs))
+                elif type == "base64":
+                    self.combineBase64(config)
+
+            self._console.outdent()
+            configs.append(config)
+
+        if numProcs > 0 and len(tasks) > 1 and hasattr(os, 'fork'):
+            self._console.debug("Writing %d combined images with %d processes" % (len(tasks), numProcs))
+            import multiprocessing  # Python 2.6+, so only when asked for
+            pool = multiprocessing.Pool(min(numProcs, len(tasks)), _initCombineWorker)
+            try:
+                pool.map(_writeCombined, tasks, chunksize=1)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
         else:
-            filetool.directory(os.path.dirname(combined))
-            if type == "extension":
-                self.combineImgMagick(clips, combined, orientation)
-            elif type == "base64":
-                self.combineBase64(config)
+            for task in tasks:
+                _writeCombined(task)
+
+        for combined, imgInputs in inputs:
+            self._cache.write("combined-%s" % combined, (imgInputs, FileDigests.compute(combined)))
+
+        return configs
 
-        self._console.outdent()
-        return config
+
+    ##
+    # Compare imgInputs with the inputs combined was last written from. Returns
+    # the input files that have changed if the layout is still the same (i.e.
+    # [] if combined is up to date), otherwise None.
+    def _changedInputs(self, combined, imgInputs):
+        cached, _ = self._cache.read("combined-%s" % combined)
+        if cached is None or not os.path.exists(combined) or FileDigests.compute(combined) != cached[1]:
+            return None
+        (orientation, inputs), (cachedOrientation, cachedInputs) = imgInputs, cached[0]
+        if orientation != cachedOrientation or [x[:3] for x in inputs] != [x[:3] for x in cachedInputs]:
+            return None
+        return [x[0] for x, y in zip(inputs, cachedInputs) if x[3] != y[3]]
+
+
+    ##
+    # Write the combined image of the clipped images in config; PNG and GIF
+    # files are handled in-process, everything else by ImageMagick. If only
+    # the changed files have to be replaced, the others are taken from the
+    # existing combined image.
+    @staticmethod
+    def writeCombined(config, combined, orientation, changed=None):
+        try:
+            if changed is not None:
+                canvas = Raster.read(combined)
+                clips  = [clip for clip in config if clip['file'] in changed]
+            else:
+                canvas = None
+                clips  = config
+            rasters = [Raster.read(clip['file']) for clip in clips]
+            if canvas is None:
+                if orientation == "x1":
+                    canvas = Raster(sum(x.width for x in rasters), max(x.height for x in rasters))
+                else:
+                    canvas = Raster(max(x.width for x in rasters), sum(x.height for x in rasters))
+            for clip, raster in zip(clips, rasters):
+                canvas.paste(raster, -clip['left'], -clip['top'])
+            canvas.write(combined)
+        except RasterError:
+            ImageClipping.combineImgMagick([clip['file'] for clip in config], combined, orientation)
 
 
-    def combineImgMagick(self, clips, combined, orientation):
+    @staticmethod
+    def combineImgMagick(clips, combined, orientation):
         montage_cmd = "montage -geometry +0+0 -gravity NorthWest -tile %s -background None %s %s"
         (fileDescriptor, tempPath) = tempfile.mkstemp(text=True, dir=os.curdir)
         temp = os.fdopen(fileDescriptor, "w")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Index of the image files below a resource folder, with their
+# (width, height, type) as found by Image.sniff().
+#
+# An entry is valid as long as the file's stamp from the Snapshot is the same,
+# i.e. its digest in content mode, its size and mtime otherwise. The index is
+# kept in the cache on its own, so it survives re-scans of the whole library
+# (e.g. after the Manifest has changed) and is shared by all jobs using the
+# same resource folder; it is read and written in one piece.
+##
+
+from generator.resource.Image import Image
+from generator import Context as context
+
+
+class ImageIndex(object):
+
+    def __init__(self, root):
+        self.root     = root
+        self._entries = {}    # {path: (stamp, (width, height, type))}
+        self._dirty   = False
+
+
+    def _cacheId(self):
+        return "imginfo-%s" % self.root
+
+
+    ##
+    # The index for root from the cache, or an empty one
+    @staticmethod
+    def load(root):
+        index, _ = context.cache.read("imginfo-%s" % root, memory=True)
+        if not isinstance(index, ImageIndex):
+            index = ImageIndex(root)
+        return index
+
+
+    ##
+    # Write the index back to the cache, if anything has changed
+    def save(self):
+        if self._dirty:
+            self._dirty = False
+            context.cache.write(self._cacheId(), self, memory=True)
+
+
+    ##
+    # (width, height, type) of the image at path, or None
+    #
+    # @param stat  the file's (size, mtime, inode, digest), see Snapshot.stat()
+    def info(self, path, stat):
+        stamp = stat[3] or stat[:2]
+        entry = self._entries.get(path)
+        if entry and entry[0] == stamp:
+            return entry[1]
+        imgInfo = Image.sniff(path)
+        self._entries[path] = (stamp, imgInfo)
+        self._dirty = True
+        return imgInfo
+
+
+    ##
+    # Forget the files that are not contained in snapshot any more
+    def prune(self, snapshot):
+        for path in [path for path in self._entries if path not in snapshot]:
+            del self._entries[path]
+            self._dirty = True
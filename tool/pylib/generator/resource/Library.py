@@ -20,9 +20,10 @@
 #
 ################################################################################
 
-import os, re, sys, unicodedata as unidata
+import os, re, sys, signal, unicodedata as unidata
 
 from misc                         import filetool, Path
+from misc.Trie                    import Trie
 from misc.NameSpace               import NameSpace
 from ecmascript.frontend          import lang, treeutil
 from generator.code.Class         import Class
@@ -30,6 +31,8 @@ from generator.code.qcEnvClass    import qcEnvClass
 from generator.resource.Resource  import Resource
 from generator.resource.Image     import Image
 from generator.resource.CombinedImage    import CombinedImage
+from generator.resource.ImageIndex       import ImageIndex
+from generator.resource.Snapshot  import Snapshot
 from generator.action.ContribLoader      import ContribLoader
 from generator.config.Manifest    import Manifest
 from generator.config.ConfigurationError import ConfigurationError
@@ -39,6 +42,57 @@ from generator                    import Context as context
 # pickle complains when I use NameSpace!?
 class C(object): pass
 
+##
+# Bulk parsing for Library._scanClassPath(), with forked processes if
+# 'run-time/num-processes' is set. Small batches are not worth the start-up
+# costs and are done in-line.
+
+_PARALLEL_MIN = 64
+_PARSE_FAILED = ("parse failed",)
+
+##
+# Returns the code id of each class, or _PARSE_FAILED where the worker ran
+# into an error (the caller repeats those, to get the exception). The workers
+# put the syntax trees into the cache, where the generator process picks
+# them up later.
+
+_parseJob = None  # (library, classes), inherited by the forked workers
+
+def _parseCodeIds(library, classes, numProcs):
+    global _parseJob
+    if numProcs > 0 and len(classes) >= _PARALLEL_MIN and hasattr(os, 'fork'):
+        library._console.debug("Parsing %d classes with %d processes" % (len(classes), numProcs))
+        import multiprocessing  # Python 2.6+, so only when asked for
+        _parseJob = (library, classes)
+        pool = multiprocessing.Pool(numProcs, _initParseWorker)
+        try:
+            codeIds = pool.map(_parseCodeId, range(len(classes)), chunksize=_PARALLEL_MIN // 4)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _parseJob = None
+        return codeIds
+    else:
+        return [_PARSE_FAILED] * len(classes)  # i.e. parse them in-line
+
+
+def _initParseWorker():
+    import multiprocessing.util
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the generator process handles interrupts
+    multiprocessing.util.Finalize(None, context.cache.flush, exitpriority=10)  # run when the pool closes
+
+
+def _parseCodeId(num):
+    library, classes = _parseJob
+    try:
+        return library._getCodeId(classes[num])
+    except Exception:
+        return _PARSE_FAILED
+
+
 ##
 # Represents a qooxdoo library
 class Library(object):
@@ -51,6 +105,7 @@ class Library(object):
         self._docs = {}
         self._translations = {}
         self.resources  = set()
+        self._resourceIndex = None  # see getResourceIndex()
 
         #self._init_from_manifest(libconfig)
         self._libconfig = libconfig
@@ -62,6 +117,7 @@ class Library(object):
         self.categories["resources"] = {}
         
         self.__youngest = (None, None) # to memoize youngest file in lib
+        self._snapshots = {}  # {category: Snapshot}, as of the last scan
 
 
     def _init_from_manifest(self, libconfig=None):
@@ -81,6 +137,8 @@ class Library(object):
 
         self.manifest = context.config.absPath(os.path.normpath(manipath))
         manifest = Manifest(self.manifest)
+        manistat = os.stat(self.manifest)
+        self.manifestStamp = (manistat.st_size, manistat.st_mtime)  # cached libs with another stamp are stale
         
         self.path = os.path.dirname(self.manifest)
         self.uri = libconfig.get("uri", None)
@@ -144,6 +202,7 @@ class Library(object):
         # the Log object (the StreamWriter for a potential log file) makes
         # problems on unpickling
         del d['_console']
+        d['_resourceIndex'] = None  # re-built on demand
         return d
 
 
@@ -151,9 +210,17 @@ class Library(object):
     # unpickling: update state
     def __setstate__(self, d):
         d['_console']      = context.console
+        d['_resourceIndex'] = None
         self.__dict__ = d
 
 
+    ##
+    # forget the memoized mostRecentlyChangedFile(), so the next call looks at
+    # the file system again (e.g. in a long-running process)
+    def resetYoungest(self):
+        self.__youngest = (None, None)
+
+
     def mostRecentlyChangedFile(self, force=False):
         if self.__youngest != (None,None) and not force:
             return self.__youngest
@@ -200,17 +267,59 @@ class Library(object):
     def getResources(self):
         return self.resources
 
-    def scan(self, timeOfLastScan=0):
+    _resourceExclPatt = re.compile(r"\.(?:meta|py)$", re.I)
+
+    ##
+    # The resources as a Trie over the path segments of their ids, with
+    # (resId, res) values; the images embedded in a combined image are entered
+    # with their own ids, leading to the combined image. .meta and .py files
+    # are left out. The index is kept until the resources change.
+    def getResourceIndex(self):
+        if self._resourceIndex is None:
+            index = Trie("/")
+            for res in self.resources:
+                if self._resourceExclPatt.search(res.id):
+                    continue
+                index.add(res.id, (res.id, res))
+                if isinstance(res, CombinedImage):
+                    for embed in res.embeds:
+                        index.add(embed.id, (embed.id, res))
+            self._resourceIndex = index
+        return self._resourceIndex
+
+    ##
+    # Bring classes, translations and resources up to date with the file
+    # system. Only files that have been added, changed or removed since the
+    # last scan are processed (see Snapshot). Returns whether anything has
+    # changed.
+    def scan(self):
         self._console.debug("Scanning %s..." % self.path)
         self._console.indent()
 
-        scanres = self._scanClassPath(timeOfLastScan)
-        self._classes = scanres[0]
-        self._docs    = scanres[1]
-        self._scanTranslationPath(os.path.join(self.path, self.translationPath))
-        self._scanResourcePath(os.path.join(self.path, self.resourcePath))
+        changed = self._scanClassPath()
+        changed = self._scanTranslationPath(os.path.join(self.path, self.translationPath)) or changed
+        changed = self._scanResourcePath(os.path.join(self.path, self.resourcePath)) or changed
 
         self._console.outdent()
+        return changed
+
+
+    ##
+    # (Re-)watch the library's folders for changes, in a long-running process
+    def watch(self):
+        for snapshot in self._snapshots.values():
+            snapshot.watch()
+
+
+    def _updateSnapshot(self, category, root, extensions=None, skipDotFiles=False):
+        snapshot = self._snapshots.get(category)
+        if snapshot is None or snapshot.root != root:
+            snapshot = self._snapshots[category] = Snapshot(root, self._ignoredDirEntries, extensions, skipDotFiles)
+        digest = context.cache.digest if context.cache.isContentMode() else None
+        delta  = snapshot.update(digest, context.jobconf.get("run-time/num-processes", 0))
+        if delta:
+            self._console.debug("%s: %r" % (category.capitalize(), delta))
+        return snapshot, delta
 
 
     def _getCodeId1(self, fileContent):
@@ -297,44 +406,58 @@ class Library(object):
         if not os.path.exists(path):
             raise ValueError("The given resource path does not exist: %s" % path)
 
+        path = os.path.abspath(path)
+        snapshot, delta = self._updateSnapshot("resources", path)
+        if not delta:
+            return False
+
         self._console.debug("Scanning resource folder...")
 
-        path = os.path.abspath(path)
         lib_prefix_len = len(path)
         if not path.endswith(os.sep):
             lib_prefix_len += 1
 
-        self.resources = set()
-        for root, dirs, files in filetool.walk(path):
-            # filter ignored directories
-            for dir in dirs:
-                if self._ignoredDirEntries.match(dir):
-                    dirs.remove(dir)
+        resources = dict((res.path, res) for res in self.resources)
+        for fpath in delta.changed + delta.removed:
+            resources.pop(fpath, None)
 
-            for file in files:
-                if self._ignoredDirEntries.match(file):
-                    continue
-                fpath = os.path.join(root, file)
-                fpath = os.path.normpath(fpath)
-                if Image.isImage(fpath):
-                    if CombinedImage.isCombinedImage(fpath):
-                        res = CombinedImage(fpath)
-                    else:
-                        res = Image(fpath)
-                    res.analyzeImage()
+        # combined images depend on their .meta file as well
+        metaStems = set(os.path.splitext(fpath)[0] for fpath in delta.added + delta.changed + delta.removed
+                        if fpath.endswith(".meta"))
+        combined  = [fpath for fpath in resources if os.path.splitext(fpath)[0] in metaStems and Image.isImage(fpath)]
+
+        imgIndex = ImageIndex.load(path)
+        imgIndex.prune(snapshot)
+
+        for fpath in delta.added + delta.changed + combined:
+            if Image.isImage(fpath):
+                # combined images come with a .meta file (cf. CombinedImage.isCombinedImage)
+                if os.path.splitext(fpath)[0] + ".meta" in snapshot:
+                    res = CombinedImage(fpath)
                 else:
-                    res = Resource(fpath)
-                
-                res.set_id(Path.posifyPath(fpath[lib_prefix_len:]))
-                res.library= self
+                    res = Image(fpath)
+                stat    = snapshot.stat(fpath)
+                imgInfo = imgIndex.info(fpath, stat)
+                if imgInfo:
+                    res.width, res.height, res.format = imgInfo
+                res.analyzeImage()
+                res.digest_ = stat[3]
+            else:
+                res = Resource(fpath)
+
+            res.set_id(Path.posifyPath(fpath[lib_prefix_len:]))
+            res.library= self
 
-                self.resources.add(res)
+            resources[fpath] = res
 
-        return
+        imgIndex.save()
+        self.resources = set(resources.values())
+        self._resourceIndex = None
+        return True
 
 
 
-    def _scanClassPath(self, timeOfLastScan=0):
+    def _scanClassPath(self):
 
         codeIdFromTree = True  # switch between regex- and tree-based codeId search
 
@@ -343,21 +466,28 @@ class Library(object):
         if not os.path.isdir(classPath):
             raise ConfigurationError("Class path from Manifest doesn't exist: %s" % self.classPath)
 
-        # Check multiple namespaces
-        if not len([d for d in os.listdir(classPath) if not d.startswith(".")]) == 1:
-            self._console.warn ("The class path must contain exactly one namespace; ignoring everything else: '%s'" % (classPath,))
-
         # Check Manifest namespace matches file system
         nsPrefix    = self.namespace.replace(".", os.sep)
         classNSRoot = os.path.join(classPath, nsPrefix)
         if not os.path.isdir(classNSRoot):
             raise ValueError ("Manifest namespace does not exist on file system:  '%s'" % (classNSRoot))
-            
+
+        snapshot, delta = self._updateSnapshot("classes", classNSRoot, (".js",), skipDotFiles=True)
+        if not delta:
+            return False
+
+        # Check multiple namespaces
+        if not len([d for d in os.listdir(classPath) if not d.startswith(".")]) == 1:
+            self._console.warn ("The class path must contain exactly one namespace; ignoring everything else: '%s'" % (classPath,))
+
         self._console.debug("Scanning class folder...")
 
-        classList = []
-        existClassIds = dict([(x.id,x) for x in self._classes])  # if we scanned before
-        docs = {}
+        classes = dict((clazz.path, clazz) for clazz in self._classes)  # if we scanned before
+        docs    = dict((doc["path"], doc) for doc in self._docs.values())
+        for filePath in delta.changed + delta.removed:
+            classes.pop(filePath, None)
+            docs.pop(filePath, None)
+        numProcs = context.jobconf.get("run-time/num-processes", 0)
 
 
         # TODO: Clazz still relies on a context dict!
@@ -367,152 +497,138 @@ class Library(object):
         contextdict["jobconf"] = context.jobconf
         contextdict["envchecksmap"] = {}
 
+        toParse = []
+
         # Iterate...
-        for root, dirs, files in filetool.walk(classNSRoot):
-            # Filter ignored directories
-            for ignoredDir in dirs:
-                if self._ignoredDirEntries.match(ignoredDir):
-                    dirs.remove(ignoredDir)
-
-            # Add good directories
-            currNameSpace = root[len(classNSRoot+os.sep):]
-            currNameSpace = currNameSpace.replace(os.sep, ".")  # TODO: var name
-            
-            # Searching for files
-            for fileName in files:
-                # Ignore dot files
-                if fileName.startswith(".") or self._ignoredDirEntries.match(fileName):
-                    continue
-                self._console.dot()
-
-                # Process path data
-                filePath = os.path.join(root, fileName)
-                fileRel  = filePath.replace(classNSRoot + os.sep, "")  # now only path fragment *afte* NS
-                fileExt  = os.path.splitext(fileName)[-1]
-                fileStat = os.stat(filePath)
-                fileSize = fileStat.st_size
-                fileMTime= fileStat.st_mtime
-
-                # Compute full URI from relative path
-                fileUri = self.classUri + "/" + fileRel.replace(os.sep, "/")
-
-                # Compute identifier from relative path
-                filePathId = fileRel.replace(fileExt, "").replace(os.sep, ".")
-                filePathId = self.namespace + "." + filePathId     # e.g. "qx.core.Environment"
-                filePathId = unidata.normalize("NFC", filePathId)  # combine combining chars: o" -> ö
-                fileId     = nsPrefix + "/" + fileRel  # e.g. "qx/core/Environment.js"
-
-                # check if known and fresh
-                if (filePathId in existClassIds
-                    and fileMTime < timeOfLastScan):
-                    classList.append(existClassIds[filePathId])
-                    #print "re-using existing", filePathId
-                    continue # re-use known class
-
-                # Extract package ID
-                filePackage = filePathId[:filePathId.rfind(".")]
-
-                # Handle doc files
-                if fileName == self._docFilename:
-                    fileFor = filePathId[:filePathId.rfind(".")]
-                    docs[filePackage] = {
-                        "relpath" : fileId,
-                        "path" : filePath,
-                        "encoding" : self.encoding,
-                        "namespace" : self.namespace,
-                        "id" : filePathId,
-                        "package" : filePackage,
-                        "size" : fileSize
-                    }
-
-                    # Stop further processing
-                    continue
+        for filePath in sorted(delta.added + delta.changed):
+            self._console.dot()
+
+            # Process path data
+            fileName = os.path.basename(filePath)
+            fileRel  = filePath.replace(classNSRoot + os.sep, "")  # now only path fragment *afte* NS
+            fileExt  = os.path.splitext(fileName)[-1]
+            fileSize, fileMTime, _, fileDigest = snapshot.stat(filePath)
+
+            # Compute full URI from relative path
+            fileUri = self.classUri + "/" + fileRel.replace(os.sep, "/")
+
+            # Compute identifier from relative path
+            filePathId = fileRel.replace(fileExt, "").replace(os.sep, ".")
+            filePathId = self.namespace + "." + filePathId     # e.g. "qx.core.Environment"
+            filePathId = unidata.normalize("NFC", filePathId)  # combine combining chars: o" -> ö
+            fileId     = nsPrefix + "/" + fileRel  # e.g. "qx/core/Environment.js"
+
+            # Extract package ID
+            filePackage = filePathId[:filePathId.rfind(".")]
+
+            # Handle doc files
+            if fileName == self._docFilename:
+                fileFor = filePathId[:filePathId.rfind(".")]
+                docs[filePath] = {
+                    "relpath" : fileId,
+                    "path" : filePath,
+                    "encoding" : self.encoding,
+                    "namespace" : self.namespace,
+                    "id" : filePathId,
+                    "package" : filePackage,
+                    "size" : fileSize
+                }
+
+                # Stop further processing
+                continue
 
-                # Ignore non-script
-                if os.path.splitext(fileName)[-1] != ".js":
-                    continue
+            if filePathId == "qx.core.Environment":
+                clazz = qcEnvClass(filePathId, filePath, self, contextdict)
+            else:
+                clazz = Class(filePathId, filePath, self, contextdict)
+
+            # Store file data
+            clazz.size     = fileSize     # dependency logging uses this
+            clazz.package  = filePackage  # Apiloader uses this
+            clazz.relpath  = fileId       # Locale uses this
+            clazz.m_time_  = fileMTime
+            clazz.digest_  = fileDigest
+            toParse.append(clazz)
+
+        # Extract code IDs (e.g. class name, mixin name, ...)
+        if codeIdFromTree:
+            codeIds = _parseCodeIds(self, toParse, numProcs)
+        else:
+            codeIds = [None] * len(toParse)
 
-                if filePathId == "qx.core.Environment":
-                    clazz = qcEnvClass(filePathId, filePath, self, contextdict)
+        for clazz, fileCodeId in zip(toParse, codeIds):
+            try:
+                if codeIdFromTree:
+                    if fileCodeId == _PARSE_FAILED:
+                        fileCodeId = self._getCodeId(clazz)  # again, for the exception
                 else:
-                    clazz = Class(filePathId, filePath, self, contextdict)
-
-                # Extract code ID (e.g. class name, mixin name, ...)
-                try:
-                    if codeIdFromTree:
-                        fileCodeId = self._getCodeId(clazz)
-                    else:
-                        # Read content
-                        fileContent = filetool.read(filePath, self.encoding)
-                        fileCodeId = self._getCodeId1(fileContent)
-                except ValueError, e:
-                    argsList = []
-                    for arg in e.args:
-                        argsList.append(arg)
-                    argsList[0] = argsList[0] + u' (%s)' % fileName
-                    e.args = tuple(argsList)
-                    raise e
-
-                # Ignore all data files (e.g. translation, doc files, ...)
-                if fileCodeId == None:
-                    continue
+                    # Read content
+                    fileContent = filetool.read(clazz.path, self.encoding)
+                    fileCodeId = self._getCodeId1(fileContent)
+            except ValueError, e:
+                argsList = []
+                for arg in e.args:
+                    argsList.append(arg)
+                argsList[0] = argsList[0] + u' (%s)' % os.path.basename(clazz.path)
+                e.args = tuple(argsList)
+                raise e
+
+            # Ignore all data files (e.g. translation, doc files, ...)
+            if fileCodeId == None:
+                continue
+
+            # Compare path and content
+            if fileCodeId != clazz.id:
+                self._console.error("Detected conflict between filename and classname!")
+                self._console.indent()
+                self._console.error("Classname: %s" % fileCodeId)
+                self._console.error("Path: %s" % clazz.path)
+                self._console.outdent()
+                raise RuntimeError()
 
-                # Compare path and content
-                if fileCodeId != filePathId:
-                    self._console.error("Detected conflict between filename and classname!")
-                    self._console.indent()
-                    self._console.error("Classname: %s" % fileCodeId)
-                    self._console.error("Path: %s" % filePath)
-                    self._console.outdent()
-                    raise RuntimeError()
-
-                # Store file data
-                self._console.debug("Adding class %s" % filePathId)
-                clazz.encoding = self.encoding
-                clazz.size     = fileSize     # dependency logging uses this
-                clazz.package  = filePackage  # Apiloader uses this
-                clazz.relpath  = fileId       # Locale uses this
-                clazz.m_time_  = fileStat.st_mtime
-                classList.append(clazz)
+            self._console.debug("Adding class %s" % clazz.id)
+            clazz.encoding = self.encoding
+            classes[clazz.path] = clazz
+
+        self._classes = [classes[filePath] for filePath in sorted(classes)]
+        self._docs    = dict((doc["package"], doc) for doc in docs.values())
 
         self._console.indent()
-        self._console.debug("Found %s classes" % len(classList))
-        self._console.debug("Found %s docs" % len(docs))
+        self._console.debug("Found %s classes" % len(self._classes))
+        self._console.debug("Found %s docs" % len(self._docs))
         self._console.outdent()
 
-        #return classList, docs 
-        return classList, docs 
+        return True
 
 
 
     def _scanTranslationPath(self, path):
-        if not os.path.exists(path):
+        if not os.path.exists(path) and "translations" not in self._snapshots:
             self._console.warn("The given path does not contain a translation folder: %s" % path)
 
+        snapshot, delta = self._updateSnapshot("translations", path, (".po",), skipDotFiles=True)
+        if not delta:
+            return False
+
         self._console.debug("Scanning translation folder...")
 
-        # Iterate...
-        for root, dirs, files in filetool.walk(path):
-            # Filter ignored directories
-            for ignoredDir in dirs:
-                if self._ignoredDirEntries.match(ignoredDir):
-                    dirs.remove(ignoredDir)
-
-            # Searching for files
-            for fileName in files:
-                # Ignore non-script and dot files
-                if os.path.splitext(fileName)[-1] != ".po" or fileName.startswith("."):
-                    continue
+        for filePath in delta.changed + delta.removed:
+            fileLocale = os.path.splitext(os.path.basename(filePath))[0]
+            if self._translations.get(fileLocale, {}).get("path") == filePath:
+                del self._translations[fileLocale]
 
-                filePath = os.path.join(root, fileName)
-                fileLocale = os.path.splitext(fileName)[0]
+        # Searching for files
+        for filePath in sorted(delta.added + delta.changed):
+            fileLocale = os.path.splitext(os.path.basename(filePath))[0]
 
-                self._translations[fileLocale] = self.translationEntry(fileLocale, filePath, self.namespace)
+            self._translations[fileLocale] = self.translationEntry(fileLocale, filePath, self.namespace)
 
         self._console.indent()
         self._console.debug("Found %s translations" % len(self._translations))
         self._console.outdent()
 
+        return True
+
 
     @staticmethod
     def translationEntry(fileLocale, filePath, namespace):
@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Raster -- decoded image data, to combine and slice images in-process
+#
+# Reads PNG files (all color types, bit depths and interlacing) and GIF files
+# (the first frame) into 8-bit RGBA pixels, and writes PNG and GIF files. A
+# PNG is written with a palette if the image has no more than 256 colors.
+# Other formats (like JPEG) raise a RasterError; see ImageClipping for the
+# fall-back to ImageMagick.
+##
+
+import os, struct, zlib
+
+class RasterError(RuntimeError): pass
+
+PNG_SIGNATURE = struct.pack("8B", 137, 80, 78, 71, 13, 10, 26, 10)
+
+# (x0, y0, dx, dy) of the Adam7 passes of interlaced PNGs
+ADAM7 = [(0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4),
+         (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2)]
+
+
+class Raster(object):
+
+    def __init__(self, width, height, pixels=None):
+        self.width  = width
+        self.height = height
+        self.pixels = pixels if pixels is not None else bytearray(width * height * 4)  # RGBA, row by row
+
+
+    @staticmethod
+    def read(path):
+        data = open(path, "rb").read()
+        try:
+            if data[:8] == PNG_SIGNATURE:
+                return _readPng(data)
+            elif data[:6] in ("GIF87a", "GIF89a"):
+                return _readGif(data)
+        except (struct.error, zlib.error, IndexError, KeyError), e:
+            raise RasterError("Corrupt image file %s (%s)" % (path, e))
+        raise RasterError("Unsupported image format: %s" % path)
+
+
+    ##
+    # Write to path, as PNG or GIF depending on its extension
+    def write(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".png":
+            data = _writePng(self)
+        elif ext == ".gif":
+            data = _writeGif(self)
+        else:
+            raise RasterError("Unsupported image format: %s" % path)
+        out = open(path, "wb")
+        try:
+            out.write(data)
+        finally:
+            out.close()
+
+
+    ##
+    # The region at (left, top), like "convert -crop WxH+L+T +repage": the
+    # region is clipped to the image, and a width or height of 0 means all of it
+    def crop(self, width, height, left, top):
+        left   = min(max(left, 0), self.width)
+        top    = min(max(top, 0), self.height)
+        width  = min(width or self.width, self.width - left)
+        height = min(height or self.height, self.height - top)
+        result = Raster(max(width, 0), max(height, 0))
+        rowlen = result.width * 4
+        for y in range(result.height):
+            src = ((top + y) * self.width + left) * 4
+            result.pixels[y * rowlen:(y + 1) * rowlen] = self.pixels[src:src + rowlen]
+        return result
+
+
+    ##
+    # Copy other into this raster at (left, top)
+    def paste(self, other, left, top):
+        width  = min(other.width, self.width - left)
+        rowlen = width * 4
+        if rowlen <= 0:
+            return
+        for y in range(min(other.height, self.height - top)):
+            src = y * other.width * 4
+            dst = ((top + y) * self.width + left) * 4
+            self.pixels[dst:dst + rowlen] = other.pixels[src:src + rowlen]
+
+
+    ##
+    # Returns (colors, indices), the distinct colors ("RGBA" strings, the
+    # transparent ones first) and the color index of each pixel, or None if
+    # there are more than maxColors. All fully transparent pixels count as
+    # one color.
+    def palette(self, maxColors=256):
+        pixels = str(self.pixels)
+        colors = {}
+        order  = []
+        for i in xrange(0, len(pixels), 4):
+            px = pixels[i:i + 4]
+            if px[3] == "\x00":
+                px = "\x00\x00\x00\x00"
+            if px not in colors:
+                if len(order) == maxColors:
+                    return None
+                colors[px] = len(order)
+                order.append(px)
+        # transparent colors first, for a short tRNS chunk
+        ranked = sorted(order, key=lambda px: (px[3] == "\xff", colors[px]))
+        remap  = dict((px, num) for num, px in enumerate(ranked))
+        indices = bytearray(len(pixels) // 4)
+        for i in xrange(0, len(pixels), 4):
+            px = pixels[i:i + 4]
+            if px[3] == "\x00":
+                px = "\x00\x00\x00\x00"
+            indices[i // 4] = remap[px]
+        return ranked, indices
+
+
+# ------------------------------------------------------------------------------
+#   PNG
+# ------------------------------------------------------------------------------
+
+def _readPng(data):
+    pos   = 8
+    idat  = []
+    plte  = trns = header = None
+    while pos + 8 <= len(data):
+        length, ctype = struct.unpack("!I4s", data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos  += length + 12
+        if ctype == "IHDR":
+            header = struct.unpack("!IIBBBBB", chunk)
+        elif ctype == "PLTE":
+            plte = bytearray(chunk)
+        elif ctype == "tRNS":
+            trns = bytearray(chunk)
+        elif ctype == "IDAT":
+            idat.append(chunk)
+        elif ctype == "IEND":
+            break
+    if header is None:
+        raise RasterError("PNG without header")
+    width, height, depth, colorType, _, _, interlace = header
+
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[colorType]
+    bpp      = max(1, channels * depth // 8)  # bytes per pixel, for the filters
+    toRgba   = _pngConverter(colorType, depth, plte, trns)
+    raw      = bytearray(zlib.decompress("".join(idat)))
+    raster   = Raster(width, height)
+    pixels   = raster.pixels
+    offset   = 0
+    for x0, y0, dx, dy in (ADAM7 if interlace else [(0, 0, 1, 1)]):
+        passWidth  = (width - x0 + dx - 1) // dx
+        passHeight = (height - y0 + dy - 1) // dy
+        if not passWidth or not passHeight:
+            continue
+        rowlen = (passWidth * channels * depth + 7) // 8
+        prev   = bytearray(rowlen)
+        for j in range(passHeight):
+            row = raw[offset + 1:offset + 1 + rowlen]
+            _unfilter(raw[offset], row, prev, bpp)
+            offset += rowlen + 1
+            rgba = toRgba(row, passWidth)
+            y = y0 + j * dy
+            if dx == 1:
+                pixels[y * width * 4:(y + 1) * width * 4] = rgba
+            else:
+                for i in range(passWidth):
+                    dst = (y * width + x0 + i * dx) * 4
+                    pixels[dst:dst + 4] = rgba[i * 4:i * 4 + 4]
+            prev = row
+    return raster
+
+
+def _unfilter(ftype, row, prev, bpp):
+    n = len(row)
+    if ftype == 0:
+        pass
+    elif ftype == 1:  # Sub
+        for i in xrange(bpp, n):
+            row[i] = (row[i] + row[i - bpp]) & 0xff
+    elif ftype == 2:  # Up
+        for i in xrange(n):
+            row[i] = (row[i] + prev[i]) & 0xff
+    elif ftype == 3:  # Average
+        for i in xrange(bpp):
+            row[i] = (row[i] + (prev[i] >> 1)) & 0xff
+        for i in xrange(bpp, n):
+            row[i] = (row[i] + ((row[i - bpp] + prev[i]) >> 1)) & 0xff
+    elif ftype == 4:  # Paeth
+        for i in xrange(bpp):
+            row[i] = (row[i] + prev[i]) & 0xff
+        for i in xrange(bpp, n):
+            a, b, c = row[i - bpp], prev[i], prev[i - bpp]
+            p  = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            if pa <= pb and pa <= pc:
+                pred = a
+            elif pb <= pc:
+                pred = b
+            else:
+                pred = c
+            row[i] = (row[i] + pred) & 0xff
+    else:
+        raise RasterError("Unknown PNG filter type: %d" % ftype)
+
+
+##
+# Returns a function (row, width) -> RGBA bytes for the scanlines of a PNG
+def _pngConverter(colorType, depth, plte, trns):
+
+    def samples(row, count):
+        if depth == 8:
+            return row
+        elif depth == 16:
+            return [(row[i] << 8) | row[i + 1] for i in xrange(0, count * 2, 2)]
+        else:
+            perByte = 8 // depth
+            mask    = (1 << depth) - 1
+            return [(row[i // perByte] >> (8 - depth * (i % perByte + 1))) & mask
+                    for i in xrange(count)]
+
+    if depth == 16:
+        scale = lambda v: v >> 8
+    elif depth < 8 and colorType != 3:
+        scale = lambda v: v * 255 // ((1 << depth) - 1)
+    else:
+        scale = lambda v: v
+
+    if colorType == 6 and depth == 8:
+        return lambda row, width: row
+
+    elif colorType == 6 or colorType == 4:
+        channels = colorType == 6 and 4 or 2
+        def convert(row, width):
+            s = samples(row, width * channels)
+            result = bytearray(width * 4)
+            for i in xrange(width):
+                if channels == 4:
+                    result[i * 4:i * 4 + 4] = [scale(v) for v in s[i * 4:i * 4 + 4]]
+                else:
+                    g = scale(s[i * 2])
+                    result[i * 4:i * 4 + 4] = [g, g, g, scale(s[i * 2 + 1])]
+            return result
+        return convert
+
+    elif colorType == 2:
+        key = None
+        if trns and len(trns) >= 6:
+            key = tuple(struct.unpack("!HHH", str(trns[:6])))
+        def convert(row, width):
+            s = samples(row, width * 3)
+            result = bytearray(width * 4)
+            for i in xrange(width):
+                rgb = tuple(s[i * 3:i * 3 + 3])
+                result[i * 4:i * 4 + 4] = [scale(rgb[0]), scale(rgb[1]), scale(rgb[2]),
+                                           0 if rgb == key else 255]
+            return result
+        return convert
+
+    elif colorType == 0:
+        key = None
+        if trns and len(trns) >= 2:
+            key = struct.unpack("!H", str(trns[:2]))[0]
+        def convert(row, width):
+            s = samples(row, width)
+            result = bytearray(width * 4)
+            for i in xrange(width):
+                g = scale(s[i])
+                result[i * 4:i * 4 + 4] = [g, g, g, 0 if s[i] == key else 255]
+            return result
+        return convert
+
+    elif colorType == 3:
+        colors = []
+        for i in range(len(plte) // 3):
+            alpha = trns[i] if trns and i < len(trns) else 255
+            colors.append(str(plte[i * 3:i * 3 + 3]) + chr(alpha))
+        def convert(row, width):
+            return bytearray("".join([colors[v] for v in samples(row, width)]))
+        return convert
+
+    raise RasterError("Unknown PNG color type: %d" % colorType)
+
+
+def _pngChunk(ctype, data):
+    return "".join((struct.pack("!I", len(data)), ctype, data,
+                    struct.pack("!I", zlib.crc32(ctype + data) & 0xffffffff)))
+
+
+def _writePng(raster):
+    width, height = raster.width, raster.height
+    palette = raster.palette()
+    chunks  = []
+    if palette:
+        colors, indices = palette
+        header = struct.pack("!IIBBBBB", width, height, 8, 3, 0, 0, 0)
+        chunks.append(_pngChunk("PLTE", "".join(px[:3] for px in colors)))
+        alphas = "".join(px[3] for px in colors).rstrip("\xff")
+        if alphas:
+            chunks.append(_pngChunk("tRNS", alphas))
+        raw = bytearray()
+        for y in range(height):
+            raw.append(0)
+            raw.extend(indices[y * width:(y + 1) * width])
+    else:
+        header = struct.pack("!IIBBBBB", width, height, 8, 6, 0, 0, 0)
+        raw = _filterRows(raster.pixels, width * 4, height, 4)
+    chunks.append(_pngChunk("IDAT", zlib.compress(str(raw), 9)))
+    return "".join([PNG_SIGNATURE, _pngChunk("IHDR", header)] + chunks + [_pngChunk("IEND", "")])
+
+
+##
+# Filter each row with the filter type that gives the smallest sum of
+# absolute (signed) bytes, the heuristic recommended by the PNG spec
+def _filterRows(pixels, rowlen, height, bpp):
+    raw  = bytearray()
+    prev = bytearray(rowlen)
+    for y in range(height):
+        row = pixels[y * rowlen:(y + 1) * rowlen]
+        candidates = [
+            (0, row),
+            (1, bytearray([row[i] if i < bpp else (row[i] - row[i - bpp]) & 0xff
+                           for i in xrange(rowlen)])),
+            (2, bytearray([(row[i] - prev[i]) & 0xff for i in xrange(rowlen)])),
+            (4, bytearray([(row[i] - _paeth(row[i - bpp] if i >= bpp else 0, prev[i],
+                                            prev[i - bpp] if i >= bpp else 0)) & 0xff
+                           for i in xrange(rowlen)])),
+        ]
+        ftype, filtered = min(candidates, key=lambda c: sum(v if v < 128 else 256 - v for v in c[1]))
+        raw.append(ftype)
+        raw.extend(filtered)
+        prev = row
+    return raw
+
+
+def _paeth(a, b, c):
+    p  = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    elif pb <= pc:
+        return b
+    return c
+
+
+# ------------------------------------------------------------------------------
+#   GIF
+# ------------------------------------------------------------------------------
+
+def _readGif(data):
+    width, height, flags = struct.unpack("<HHB", data[6:11])
+    pos    = 13
+    colors = None
+    if flags & 0x80:
+        size   = 3 * (2 << (flags & 7))
+        colors = data[pos:pos + size]
+        pos   += size
+    transparent = None
+    raster = Raster(width, height)
+
+    while pos < len(data):
+        block = data[pos]
+        pos  += 1
+        if block == "!":  # extension
+            if data[pos] == "\xf9" and ord(data[pos + 2]) & 1:  # graphic control, with transparency
+                transparent = ord(data[pos + 5])
+            pos, _ = _gifSubBlocks(data, pos + 1)
+        elif block == ",":  # image
+            left, top, w, h, iflags = struct.unpack("<HHHHB", data[pos:pos + 9])
+            pos += 9
+            if iflags & 0x80:
+                size   = 3 * (2 << (iflags & 7))
+                colors = data[pos:pos + size]
+                pos   += size
+            if colors is None:
+                raise RasterError("GIF without color table")
+            minCodeSize = ord(data[pos])
+            pos, lzw = _gifSubBlocks(data, pos + 1)
+            indices = _lzwDecode(lzw, minCodeSize)
+            if iflags & 0x40:  # interlaced
+                rows = range(0, h, 8) + range(4, h, 8) + range(2, h, 4) + range(1, h, 2)
+            else:
+                rows = range(h)
+            pixels = raster.pixels
+            for j, y in enumerate(rows):
+                if top + y >= height:
+                    continue
+                for i in range(min(w, width - left)):
+                    n = j * w + i
+                    if n >= len(indices):
+                        break
+                    idx = ord(indices[n])
+                    if idx == transparent:
+                        continue
+                    dst = ((top + y) * width + left + i) * 4
+                    pixels[dst:dst + 4] = colors[idx * 3:idx * 3 + 3] + "\xff"
+            break  # first frame only
+        elif block == ";":
+            break
+        else:
+            raise RasterError("Unknown GIF block: %r" % block)
+    return raster
+
+
+def _gifSubBlocks(data, pos):
+    parts = []
+    while True:
+        size = ord(data[pos])
+        pos += 1
+        if not size:
+            return pos, "".join(parts)
+        parts.append(data[pos:pos + size])
+        pos += size
+
+
+def _lzwDecode(data, minCodeSize):
+    clear    = 1 << minCodeSize
+    end      = clear + 1
+    initial  = [chr(i) for i in range(clear)] + ["", ""]
+    table    = initial[:]
+    codeSize = minCodeSize + 1
+    out      = []
+    prev     = None
+    bits = nbits = 0
+    for byte in bytearray(data):
+        bits  |= byte << nbits
+        nbits += 8
+        while nbits >= codeSize:
+            code   = bits & ((1 << codeSize) - 1)
+            bits >>= codeSize
+            nbits -= codeSize
+            if code == clear:
+                table    = initial[:]
+                codeSize = minCodeSize + 1
+                prev     = None
+                continue
+            elif code == end:
+                return "".join(out)
+            if prev is None:
+                entry = table[code]
+            else:
+                if code < len(table):
+                    entry = table[code]
+                    new   = prev + entry[0]
+                elif code == len(table):
+                    entry = new = prev + prev[0]
+                else:
+                    raise RasterError("Corrupt GIF data")
+                if len(table) < 4096:
+                    table.append(new)
+                    if len(table) == 1 << codeSize and codeSize < 12:
+                        codeSize += 1
+            out.append(entry)
+            prev = entry
+    return "".join(out)
+
+
+def _writeGif(raster):
+    palette = raster.palette()
+    if not palette:
+        raise RasterError("Too many colors for a GIF image")
+    colors, indices = palette
+    transparent = None
+    for num, px in enumerate(colors):
+        if px[3] == "\x00":
+            transparent = num
+        elif px[3] != "\xff":
+            raise RasterError("Semi-transparent pixels cannot be stored in a GIF image")
+
+    bits = 1
+    while (1 << bits) < len(colors):
+        bits += 1
+    table = "".join(px[:3] for px in colors).ljust(3 << bits, "\x00")
+    minCodeSize = max(2, bits)
+
+    out = ["GIF89a", struct.pack("<HHBBB", raster.width, raster.height, 0x80 | ((bits - 1) << 4) | (bits - 1), 0, 0), table]
+    if transparent is not None:
+        out.append(struct.pack("<3sBHBB", "!\xf9\x04", 1, 0, transparent, 0))
+    out.append(struct.pack("<cHHHHBB", ",", 0, 0, raster.width, raster.height, 0, minCodeSize))
+    lzw = _lzwEncode(indices, minCodeSize)
+    for i in xrange(0, len(lzw), 255):
+        block = lzw[i:i + 255]
+        out.append(chr(len(block)) + block)
+    out.append("\x00;")
+    return "".join(out)
+
+
+def _lzwEncode(indices, minCodeSize):
+    clear    = 1 << minCodeSize
+    end      = clear + 1
+    codeSize = minCodeSize + 1
+    nextCode = end + 1
+    table    = {}  # {(prefix code << 8) | index: code}
+    out      = bytearray()
+    state    = [0, 0]  # bits, number of bits
+
+    def emit(code):
+        bits, nbits = state
+        bits  |= code << nbits
+        nbits += codeSize
+        while nbits >= 8:
+            out.append(bits & 0xff)
+            bits  >>= 8
+            nbits -= 8
+        state[:] = [bits, nbits]
+
+    emit(clear)
+    prefix = indices[0] if indices else None
+    for index in indices[1:]:
+        key  = (prefix << 8) | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if nextCode < 4096:
+            table[key] = nextCode
+            nextCode  += 1
+            if nextCode > (1 << codeSize) and codeSize < 12:
+                codeSize += 1
+        else:
+            emit(clear)
+            table    = {}
+            codeSize = minCodeSize + 1
+            nextCode = end + 1
+        prefix = index
+    if prefix is not None:
+        emit(prefix)
+    emit(end)
+    if state[1]:
+        out.append(state[0] & 0xff)
+    return str(out)
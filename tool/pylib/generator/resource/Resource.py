@@ -28,6 +28,7 @@
 ##
 
 import re, os, sys, types, unicodedata as unidata
+from generator import Context
 
 class Resource(object):
     
@@ -36,6 +37,7 @@ class Resource(object):
         self.set_id(unicode(id(self)))
         self.library= None
         self.m_time_= None  # last-modified time stamp
+        self.digest_= None  # content digest, as of the last library scan
 
     def set_id(self, id):
         self.id = unidata.normalize("NFC", id)
@@ -66,3 +68,8 @@ class Resource(object):
         if not self.m_time_ or force:
             self.m_time_ = os.stat(self.path).st_mtime
         return self.m_time_
+
+    ##
+    # Resource's current content digest (see Cache.digest)
+    def digest(self):
+        return Context.cache.digest(self.path)
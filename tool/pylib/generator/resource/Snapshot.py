@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Snapshot of a directory tree, to find out what has changed since a
+# library was last scanned.
+#
+# A snapshot records (size, mtime, inode, digest) for each file below its
+# root (the digest only in content mode). update() compares this with the
+# file system and returns the Delta: the files added, changed and removed.
+# In content mode, a file only counts as changed if its contents have.
+#
+# Snapshots are kept with their Library in the cache. In a long-running
+# process (see generator.runtime.Generatord) a snapshot can watch() its tree
+# with inotify; update() then only looks at the directories something has
+# happened in, instead of stat'ing every file.
+##
+
+import os, stat, errno, struct
+
+_PARALLEL_MIN = 16  # directories with fewer entries are stat'ed in-line
+
+
+class Delta(object):
+
+    def __init__(self):
+        self.added   = []
+        self.changed = []
+        self.removed = []
+
+    def __nonzero__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self):
+        return "<Delta: %d added, %d changed, %d removed>" % (
+            len(self.added), len(self.changed), len(self.removed))
+
+
+class Snapshot(object):
+
+    ##
+    # @param ignore       regexp of file and directory names to skip
+    # @param extensions   file extensions to consider (None: all)
+    # @param skipDotFiles whether to skip files starting with "."
+    def __init__(self, root, ignore, extensions=None, skipDotFiles=False):
+        self.root       = root
+        self._ignore    = ignore
+        self._extensions= extensions
+        self._skipDot   = skipDotFiles
+        self._files     = {}   # {path: (size, mtime, inode, digest)}
+        self._dirs      = {}   # {path: (set(file names), set(dir names))}
+        self._watcher   = None
+
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_watcher'] = None
+        return d
+
+
+    def __contains__(self, path):
+        return path in self._files
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def stat(self, path):
+        return self._files[path]
+
+
+    ##
+    # Compare with the file system, and record its current state.
+    #
+    # @param digest     function path -> content digest (content mode), or None
+    # @param numThreads threads to stat files with (0: in-line)
+    def update(self, digest=None, numThreads=0):
+        delta = Delta()
+        dirty = self._watcher.dirtyDirs() if self._watcher else None
+        pool  = None
+        if numThreads > 0 and dirty is None:
+            from multiprocessing.pool import ThreadPool  # Python 2.6+, so only when asked for
+            pool = ThreadPool(numThreads)
+        try:
+            if dirty is None:  # look at everything
+                self._visit(self.root, True, delta, digest, pool, self._ancestors(self.root))
+            else:
+                for path in sorted(dirty):  # parents before children
+                    if path in self._dirs:
+                        self._visit(path, False, delta, digest, pool, self._ancestors(path))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return delta
+
+
+    ##
+    # @param ancestors  (st_dev, st_ino) of dirPath and the directories above it,
+    #                   to recognize symlink cycles
+    def _visit(self, dirPath, recursive, delta, digest, pool, ancestors):
+        if self._watcher:
+            self._watcher.add(dirPath)  # before listing, so no change goes unnoticed
+        try:
+            names = [name for name in os.listdir(dirPath) if not self._ignore.match(name)]
+        except OSError:
+            names = []
+        paths = [os.path.join(dirPath, name) for name in names]
+        if pool and len(paths) >= _PARALLEL_MIN:
+            stats = pool.map(_stat, paths)
+        else:
+            stats = map(_stat, paths)
+
+        oldFiles, oldDirs = self._dirs.get(dirPath, (set(), set()))
+        files, dirs, dirIds = set(), set(), {}
+        for name, path, st in zip(names, paths, stats):
+            if st is None:
+                continue  # vanished meanwhile
+            if stat.S_ISDIR(st.st_mode):
+                dirId = (st.st_dev, st.st_ino)
+                if dirId not in ancestors:  # symlink cycles
+                    dirs.add(name)
+                    dirIds[name] = dirId
+                continue
+            if self._skipDot and name.startswith("."):
+                continue
+            if self._extensions and os.path.splitext(name)[-1] not in self._extensions:
+                continue
+            files.add(name)
+            sig   = (st.st_size, st.st_mtime, st.st_ino)
+            entry = self._files.get(path)
+            if entry is None:
+                self._files[path] = sig + (digest(path) if digest else None,)
+                delta.added.append(path)
+            elif entry[:3] != sig:
+                fileDigest = digest(path) if digest else None
+                if fileDigest is None or fileDigest != entry[3]:
+                    delta.changed.append(path)
+                self._files[path] = sig + (fileDigest,)
+
+        for name in oldFiles - files:
+            path = os.path.join(dirPath, name)
+            del self._files[path]
+            delta.removed.append(path)
+        for name in oldDirs - dirs:
+            self._drop(os.path.join(dirPath, name), delta)
+        self._dirs[dirPath] = (files, dirs)
+
+        for name in dirs:
+            if recursive or name not in oldDirs:
+                self._visit(os.path.join(dirPath, name), recursive, delta, digest, pool,
+                            ancestors | frozenset([dirIds[name]]))
+
+
+    ##
+    # (st_dev, st_ino) of dirPath and its parents up to the root; other
+    # directories may well be reached through more than one symlink
+    def _ancestors(self, dirPath):
+        ids = set()
+        while True:
+            st = _stat(dirPath)
+            if st is not None:
+                ids.add((st.st_dev, st.st_ino))
+            if dirPath == self.root or len(dirPath) <= len(self.root):
+                return frozenset(ids)
+            dirPath = os.path.dirname(dirPath)
+
+
+    def _drop(self, dirPath, delta):
+        files, dirs = self._dirs.pop(dirPath, ((), ()))
+        for name in files:
+            path = os.path.join(dirPath, name)
+            del self._files[path]
+            delta.removed.append(path)
+        for name in dirs:
+            self._drop(os.path.join(dirPath, name), delta)
+
+
+    ##
+    # Watch the tree for changes from now on (if the platform supports it);
+    # the next update() still looks at everything
+    def watch(self):
+        if self._watcher is None:
+            try:
+                self._watcher = Watcher()
+            except (OSError, AttributeError):
+                pass  # no inotify
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+##
+# Collects the directories something has happened in, using Linux's inotify
+# through ctypes.
+
+class Watcher(object):
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ONLYDIR     = 0x01000000
+    IN_NONBLOCK    = 00004000
+    IN_CLOEXEC     = 02000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by the name
+
+    def __init__(self):
+        import ctypes, ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd   = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths    = {}     # {wd: path}
+        self._wds      = {}     # {path: wd}
+        self._complete = False  # every directory watched since the last full update
+
+
+    def __del__(self):
+        if getattr(self, '_fd', -1) >= 0:
+            os.close(self._fd)
+
+
+    def add(self, path):
+        if path in self._wds:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, path.encode('utf-8') if isinstance(path, unicode) else path,
+                                          self.MASK)
+        if wd < 0:
+            self._complete = False  # e.g. out of watches; keep looking at everything
+            return
+        self._paths[wd] = path
+        self._wds[path] = wd
+
+
+    ##
+    # Directories with events since the last call, or None if everything has
+    # to be looked at
+    def dirtyDirs(self):
+        dirty = set()
+        complete, self._complete = self._complete, True
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, pos)
+                pos += self.EVENT.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    complete = False
+                elif mask & self.IN_IGNORED:  # directory gone; it might be back under the same name
+                    path = self._paths.pop(wd, None)
+                    self._wds.pop(path, None)
+                    complete = False
+                elif wd in self._paths:
+                    dirty.add(self._paths[wd])
+        return dirty if complete else None
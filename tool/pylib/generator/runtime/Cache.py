@@ -20,16 +20,22 @@
 #
 ################################################################################
 
-import os, sys, time, functools, gc
+import os, sys, time, functools, gc, zlib
 import cPickle as pickle
 from misc import filetool
-from misc.securehash import sha_construct
 from generator.runtime.ShellCmd import ShellCmd
 from generator.runtime.Log import Log
+from misc.securehash import sha_construct
+from generator.runtime.CacheStore import createStore, entryName, FileStore
+from generator.runtime.MemCache import MemCache, MB
+from generator.runtime.FileDigests import FileDigests
+from generator.runtime.PrivatesDb import PrivatesDb
+from generator.runtime.RemoteCache import createRemote
 
-memcache  = {} # {key: {'content':content, 'time': (time.time()}}
+memcache  = MemCache() # shared by all Cache objects of the process
 check_file     = u".cache_check_file"
-CACHE_REVISION = 28984 # increment this when existing caches need clearing
+privates_file  = u"privates.log"
+CACHE_REVISION = 28985 # increment this when existing caches need clearing
 
 class Cache(object):
 
@@ -40,6 +46,11 @@ class Cache(object):
     #  'cache/downloads' : path
     #  'interruptRegistry' : generator.runtime.InterruptRegistry (mandatory)
     #  'cache/invalidate-on-tool-change' : True|False
+    #  'cache/store' : "files"|"segments" (see generator.runtime.CacheStore)
+    #  'cache/store-options' : {} (passed on to the store)
+    #  'cache/memory' : {'budget' : MB, 'quotas' : {namespace : MB}, 'copy-on-read' : [namespace]}
+    #  'cache/invalidate-by' : "mtime"|"content"
+    #  'cache/remote' : {'url' : URL | 'path' : path, 'namespaces' : [namespace], 'upload' : True|False}
     #
     def __init__(self, path, **kwargs):
         self._cache_revision = CACHE_REVISION
@@ -51,7 +62,15 @@ class Cache(object):
         self._console.debug("Initializing cache...")
         self._console.indent()
         self._check_path(self._path)
-        self._locked_files   = set(())
+        self._storeType      = kwargs.get("cache/store", "files")
+        self._store          = createStore(self._storeType, self._path, self._console,
+                                           **kwargs.get("cache/store-options", {}))
+        self._configureMemory(kwargs.get("cache/memory", {}))
+        self._contentMode    = kwargs.get("cache/invalidate-by", "mtime") == "content"
+        self._digests        = None  # FileDigests, loaded on demand
+        self._privates       = PrivatesDb(os.path.join(self._path, privates_file))
+        self._remote         = createRemote(kwargs.get("cache/remote", None), self._console)
+        self._resident       = False # keep all source-derived entries in memory
         self._context['interruptRegistry'].register(self._unlock_files)
         self._assureCacheIsValid()  # checks and pot. clears existing cache
         self._console.outdent()
@@ -60,10 +79,32 @@ class Cache(object):
 
     def __getstate__(self):
         d = self.__dict__.copy()
-        del d['_locked_files']
         return d
 
 
+    def _configureMemory(self, memConf):
+        budget = memConf.get("budget", 256)
+        quotas = memConf.get("quotas", {})
+        memcache.configure(
+            budget = budget * MB if budget is not None else None,
+            quotas = dict((ns, q * MB) for ns, q in quotas.items()),
+            copyOnRead = memConf.get("copy-on-read", ["tree"]))
+
+
+    ##
+    # hit/miss/eviction counters of the memory tier, as a printable string
+
+    def memoryStats(self):
+        return memcache.statsString()
+
+
+    ##
+    # counters of the shared cache, if any
+
+    def remoteStats(self):
+        return self._remote.statsString() if self._remote else ""
+
+
     def _assureCacheIsValid(self, ):
         self._toolChainIsNewer = self._checkToolsNewer()
         if self._toolChainIsNewer:
@@ -132,10 +173,9 @@ class Cache(object):
     def cleanCompileCache(self):
         self._check_path(self._path)
         self._console.info("Deleting compile cache")
-        for f in os.listdir(self._path):   # currently, just delete the files in the top-level dir
-            file = os.path.join(self._path, f)
-            if os.path.isfile(file):
-                os.unlink(file)
+        self._store.clear()
+        if not isinstance(self._store, FileStore):
+            FileStore(self._path, self._console).clear()  # entries of the classic layout
         self._update_checkfile()
 
 
@@ -170,12 +210,7 @@ class Cache(object):
     # clean up lock files interrupt handler
 
     def _unlock_files(self):
-        for file in self._locked_files:
-            try:
-                filetool.unlock(file)
-                self._console.debug("Cleaned up lock for file: %r" % file)
-            except: # file might not exists since adding to _lock_files and actually locking is not atomic
-                pass   # no sense to do much fancy in an interrupt handler
+        self._store.unlock_all()
 
 
     ##
@@ -190,18 +225,122 @@ class Cache(object):
     # create a file name from a cacheId
 
     def filename(self, cacheId):
-        cacheId = cacheId.encode('utf-8')
-        splittedId = cacheId.split("-")
-        
-        if len(splittedId) == 1:
-            return cacheId
-                
-        baseId = splittedId.pop(0)
-        digestId = sha_construct("-".join(splittedId)).hexdigest()
+        return entryName(cacheId)
+
+
+    ##
+    # write pending store changes to disk (e.g. at the end of a job)
+
+    def flush(self):
+        if self._digests and self._digests.isChanged():
+            self.write(self.DIGESTS_ID, self._digests)
+            self._digests.markSaved()
+        self._store.flush()
+        if self._remote:
+            self._remote.flush()
+
+
+    ##
+    # prepare for another run in the same process (see generator.runtime.Generatord):
+    # drop per-run state, and log to the new run's console
+
+    def newRun(self, console):
+        self._console = console
+        if self._digests:
+            self._digests.reset()
+        if self._remote:
+            self._remote.reset(console)
+
+
+    ##
+    # the replacements for private names, shared with other processes (see
+    # generator.runtime.PrivatesDb)
+
+    def privates(self):
+        return self._privates
+
+
+    ##
+    # in resident mode, all entries that depend on a source file are kept in
+    # the memory tier, not only those read or written with memory=True
+
+    def setResident(self, resident=True):
+        self._resident = resident
+
+    def isResident(self):
+        return self._resident
+
+
+    # -- Content digests ------------------------------------------------------
+
+    DIGESTS_ID = "digests"
+
+    ##
+    # True if cache entries depend on the contents rather than the mtime of
+    # their source files
+
+    def isContentMode(self):
+        return self._contentMode
+
+
+    ##
+    # content digest of a (source) file; see FileDigests
+
+    def digest(self, path):
+        if self._digests is None:
+            self._digests, _ = self.read(self.DIGESTS_ID)
+            if not isinstance(self._digests, FileDigests):
+                self._digests = FileDigests()
+        return self._digests.digest(path)
+
+
+    ##
+    # In content mode, entries depending on a file are stored under their
+    # cacheId extended by the file's digest; so they are valid as long as
+    # this key exists, and entries for earlier contents stay around for
+    # when these contents come back (e.g. after switching branches).
+
+    def _contentKey(self, cacheId, dependsOn):
+        return u"%s-#%s" % (cacheId, self.digest(dependsOn))
+
+
+    ##
+    # Key of an entry in the shared cache (see RemoteCache); independent of
+    # the location of the source file, or None if the entry is not shared
+
+    def _remoteKey(self, cacheId, dependsOn, shared):
+        if not shared or not self._remote or not dependsOn or not self._remote.handles(MemCache.namespace(cacheId)):
+            return None
+        return sha_construct((u"%s|%s|%s" % (self._cache_revision, cacheId.replace(dependsOn, u""),
+                              self.digest(dependsOn))).encode('utf-8')).hexdigest()
+
+
+    ##
+    # read-through from the shared cache; copies a hit into the local store
+
+    def _readRemote(self, cacheId, remoteKey, memory):
+        data = self._remote.get(remoteKey)
+        if data is None:
+            return None, None
+        try:
+            raw = data.decode('zlib')
+            content = pickle.loads(raw)
+        except (EOFError, zlib.error, pickle.PickleError, pickle.UnpicklingError):
+            self._console.warn("Could not read shared cache object %s, recalculating..." % cacheId)
+            return None, None
+        self._store.store(cacheId, data)
+        if memory:
+            memcache.put(cacheId, content, time.time(), raw)
+        return content, time.time()
+
+
+    ##
+    # number of entries in the (disk) cache
+
+    def count(self):
+        return self._store.count()
+
 
-        return "%s-%s" % (baseId, digestId)
-        
-        
     def readmulti(self, cacheId, dependsOn=None):
         splittedId = cacheId.split("-")
         baseId = splittedId.pop(0)
@@ -239,63 +378,62 @@ class Cache(object):
     # 
     # @param dependsOn  file name to compare cache file against
     # @param memory     if read from disk keep value also in memory; improves subsequent access
-    def read(self, cacheId, dependsOn=None, memory=False, keepLock=False):
+    # @param shared     False if the value depends on local state besides dependsOn
+    #                   (like the privates DB), so it must not come from the shared cache
+    def read(self, cacheId, dependsOn=None, memory=False, keepLock=False, shared=True):
+        memory    = memory or (self._resident and dependsOn is not None)
+        remoteKey = self._remoteKey(cacheId, dependsOn, shared)
+        if dependsOn and self._contentMode:
+            cacheId   = self._contentKey(cacheId, dependsOn)
+            dependsOn = None
         if dependsOn:
             dependsModTime = os.stat(dependsOn).st_mtime
 
         if writeCond(cacheId):
             print "\nReading %s ..." % (cacheId,),
         # Mem cache
-        if cacheId in memcache:
-            memitem = memcache[cacheId]
-            if not dependsOn or dependsModTime < memitem['time']:
+        if cacheId in memcache or memory:
+            content, memtime = memcache.get(cacheId)
+            if content is not None and (not dependsOn or dependsModTime < memtime):
                 if writeCond(cacheId):
                     print "from memcache"
-                return memitem['content'], memitem['time']
+                return content, memtime
 
-        # File cache
-        filetool.directory(self._path)
-        cacheFile = os.path.join(self._path, self.filename(cacheId))
-
-        try:
-            cacheModTime = os.stat(cacheFile).st_mtime
-        except OSError:
+        # Disk cache
+        cacheModTime = self._store.mtime(cacheId)
+        if cacheModTime is None:
+            if remoteKey:
+                return self._readRemote(cacheId, remoteKey, memory)
             return None, None
 
         # out of date check
         if dependsOn and dependsModTime > cacheModTime:
+                if remoteKey:
+                    content, remoteTime = self._readRemote(cacheId, remoteKey, memory)
+                    if content is not None:
+                        return content, remoteTime
                 return None, cacheModTime
 
         try:
-            if not cacheFile in self._locked_files:
-                self._locked_files.add(cacheFile)
-                filetool.lock(cacheFile)
-
-            fobj = open(cacheFile, 'rb')
-            #filetool.lock(fobj.fileno())
+            data = self._store.load(cacheId, keepLock)
 
             gc.disable()
             try:
-                content = pickle.loads(fobj.read().decode('zlib'))
+                data = data.decode('zlib')
+                content = pickle.loads(data)
             finally:
                 gc.enable()
 
-            #filetool.unlock(fobj.fileno())
-            fobj.close()
-            if not keepLock:
-                filetool.unlock(cacheFile)
-                self._locked_files.remove(cacheFile)
-
             if memory:
-                memcache[cacheId] = {'content':content, 'time': time.time()}
+                memcache.put(cacheId, content, time.time(), data)
 
             #print "read cacheId: %s" % cacheId
             if writeCond(cacheId):
                 print "from disk"
             return content, cacheModTime
 
-        except (IOError, EOFError, pickle.PickleError, pickle.UnpicklingError):
-            self._console.warn("Could not read cache object %s, recalculating..." % cacheFile)
+        except (IOError, EOFError, zlib.error, pickle.PickleError, pickle.UnpicklingError):
+            self._console.warn("Could not read cache object %s, recalculating..." % cacheId)
             return None, cacheModTime
 
 
@@ -304,51 +442,40 @@ class Cache(object):
     #
     # @param memory         keep value also in memory; improves subsequent access
     # @param writeToFile    write value to disk
-    def write(self, cacheId, content, memory=False, writeToFile=True, keepLock=False):
-        filetool.directory(self._path)
-        cacheFile = os.path.join(self._path, self.filename(cacheId))
-
+    # @param dependsOn      file name the value is computed from (as with read())
+    # @param shared         False to keep the value out of the shared cache (as with read())
+    def write(self, cacheId, content, memory=False, writeToFile=True, keepLock=False, dependsOn=None, shared=True):
+        memory    = memory or (self._resident and dependsOn is not None)
+        remoteKey = self._remoteKey(cacheId, dependsOn, shared)
+        if dependsOn and self._contentMode:
+            cacheId = self._contentKey(cacheId, dependsOn)
         if writeCond(cacheId):
             print "\nWriting %s ..." % (cacheId,),
+        data = None
         if writeToFile:
             try:
-                if not cacheFile in self._locked_files:
-                    self._locked_files.add(cacheFile)  # this is not atomic with the next one!
-                    filetool.lock(cacheFile)
-
-                fobj = open(cacheFile, 'wb')
-                fobj.write(pickle.dumps(content, 2).encode('zlib'))
-                fobj.close()
-
-                if not keepLock:
-                    filetool.unlock(cacheFile)
-                    self._locked_files.remove(cacheFile)  # not atomic with the previous one!
+                data = pickle.dumps(content, 2)
+                zdata = data.encode('zlib')
+                self._store.store(cacheId, zdata, keepLock)
+                if remoteKey:
+                    self._remote.put(remoteKey, zdata)  # write-back on flush()
 
                 #print "wrote cacheId: %s" % cacheId
                 if writeCond(cacheId):
                     print "to disk"
 
             except (IOError, EOFError, pickle.PickleError, pickle.PicklingError), e:
-                try:
-                    os.unlink(cacheFile) # try remove cache file, Pickle might leave incomplete files
-                except:
-                    e.args = ("Cache file might be crippled.\n" % self._path + e.args[0], ) + e.args[1:]
-                e.args = ("Could not store cache to %s.\n" % self._path + e.args[0], ) + e.args[1:]
+                e.args = ("Could not store cache to %s.\n" % self._path + str(e.args[0] if e.args else e), ) + e.args[1:]
                 raise e
 
         if memory:
-            memcache[cacheId] = {'time': time.time(), 'content':content}
+            memcache.put(cacheId, content, time.time(), data)
             if writeCond(cacheId):
                 print "to memcache"
 
 
     def remove(self, cacheId, writeToFile=False):
-        if cacheId in memcache:
-           entry = memcache[cacheId]
-           del memcache[cacheId]
-           return entry['content'], entry['time']
-        else:
-            return None, None
+        return memcache.remove(cacheId)
 
 
 def writeCond(cacheId):
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# A minimal HTTP server for the shared cache (see generator.runtime.RemoteCache).
+#
+# Serves GET/HEAD/PUT on /<key>, keeping the entries in a directory. PUTs
+# are only accepted if the entry is signed with the shared secret. Meant
+# for testing and small teams; any HTTP server that can store and deliver
+# files under these URLs will do as well (clients check the signatures
+# themselves).
+##
+
+import os, BaseHTTPServer, SocketServer
+from generator.runtime.RemoteCache import DirRemote, RemoteError, verify
+
+MAX_ENTRY_SIZE = 64 * 1024 * 1024
+
+
+class CacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    wbufsize = -1                  # send each response in one go, and
+    disable_nagle_algorithm = True # don't let it wait for delayed ACKs
+
+    def _key(self):
+        return self.path.rstrip("/").rsplit("/", 1)[-1]
+
+
+    def _reply(self, status, body=""):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+    def do_GET(self):
+        try:
+            data = self.server.store.get(self._key())
+        except RemoteError:
+            return self._reply(400)
+        if data is None:
+            self._reply(404)
+        else:
+            self._reply(200, data)
+
+    do_HEAD = do_GET
+
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length", -1))
+        if length < 0 or length > MAX_ENTRY_SIZE:
+            return self._reply(411 if length < 0 else 413)
+        data = self.rfile.read(length)
+        if verify(self.server.secret, self._key(), data) is None:
+            return self._reply(403)
+        try:
+            self.server.store.put(self._key(), data)
+        except RemoteError:
+            return self._reply(400)
+        self._reply(201)
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, path, secret, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheRequestHandler)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.store   = DirRemote(path)
+        self.secret  = secret
+        self.verbose = verbose
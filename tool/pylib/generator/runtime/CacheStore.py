@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Storage backends for generator.runtime.Cache.
+#
+# A store persists opaque cache entries (already pickled and compressed by
+# the Cache) under their cacheId, together with the time they were written.
+# Two implementations exist:
+#
+#  FileStore    - the classic layout, one file per cacheId plus a lock file
+#                 for every access
+#  SegmentStore - append-only segment files with a single index, batched
+#                 fsync and compaction; avoids one inode per cache entry
+#
+# Both implement the same small interface (mtime, load, store, delete, flush,
+# clear, count, unlock_all), so Cache doesn't need to know which one is in
+# use.
+##
+
+import os, sys, time, errno, struct, zlib, socket, atexit
+import cPickle as pickle
+from misc import filetool
+from misc.securehash import sha_construct
+
+STORE_TYPES = ("files", "segments")
+
+
+class CacheStoreError(IOError): pass
+
+
+##
+# Map a cacheId to a (file system safe) entry name; "baseId-<sha1 of rest>"
+
+def entryName(cacheId):
+    if isinstance(cacheId, unicode):
+        cacheId = cacheId.encode('utf-8')
+    splittedId = cacheId.split("-")
+
+    if len(splittedId) == 1:
+        return cacheId
+
+    baseId = splittedId.pop(0)
+    digestId = sha_construct("-".join(splittedId)).hexdigest()
+
+    return "%s-%s" % (baseId, digestId)
+
+
+##
+# Factory for the store configured under 'cache/store'
+
+def createStore(storeType, path, console, **kwargs):
+    if storeType in (None, "files"):
+        return FileStore(path, console)
+    elif storeType == "segments":
+        return SegmentStore(os.path.join(path, SegmentStore.DIRNAME), console, **kwargs)
+    else:
+        raise ValueError("Unknown cache store type '%s' (expected one of %r)" % (storeType, STORE_TYPES))
+
+
+##
+# One file per cache entry (the original Cache layout)
+
+class FileStore(object):
+
+    def __init__(self, path, console):
+        self._path         = path
+        self._console      = console
+        self._locked_files = set(())
+
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_locked_files'] = set(())
+        return d
+
+
+    def _cacheFile(self, cacheId):
+        return os.path.join(self._path, entryName(cacheId))
+
+
+    ##
+    # returns the write time of the entry, or None if there is no entry
+
+    def mtime(self, cacheId):
+        try:
+            return os.stat(self._cacheFile(cacheId)).st_mtime
+        except OSError:
+            return None
+
+
+    def load(self, cacheId, keepLock=False):
+        cacheFile = self._cacheFile(cacheId)
+        if not cacheFile in self._locked_files:
+            self._locked_files.add(cacheFile)
+            filetool.lock(cacheFile)
+
+        fobj = open(cacheFile, 'rb')
+        try:
+            data = fobj.read()
+        finally:
+            fobj.close()
+
+        if not keepLock:
+            self._release(cacheFile)
+        return data
+
+
+    def store(self, cacheId, data, keepLock=False):
+        filetool.directory(self._path)
+        cacheFile = self._cacheFile(cacheId)
+        if not cacheFile in self._locked_files:
+            self._locked_files.add(cacheFile)  # this is not atomic with the next one!
+            filetool.lock(cacheFile)
+
+        try:
+            fobj = open(cacheFile, 'wb')
+            fobj.write(data)
+            fobj.close()
+        except IOError:
+            try:
+                os.unlink(cacheFile) # might leave incomplete files
+            except OSError:
+                pass
+            raise
+
+        if not keepLock:
+            self._release(cacheFile)
+
+
+    def delete(self, cacheId):
+        cacheFile = self._cacheFile(cacheId)
+        if os.path.isfile(cacheFile):
+            os.unlink(cacheFile)
+
+
+    def _release(self, cacheFile):
+        filetool.unlock(cacheFile)
+        self._locked_files.discard(cacheFile)  # not atomic with the previous one!
+
+
+    def unlock_all(self):
+        for file in list(self._locked_files):
+            try:
+                filetool.unlock(file)
+            except: # file might not exists since adding to _lock_files and actually locking is not atomic
+                pass   # no sense to do much fancy in an interrupt handler
+        self._locked_files = set(())
+
+
+    def flush(self):
+        pass
+
+
+    def compact(self, force=False):
+        pass
+
+
+    ##
+    # delete the entries (currently, just the files in the top-level dir)
+
+    def clear(self):
+        for f in os.listdir(self._path):
+            file = os.path.join(self._path, f)
+            if os.path.isfile(file):
+                os.unlink(file)
+
+
+    def count(self):
+        return len([f for f in os.listdir(self._path) if os.path.isfile(os.path.join(self._path, f))])
+
+
+##
+# Append-only, indexed segment store
+#
+# Layout of the store directory:
+#
+#   index         - zlib'ed pickle {'revision':.., 'entries': {cacheId: (segment, offset, length, time, crc)}}
+#   index.lock    - lock file while the index is rewritten
+#   <name>.seg    - segment files; every process appends to its own segment
+#
+# Each record in a segment is HEADER + key + data, where HEADER carries a
+# magic, the key and data lengths, the write time and the crc32 of the data.
+# Deletions are recorded as tombstones (data length 0, DELETE magic). The
+# index can always be rebuilt by scanning the segments (latest time wins).
+#
+# Writes go to the segment immediately, but the index is only merged into the
+# on-disk index (and the segments fsync'ed) every 'sync-interval' writes and
+# on flush(), so the per-entry cost is one append. Other processes pick up
+# new entries whenever they miss a key and the on-disk index has changed.
+
+class SegmentStore(object):
+
+    DIRNAME        = "store"
+    INDEX_REVISION = 1
+    RECORD_MAGIC   = "QXCR"
+    DELETE_MAGIC   = "QXCD"
+    HEADER         = struct.Struct(">4sIIdI")  # magic, keylen, datalen, time, crc32
+    LOCK_RETRIES   = 40    # for the index lock, every LOCK_TIMEOUT seconds
+    LOCK_TIMEOUT   = 0.25
+
+    ##
+    # kwargs:
+    #  'sync-interval'   : number of writes after which the index is merged and segments are fsync'ed
+    #  'segment-size'    : max. size of a segment file in bytes, before a new one is started
+    #  'compact-ratio'   : fraction of dead bytes that triggers compaction on flush
+    #
+    def __init__(self, path, console, **kwargs):
+        self._path          = path
+        self._console       = console
+        self._sync_interval = kwargs.get('sync-interval', 500)
+        self._segment_size  = kwargs.get('segment-size', 64 * 1024 * 1024)
+        self._compact_ratio = kwargs.get('compact-ratio', 0.5)
+        self._index_file    = os.path.join(path, "index")
+        filetool.directory(path)
+        self._init_state()
+        self._load_index()
+        atexit.register(self._atexit)
+
+
+    def _init_state(self):
+        self._index         = {}   # {cacheId: (segment, offset, length, time, crc)}
+        self._index_stamp   = None # (mtime, size) of the index file when last read
+        self._dirty         = {}   # {cacheId: entry or None} not yet merged into the on-disk index
+        self._writes        = 0
+        self._segment       = None # name of our own segment
+        self._segment_fd    = None
+        self._segment_pos   = 0
+        self._readers       = {}   # {segment: file object}
+        self._locked_keys   = set(())  # keys whose lock files we created
+        self._index_locked  = False    # whether we hold index.lock
+        self._pid           = os.getpid()
+
+
+    ##
+    # A forked child (like the workers of generator.code.CompilePool) must not
+    # use our segment and file handles; it starts over on the index it inherited.
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            index = self._index
+            self._init_state()
+            self._index = index
+
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        for key in ('_segment_fd', '_readers', '_dirty', '_locked_keys', '_segment', '_segment_pos', '_writes', '_index_locked', '_pid'):
+            del d[key]
+        return d
+
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        index = self._index
+        self._init_state()
+        self._index = index
+
+
+    # -- Index handling --------------------------------------------------------
+
+    def _index_stat(self):
+        try:
+            st = os.stat(self._index_file)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+
+    def _read_index(self):
+        try:
+            fobj = open(self._index_file, "rb")
+            try:
+                data = pickle.loads(zlib.decompress(fobj.read()))
+            finally:
+                fobj.close()
+        except (IOError, EOFError, zlib.error, pickle.UnpicklingError, ValueError, TypeError):
+            return None
+        if not isinstance(data, dict) or data.get('revision') != self.INDEX_REVISION:
+            return None
+        return data['entries']
+
+
+    def _load_index(self):
+        stamp   = self._index_stat()
+        if stamp:
+            entries = self._read_index()
+            if entries is None:
+                self._console.warn("Cache index unreadable, rebuilding from segments...")
+                entries = self._scan_segments()
+        else:
+            entries = self._scan_segments()  # fresh store, or index got lost
+        self._index       = entries
+        self._index.update((k, v) for k, v in self._dirty.items() if v)
+        for k, v in self._dirty.items():
+            if v is None:
+                self._index.pop(k, None)
+        self._index_stamp = stamp
+
+
+    ##
+    # re-read the on-disk index if another process has changed it
+
+    def _refresh_index(self):
+        stamp = self._index_stat()
+        if stamp and stamp != self._index_stamp:
+            self._load_index()
+            return True
+        return False
+
+
+    def _disk_entries(self):
+        entries = self._read_index()
+        if entries is None:
+            entries = self._scan_segments()
+        return entries
+
+
+    def _write_index(self, entries):
+        tmpfile = "%s.%s.tmp" % (self._index_file, self._writer_token())
+        fobj = open(tmpfile, "wb")
+        try:
+            fobj.write(zlib.compress(pickle.dumps({'revision': self.INDEX_REVISION, 'entries': entries}, 2), 1))
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        finally:
+            fobj.close()
+        if sys.platform == "win32" and os.path.exists(self._index_file):
+            os.unlink(self._index_file)  # rename doesn't overwrite on Windows
+        os.rename(tmpfile, self._index_file)
+        self._index_stamp = self._index_stat()
+
+
+    def _lock_index(self):
+        filetool.directory(self._path)
+        if not filetool.lock(self._index_file, self.LOCK_RETRIES, self.LOCK_TIMEOUT):
+            raise CacheStoreError("Could not lock cache index %s" % self._index_file)
+        self._index_locked = True
+
+
+    ##
+    # remove index.lock, if it is ours; another process might hold it
+
+    def _unlock_index(self):
+        if self._index_locked:
+            self._index_locked = False
+            filetool.unlock(self._index_file)
+
+
+    ##
+    # reconstruct the index from the segment files, e.g. after a crash
+
+    def _scan_segments(self):
+        entries = {}
+        for segment in self._segments():
+            for key, entry in self._scan_segment(segment):
+                if key in entries and entries[key] and entries[key][3] > entry[3]:
+                    continue
+                entries[key] = entry
+        return dict((k, v) for k, v in entries.items() if v[0] is not None)
+
+
+    def _scan_segment(self, segment):
+        hsize = self.HEADER.size
+        fobj  = open(os.path.join(self._path, segment), "rb")
+        try:
+            offset = 0
+            while True:
+                header = fobj.read(hsize)
+                if len(header) < hsize:
+                    break
+                magic, keylen, datalen, mtime, crc = self.HEADER.unpack(header)
+                if magic not in (self.RECORD_MAGIC, self.DELETE_MAGIC):
+                    break  # torn write; ignore the rest of the segment
+                key = fobj.read(keylen).decode('utf-8')
+                fobj.seek(datalen, 1)
+                if magic == self.DELETE_MAGIC:
+                    yield key, (None, None, None, mtime, None)
+                else:
+                    yield key, (segment, offset + hsize + keylen, datalen, mtime, crc)
+                offset += hsize + keylen + datalen
+        finally:
+            fobj.close()
+
+
+    def _segments(self):
+        return sorted(f for f in os.listdir(self._path) if f.endswith(".seg"))
+
+
+    # -- Segment I/O -----------------------------------------------------------
+
+    def _writer_token(self):
+        return "%s-%d" % (socket.gethostname().split(".")[0], os.getpid())
+
+
+    def _open_segment(self):
+        if self._segment_fd is not None and self._segment_pos < self._segment_size:
+            return
+        if self._segment_fd is not None:
+            os.fsync(self._segment_fd)
+            os.close(self._segment_fd)
+        flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+        serial = 0
+        while True:
+            self._segment = "%s-%d-%d.seg" % (self._writer_token(), int(time.time()), serial)
+            try:
+                self._segment_fd = os.open(os.path.join(self._path, self._segment), flags, 0666)
+                break
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                serial += 1
+        self._segment_pos = 0
+
+
+    def _append(self, magic, cacheId, data, mtime):
+        self._open_segment()
+        key    = cacheId.encode('utf-8') if isinstance(cacheId, unicode) else cacheId
+        crc    = zlib.crc32(data) & 0xffffffff
+        record = self.HEADER.pack(magic, len(key), len(data), mtime, crc) + key + data
+        os.write(self._segment_fd, record)
+        offset = self._segment_pos + self.HEADER.size + len(key)
+        self._segment_pos += len(record)
+        return (self._segment, offset, len(data), mtime, crc)
+
+
+    def _read_entry(self, entry):
+        segment, offset, length, _, crc = entry
+        if segment not in self._readers:
+            self._readers[segment] = open(os.path.join(self._path, segment), "rb")
+        fobj = self._readers[segment]
+        fobj.seek(offset)
+        data = fobj.read(length)
+        if len(data) != length or (zlib.crc32(data) & 0xffffffff) != crc:
+            raise CacheStoreError("Corrupt cache entry in segment %s at %d" % (segment, offset))
+        return data
+
+
+    def _close_readers(self):
+        for fobj in self._readers.values():
+            fobj.close()
+        self._readers = {}
+
+
+    # -- Store interface -------------------------------------------------------
+
+    def _lookup(self, cacheId):
+        entry = self._index.get(cacheId)
+        if entry is None and cacheId not in self._dirty and self._refresh_index():
+            entry = self._index.get(cacheId)
+        return entry
+
+
+    def mtime(self, cacheId):
+        self._check_fork()
+        entry = self._lookup(cacheId)
+        return entry[3] if entry else None
+
+
+    def load(self, cacheId, keepLock=False):
+        self._check_fork()
+        if keepLock:
+            self._lock_key(cacheId)
+            self._refresh_index()  # read-modify-write; make sure to see other processes' updates
+        entry = self._lookup(cacheId)
+        if entry is None:
+            raise CacheStoreError("No cache entry for %s" % cacheId)
+        try:
+            return self._read_entry(entry)
+        except IOError:
+            # segment might have been compacted away by another process
+            if self._refresh_index() and self._index.get(cacheId):
+                return self._read_entry(self._index[cacheId])
+            raise
+
+
+    def store(self, cacheId, data, keepLock=False):
+        self._check_fork()
+        entry = self._append(self.RECORD_MAGIC, cacheId, data, time.time())
+        self._index[cacheId] = self._dirty[cacheId] = entry
+        if not keepLock:
+            self._unlock_key(cacheId)
+        self._count_write()
+
+
+    def delete(self, cacheId):
+        self._check_fork()
+        if cacheId not in self._index:
+            return
+        self._append(self.DELETE_MAGIC, cacheId, "", time.time())
+        del self._index[cacheId]
+        self._dirty[cacheId] = None
+        self._count_write()
+
+
+    def _count_write(self):
+        self._writes += 1
+        if self._writes >= self._sync_interval:
+            self.flush()
+
+
+    ##
+    # fsync our segment and merge our changes into the on-disk index
+
+    def flush(self):
+        self._check_fork()
+        if not self._dirty:
+            return
+        if self._segment_fd is not None:
+            os.fsync(self._segment_fd)
+        self._lock_index()
+        try:
+            entries = self._disk_entries()
+            self._merge(entries, self._dirty.items())
+            self._write_index(entries)
+            self._index = entries
+            self._dirty = {}
+            self._writes = 0
+        finally:
+            self._unlock_index()
+        self.compact()
+
+
+    ##
+    # apply changes [(cacheId, entry or None)] to index entries, unless they
+    # already have a newer entry from another process
+
+    def _merge(self, entries, changes):
+        for key, entry in changes:
+            current = entries.get(key)
+            if current and entry and current[3] > entry[3]:
+                continue
+            if entry is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+
+
+    ##
+    # rewrite the live entries of the segments no live process writes to into
+    # a fresh segment, if the share of dead bytes in the segments exceeds
+    # 'compact-ratio' (or force is True)
+    #
+    # Segments of other processes that are still running (or of other hosts,
+    # where this can't be told) are left alone, as their latest records might
+    # not be in the index yet. Records of a crashed writer that never made it
+    # into the index are recovered from its segments before they go.
+
+    def compact(self, force=False):
+        self._check_fork()
+        segments = self._segments()
+        total = sum(os.path.getsize(os.path.join(self._path, s)) for s in segments)
+        live  = sum(e[2] for e in self._index.values())
+        if not total or (not force and (total < 1024 * 1024 or float(total - live) / total < self._compact_ratio)):
+            return
+        self._console.debug("Compacting cache store (%d of %d bytes live)" % (live, total))
+        self._lock_index()
+        try:
+            if self._segment_fd is not None:
+                os.fsync(self._segment_fd)
+                os.close(self._segment_fd)
+                self._segment_fd = None
+            entries = self._disk_entries()
+            self._merge(entries, self._dirty.items())
+            self._dirty = {}
+            segments = [s for s in self._segments() if not self._has_live_writer(s)]
+            for segment in segments:
+                self._recover(entries, segment)
+            dead = set(segments)
+            for key, entry in entries.items():
+                if entry[0] not in dead:
+                    continue
+                try:
+                    data = self._read_entry(entry)
+                except IOError:
+                    del entries[key]
+                    continue
+                entries[key] = self._append(self.RECORD_MAGIC, key, data, entry[3])
+            if self._segment_fd is not None:
+                os.fsync(self._segment_fd)
+            self._write_index(entries)
+            self._index = entries
+            self._writes = 0
+            self._close_readers()
+            for segment in segments:
+                os.unlink(os.path.join(self._path, segment))
+        finally:
+            self._unlock_index()
+
+
+    ##
+    # add the records of segment that are newer than the index entries
+
+    def _recover(self, entries, segment):
+        for key, entry in self._scan_segment(segment):
+            current = entries.get(key)
+            if current and current[3] >= entry[3]:
+                continue
+            if entry[0] is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+
+
+    ##
+    # whether the process that created segment (see _open_segment()) might
+    # still append to it; never for ours, as compact() closes it beforehand
+
+    def _has_live_writer(self, segment):
+        try:
+            host, pid, _, _ = segment[:-len(".seg")].rsplit("-", 3)
+            pid = int(pid)
+        except ValueError:
+            return True   # not one of ours
+        if host != socket.gethostname().split(".")[0]:
+            return True
+        if pid == os.getpid():
+            return False  # an earlier one of ours; our records are all merged
+        if sys.platform == "win32":
+            return True   # os.kill() would terminate it
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno == errno.EPERM
+        return True
+
+
+    def _lock_key(self, cacheId):
+        if cacheId not in self._locked_keys:
+            if not filetool.lock(os.path.join(self._path, entryName(cacheId))):
+                raise CacheStoreError("Could not lock cache entry %s" % cacheId)
+            self._locked_keys.add(cacheId)
+
+
+    def _unlock_key(self, cacheId):
+        if cacheId in self._locked_keys:
+            filetool.unlock(os.path.join(self._path, entryName(cacheId)))
+            self._locked_keys.discard(cacheId)
+
+
+    def unlock_all(self):
+        self._check_fork()  # the locks of the parent are none of ours
+        for cacheId in list(self._locked_keys):
+            try:
+                self._unlock_key(cacheId)
+            except:
+                pass
+        try:
+            self._unlock_index()
+        except:
+            pass
+
+
+    def clear(self):
+        self._close_readers()
+        if self._segment_fd is not None:
+            os.close(self._segment_fd)
+        for f in os.listdir(self._path):
+            file = os.path.join(self._path, f)
+            if os.path.isfile(file):
+                os.unlink(file)
+        self._init_state()
+
+
+    def count(self):
+        self._check_fork()
+        self._refresh_index()
+        return len(self._index)
+
+
+    def _atexit(self):
+        try:
+            self.flush()
+        except (IOError, OSError), e:
+            self._console.warn("Could not flush cache store: %s" % e)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Content digests of source files (classes, .po files, images, ...).
+#
+# A digest is computed at most once per run for a given path. Across runs,
+# digests are remembered together with the file's (inode, size, mtime), so
+# a file is only read again if its stat data has changed - and even then a
+# file with unchanged contents (e.g. after a 'git checkout' back and forth)
+# gets its old digest back.
+##
+
+import os
+from misc.securehash import sha_construct
+
+class FileDigests(object):
+
+    def __init__(self):
+        self._stats   = {}   # {path: (ino, size, mtime, digest)}, persisted
+        self._seen    = {}   # {path: digest}, for the current run
+        self._changed = False
+
+
+    def __getstate__(self):
+        return {'_stats': self._stats}
+
+
+    def __setstate__(self, d):
+        self.__init__()
+        self._stats = d['_stats']
+
+
+    def digest(self, path):
+        if path in self._seen:
+            return self._seen[path]
+        st  = os.stat(path)
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        entry = self._stats.get(path)
+        if entry and entry[:3] == key:
+            digest = entry[3]
+        else:
+            digest = self.compute(path)
+            self._stats[path] = key + (digest,)
+            self._changed = True
+        self._seen[path] = digest
+        return digest
+
+
+    @staticmethod
+    def compute(path):
+        sha  = sha_construct()
+        fobj = open(path, "rb")
+        try:
+            while True:
+                chunk = fobj.read(65536)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        finally:
+            fobj.close()
+        return sha.hexdigest()
+
+
+    ##
+    # forget what has been seen in this run (e.g. for a long-running process)
+
+    def reset(self):
+        self._seen = {}
+
+
+    def isChanged(self):
+        return self._changed
+
+
+    def markSaved(self):
+        self._changed = False
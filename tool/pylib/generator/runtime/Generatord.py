@@ -23,112 +23,276 @@
 # Generatord  -- Generator Daemon Module
 #
 #   Allows to run generator.py in daemon mode.
+#
+# 'generator.py -d' starts a resident generator for a config file. Subsequent
+# generator.py (or generate.py) invocations for the same config hand their
+# command line over to it (see forward()), and the daemon runs the jobs with
+# everything from previous runs still in memory: the resolved config, the
+# Library objects with their classes, and the cache with its memory tier
+# (syntax trees, dependencies, compiled code, ...).
+#
+# Changes are picked up at the start of each request: source files by the
+# libraries' snapshots, which watch the library folders with inotify where
+# available (see generator.resource.Snapshot), config files by their
+# modification times.
+#
+# The daemon listens on a local port. Port and access token are kept in an
+# address file next to the config file, which only the user that started the
+# daemon can read. Requests are served one after the other.
+#
+# Protocol: the client sends a single JSON line
+#   {"token": ..., "config": <abs. path>, "cwd": ..., "argv": [...]};
+# the daemon answers with frames "<type><length>\n<data>", type being "O"
+# (stdout), "E" (stderr) or "X" (exit code; the last frame).
 ##
 
-import sys, os, re, string, types, copy
+import sys, os, errno, signal, socket, SocketServer, binascii, traceback
+
+from misc import json
+from misc.ExtendAction import ExtendAction
+from generator.config.GeneratorArguments import GeneratorArguments
+
+CONNECT_TIMEOUT = 5  # seconds
+
+
+def addressFile(configPath):
+    dirname, basename = os.path.split(os.path.abspath(configPath))
+    return os.path.join(dirname, ".%s.generatord" % basename)
+
+
+##
+# Client side: run the command line on the daemon serving its config.
+# Returns the exit code, or None if there is no such daemon (or the command
+# line is not to be forwarded), in which case the caller runs it locally.
+
+def forward(argv):
+    (options, args) = GeneratorArguments(option_class=ExtendAction).parse_args(argv)
+    if options.daemon or options.no_daemon:
+        return None
+
+    configPath = os.path.abspath(options.config)
+    addrFile   = addressFile(configPath)
+    try:
+        address = json.load(open(addrFile))
+    except (IOError, ValueError):
+        return None
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(("127.0.0.1", address["port"]))
+        sock.settimeout(None)  # a job takes as long as it takes
+    except socket.error, e:
+        sock.close()
+        if e.args[0] == errno.ECONNREFUSED:  # left over from a daemon that died
+            try:
+                os.remove(addrFile)
+            except OSError:
+                pass
+        return None
+
+    try:
+        request = {'token': address["token"], 'config': configPath, 'cwd': os.getcwd(), 'argv': argv}
+        sock.sendall(json.dumps(request) + "\n")
+        rfile = sock.makefile("rb")
+        while True:
+            header = rfile.readline()
+            if not header:
+                break
+            frameType, length = header[0], int(header[1:])
+            data = rfile.read(length)
+            if frameType == "X":
+                return int(data)
+            stream = sys.stdout if frameType == "O" else sys.stderr
+            stream.write(data)
+            stream.flush()
+    except KeyboardInterrupt:
+        print
+        print "Keyboard interrupt! (the daemon finishes the current job)"
+        return 2
+    finally:
+        sock.close()
+
+    print >> sys.stderr, "Generator daemon closed the connection"
+    return 1
+
+
+##
+# File-like object sending what is written to it as frames of the given type.
+# Write errors (e.g. the client has gone) are ignored, so that the job can
+# complete and leave the caches in a consistent state.
+
+class FrameWriter(object):
+
+    def __init__(self, wfile, frameType):
+        self._wfile     = wfile
+        self._frameType = frameType
+        self.broken     = False
 
-from generator import Context
-from generator.Generator import Generator
-from generator.code.Class import Class
-from generator.runtime.Cache import Cache
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if not data or self.broken:
+            return
+        try:
+            self._wfile.write("%s%d\n%s" % (self._frameType, len(data), data))
+            self._wfile.flush()
+        except (socket.error, IOError):
+            self.broken = True
 
-# -- BaseHTTPServer stuff ----
-import BaseHTTPServer, cgi
+    def flush(self):
+        pass
 
-# -- Pyro stuff ----
-import Pyro.core, Pyro.naming
+    def isatty(self):
+        return False
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        generatord = self.server.generatord
+        out = FrameWriter(self.wfile, "O")
+        err = FrameWriter(self.wfile, "E")
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if request.get('token') != generatord.token or request.get('config') != generatord.configPath:
+            err.write("Request rejected by generator daemon\n")
+            retval = 1
+        else:
+            retval = generatord.runRequest(request, out, err)
+        FrameWriter(self.wfile, "X").write(str(retval))
 
-generator_context = None
 
 class Generatord(object):
 
-    def __init__(self, context, num=0):
-        global generator_context
-        generator_context = context
-        self.num = num
-        generator_context['cache'] = Cache("/tmp/qx1.5/cache", **generator_context) # TODO: cache path
-        #self.servAddr = ('',8008)
-        #self.serv = BaseHTTPServer.HTTPServer(self.servAddr, httpServerHandler)
-        generator_context['interruptRegistry'].register(self.shut_down)
-
-    def serve(self):
-        #self.serv.serve_forever()
-        daemon = Pyro.core.Daemon()
-        self.daemon = daemon
-        ns = Pyro.naming.NameServerLocator().getNS()
-        daemon.useNameServer(ns)
-        uri = daemon.connect(GeneratordWorker(self.num), "genworker"+str(self.num))
-        daemon.requestLoop()
+    def __init__(self, configPath, console, interruptRegistry):
+        self.configPath  = os.path.abspath(configPath)
+        self.addressFile = addressFile(self.configPath)
+        self.token       = binascii.hexlify(os.urandom(16))
+        self._console    = console
+        self._runner     = None
+        self._configs    = {}  # {key: (config, expandedjobs, {configfile: mtime})}
+        self._caches     = {}  # {cache path: generator.runtime.Cache}
+        self._server     = SocketServer.TCPServer(("127.0.0.1", 0), RequestHandler)
+        self._server.generatord = self
+        self.servAddr    = self._server.server_address
+        interruptRegistry.register(self.shut_down)
+
+
+    ##
+    # runner(options, args, generatord) runs a generator command line, using
+    # the methods below to re-use what previous requests left behind
+
+    def serve(self, runner):
+        self._runner = runner
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # clean up on 'kill <pid>'
+        self._writeAddressFile()
+        try:
+            self._server.serve_forever()
+        finally:
+            self.shut_down()
+
 
     def shut_down(self):
-        self.daemon.shutdown(True)
-
-
-# This is adopted from the standard Pyro example
-class GeneratordWorker(Pyro.core.ObjBase):
-
-    def __init__(self, num):
-        Pyro.core.ObjBase.__init__(self)
-        self.num = num
-        self.job = generator_context['jobconf']
-        self.classList = self._scanLibs(self.job)
-
-    def _scanLibs(self, job):
-        genobj = Generator(generator_context)
-        (ns,classes,d,tr,lib) = genobj.scanLibrary(job.get("library", []))
-        return classes
-
-
-    def joke(self,name):
-        return "sorry "+name+", I don't know any jokes!"
-
-    def tree(self, classId, classPath, variantSet):
-        c = Class(classId, classPath, None, generator_context, {})
-        t = c.tree()
-        return t
-
-    def dependencies(self, classId, classPath, variantSet, force=False):
-        print "\nrunning on Pyro server", str(self.num)
-        c = Class(classId, classPath, None, generator_context, self.classList)
-        d, cached = c.dependencies(variantSet, force)
-        return d, cached
-        
-    def run(self, jobname):
-        print "\nrunning on Pyro server", str(self.num), ":", jobname
-        config = generator_context['config']
-        console = generator_context['console']
-        expjobs = config.resolveExtendsAndRuns([jobname])
-        config.includeSystemDefaults(expjobs)
-        config.resolveMacros(expjobs)
-        config.resolveLibs(expjobs)
-        config.checkSchema(expjobs, checkJobTypes=True)
-        config.cleanUpJobs(expjobs)
-        console.resetFilter()
-        for jobn in expjobs:
-            console.head("Executing: %s" % jobn, True)
-            job = generator_context['config'].getJob(jobn)
-            assert job is not None
-            job_context = copy.copy(generator_context)
-            job_context.update({'jobconf':job})
-            genobj = Generator(job_context)
-            genobj.run()
-        
-
-# This is from B.Dayley's "Python Phrasebook"
-class httpServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
-    
-    def do_POST(self):
-        self.query_string = self.rfile.read(int(self.headers['Content-Length']))
-        self.args = dict(cgi.parse_qsl(self.query_string))
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        sys.stdout = self.wfile
-        self.wfile.write("<h2>Handling Post</h2><p>")
-        self.wfile.write("<li>Location: <b>%s</b>" % (self.path,))
-        self.wfile.write("<li>Arguments: <b>%s</b><hr>" % (self.args,))
-        #execfile(self.path, self.args)
+        try:
+            os.remove(self.addressFile)
+        except OSError:
+            pass
+        self._server.server_close()
+
+
+    def _writeAddressFile(self):
+        fd = os.open(self.addressFile, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+        fobj = os.fdopen(fd, "w")
+        try:
+            json.dump({'port': self.servAddr[1], 'token': self.token, 'pid': os.getpid()}, fobj)
+        finally:
+            fobj.close()
+
+
+    def runRequest(self, request, out, err):
+        self._console.info("Request: %s" % " ".join(request['argv']))
+        options = None
+        savedStreams = sys.stdout, sys.stderr
+        savedCwd     = os.getcwd()
+        sys.stdout, sys.stderr = out, err
+        try:
+            try:
+                os.chdir(request['cwd'])
+                (options, args) = GeneratorArguments(option_class=ExtendAction).parse_args(request['argv'])
+                self._runner(options, args, self)
+                retval = 0
+            except SystemExit, e:
+                if e.code is None or isinstance(e.code, int):
+                    retval = e.code or 0
+                else:
+                    print >> sys.stderr, e.code
+                    retval = 1
+            except Exception, e:
+                if options is None or options.stacktrace:
+                    traceback.print_exc()
+                elif str(e):
+                    print >> sys.stderr, e
+                else:
+                    print >> sys.stderr, "Terminating on terminal exception (%r)" % e
+                retval = 1
+        finally:
+            sys.stdout, sys.stderr = savedStreams
+            os.chdir(savedCwd)
+        return retval
+
+
+    ##
+    # The resolved config for a command line, as returned by loader() the
+    # first time: (config, expandedjobs, configfiles). It is loaded again if
+    # one of the config files has changed.
+
+    def getConfig(self, options, args, loader):
+        key = (tuple(args), json.dumps(options.letmacros, sort_keys=True))
+        if key in self._configs:
+            config, expandedjobs, mtimes = self._configs[key]
+            if mtimes == self._mtimes(mtimes.keys()):
+                return config, expandedjobs
+        config, expandedjobs, configFiles = loader()
+        if key in self._configs:
+            self._caches = {}  # pick up changed cache settings
+        self._configs[key] = (config, expandedjobs, self._mtimes(configFiles))
+        return config, expandedjobs
+
+
+    def _mtimes(self, paths):
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+
+    ##
+    # Called before a job is run, with the job's context
+
+    def prepareJob(self, ctx):
+        job = ctx['jobconf']
+        for lib in job.get("library", []):
+            lib.resetYoungest()  # look at the file system again
+        cache = self._caches.get(self._cachePath(ctx))
+        if cache:
+            cache.newRun(ctx['console'])
+            ctx['cache'] = cache
+
 
+    ##
+    # Called once the job's Generator is set up, to keep its cache
 
+    def keepCache(self, ctx):
+        cache = ctx['cache']
+        cache.setResident()
+        self._caches[self._cachePath(ctx)] = cache
 
 
+    def _cachePath(self, ctx):
+        return ctx['config'].absPath(ctx['jobconf'].get("cache/compile", "cache"))
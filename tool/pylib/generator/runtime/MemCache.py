@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# In-process memory tier of generator.runtime.Cache.
+#
+# Entries are kept per namespace (the cacheId prefix, like 'tree', 'deps',
+# 'compiled', 'class'), and the least recently used ones are evicted when
+# either the namespace exceeds its quota or all namespaces together exceed
+# the budget. Each entry carries the tick of its last use; a heap of
+# (tick, cacheId) per namespace finds the oldest one. Heap items whose tick
+# is not the entry's any more are stale, and skipped.
+# The size of an entry is the length of its pickle, which Cache has at hand
+# anyway when reading from or writing to disk.
+#
+# Namespaces listed in 'copy-on-read' (default: 'tree') keep the pickle
+# rather than the object, and hand out a fresh copy on every get(). This is
+# for values that callers modify in place (the optimizers work directly on
+# the syntax trees).
+##
+
+import re, itertools, heapq
+import cPickle as pickle
+
+MB = 1024 * 1024
+
+class MemCache(object):
+
+    def __init__(self, budget=256*MB, quotas={}, copyOnRead=("tree",)):
+        self._entries = {}    # {namespace: {cacheId: [content, time, size, frozen, tick]}}
+        self._heaps   = {}    # {namespace: [(tick, cacheId)]}
+        self._size    = {}    # {namespace: bytes}
+        self._ticks   = itertools.count()
+        self.stats    = {}    # {namespace: {'hits':0, 'misses':0, 'evictions':0}}
+        self.configure(budget, quotas, copyOnRead)
+
+
+    ##
+    # (Re-)set the limits; budget and quotas are in bytes, None means unlimited
+
+    def configure(self, budget=256*MB, quotas={}, copyOnRead=("tree",)):
+        self._budget     = budget
+        self._quotas     = dict(quotas)
+        self._copyOnRead = set(copyOnRead)
+        self._shrink()
+
+
+    ##
+    # "tree1-/a/b.js-{}" -> "tree"
+
+    @staticmethod
+    def namespace(cacheId):
+        return re.sub(r'\d+$', '', cacheId.split("-", 1)[0])
+
+
+    def _stat(self, ns, counter):
+        if ns not in self.stats:
+            self.stats[ns] = {'hits':0, 'misses':0, 'evictions':0}
+        self.stats[ns][counter] += 1
+
+
+    def __contains__(self, cacheId):
+        return cacheId in self._entries.get(self.namespace(cacheId), {})
+
+
+    ##
+    # returns (content, time), or (None, None) if there is no entry
+
+    def get(self, cacheId):
+        ns = self.namespace(cacheId)
+        entries = self._entries.get(ns)
+        if not entries or cacheId not in entries:
+            self._stat(ns, 'misses')
+            return None, None
+        entry = entries[cacheId]
+        self._touch(ns, cacheId, entry)   # mark as most recently used
+        self._stat(ns, 'hits')
+        content, time, _, frozen, _ = entry
+        if frozen:
+            content = pickle.loads(content)
+        return content, time
+
+
+    ##
+    # pickled: the pickle of content, if the caller already has it
+
+    def put(self, cacheId, content, time, pickled=None):
+        ns = self.namespace(cacheId)
+        if pickled is None:
+            pickled = pickle.dumps(content, 2)
+        frozen = ns in self._copyOnRead
+        size   = len(pickled)
+        if not self._fits(ns, size):
+            self.remove(cacheId)
+            return
+        if frozen:
+            content = pickled
+        self.remove(cacheId)
+        entry = self._entries.setdefault(ns, {})[cacheId] = [content, time, size, frozen, None]
+        self._touch(ns, cacheId, entry)
+        self._size[ns] = self._size.get(ns, 0) + size
+        self._shrink(ns)
+
+
+    def _touch(self, ns, cacheId, entry):
+        entry[4] = self._ticks.next()
+        heap = self._heaps.setdefault(ns, [])
+        heapq.heappush(heap, (entry[4], cacheId))
+        if len(heap) > 2 * len(self._entries[ns]) + 64:  # mostly stale
+            heap[:] = [(e[4], key) for key, e in self._entries[ns].iteritems()]
+            heapq.heapify(heap)
+
+
+    ##
+    # (tick, cacheId) of the least recently used entry of namespace ns
+
+    def _oldest(self, ns):
+        entries = self._entries[ns]
+        heap    = self._heaps[ns]
+        while True:
+            tick, cacheId = heap[0]
+            if cacheId in entries and entries[cacheId][4] == tick:
+                return tick, cacheId
+            heapq.heappop(heap)
+
+
+    def _fits(self, ns, size):
+        if self._budget is not None and size > self._budget:
+            return False
+        quota = self._quotas.get(ns)
+        if quota is not None and size > quota:
+            return False
+        return True
+
+
+    ##
+    # returns the removed (content, time), or (None, None)
+
+    def remove(self, cacheId):
+        ns = self.namespace(cacheId)
+        entries = self._entries.get(ns)
+        if not entries or cacheId not in entries:
+            return None, None
+        content, time, size, frozen, _ = entries.pop(cacheId)
+        self._size[ns] -= size
+        if frozen:
+            content = pickle.loads(content)
+        return content, time
+
+
+    def clear(self):
+        self._entries = {}
+        self._heaps   = {}
+        self._size    = {}
+
+
+    def size(self):
+        return sum(self._size.values())
+
+
+    def _evict(self, ns):
+        _, cacheId = self._oldest(ns)
+        entry = self._entries[ns].pop(cacheId)
+        self._size[ns] -= entry[2]
+        self._stat(ns, 'evictions')
+
+
+    ##
+    # evict least recently used entries until quotas and budget are met
+
+    def _shrink(self, ns=None):
+        namespaces = [ns] if ns else self._entries.keys()
+        for name in namespaces:
+            quota = self._quotas.get(name)
+            while quota is not None and self._size.get(name, 0) > quota:
+                self._evict(name)
+        while self._budget is not None and self.size() > self._budget:
+            # oldest head entry across namespaces
+            candidates = [(self._oldest(name)[0], name) for name, entries in self._entries.items() if entries]
+            self._evict(min(candidates)[1])
+
+
+    def statsString(self):
+        res = []
+        for ns in sorted(self.stats):
+            s = self.stats[ns]
+            res.append("%s: %d hits, %d misses, %d evictions, %.1fMB" % (
+                ns, s['hits'], s['misses'], s['evictions'], self._size.get(ns, 0) / float(MB)))
+        return "; ".join(res)
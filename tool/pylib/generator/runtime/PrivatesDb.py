@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# The replacements of private names ("privates" optimization), shared by all
+# processes using a cache - without locking.
+#
+# The database is an append-only log file, one private name per line; like
+# the privates map it replaces, it has a single namespace for all classes
+# (see privateoptimizer.allocate()). A name's replacement is derived from its
+# position: the n-th distinct name in the file gets "__" + convert(n). As
+# every process sees the same sequence of lines, they all agree on the
+# replacements, however their appends are interleaved; a name appended twice
+# keeps its first position.
+#
+# So looking up known names needs nothing but reading the new lines of the
+# file (if any), and new names cost a single O_APPEND write, which is atomic
+# for local file systems.
+##
+
+import os
+from misc import filetool
+from misc.util import convert
+
+class PrivatesDb(object):
+
+    def __init__(self, path):
+        self._path   = path
+        self._repls  = {}    # {name: replacement}
+        self._file   = None  # (device, inode) of the log file read so far
+        self._offset = 0     # end of the last complete line read
+
+
+    ##
+    # Map the private names of a class to their replacements (see
+    # ecmascript.transform.optimizer.privateoptimizer.allocate())
+
+    def allocate(self, names):
+        missing = [name for name in names if name not in self._repls]
+        if missing:
+            self._read()
+            missing = [name for name in missing if name not in self._repls]
+            if missing:
+                self._append(missing)
+                self._read()
+        return dict((name, self._repls[name]) for name in names)
+
+
+    def __len__(self):
+        self._read()
+        return len(self._repls)
+
+
+    ##
+    # Pick up the lines appended since the last call
+
+    def _read(self):
+        try:
+            fobj = open(self._path, "rb")
+        except IOError:
+            return
+        try:
+            st = os.fstat(fobj.fileno())
+            if (st.st_dev, st.st_ino) != self._file or st.st_size < self._offset:
+                # (re-)created, e.g. by cleaning the cache
+                self._repls, self._file, self._offset = {}, (st.st_dev, st.st_ino), 0
+            fobj.seek(self._offset)
+            data = fobj.read()
+        finally:
+            fobj.close()
+
+        end = data.rfind("\n") + 1  # a line still being written is left for the next time
+        for line in data[:end].splitlines():
+            name = line.decode("utf-8")
+            if name not in self._repls:
+                self._repls[name] = "__%s" % convert(len(self._repls))
+        self._offset += end
+
+
+    def _append(self, names):
+        filetool.directory(os.path.dirname(self._path))
+        data = u"".join(u"%s\n" % name for name in names).encode("utf-8")
+        fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, data)  # in one go, so lines of different processes don't mix
+        finally:
+            os.close(fd)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+##
+# Shared second-level cache for generator.runtime.Cache.
+#
+# Entries are content-addressed: their key is a hash over the cacheId with
+# the source path taken out, and the digest of the source file (see
+# Cache._remoteKey()), so different workspaces and machines compute the same
+# key for the same class contents. Values are the compressed pickles the
+# local store keeps, prefixed by an HMAC-SHA256 over key and value with a
+# secret shared by all parties ('cache/remote/secret' or '.../secret-file').
+# Entries that don't carry a valid signature are treated as missing, so
+# nothing gets unpickled that wasn't written by a holder of the secret.
+#
+# Two backends:
+#
+#   HttpRemote  - GET/PUT <url>/<key> against an HTTP server, e.g. the one in
+#                 generator.runtime.CacheServer (tool/bin/cache-server.py)
+#   DirRemote   - a directory shared e.g. over a network file system
+#
+# RemoteCache wraps a backend with negative caching (keys known to be missing
+# are not asked for again in this run) and write-back (uploads are collected
+# and sent on flush()). If the backend fails, it is switched off for the rest
+# of the run, so builds never fail because of the shared cache.
+##
+
+import os, re, socket, httplib, urlparse, errno, hmac, hashlib
+
+KEY_REGEXP = re.compile(r'^[0-9a-f]{40}$')
+MAC_LENGTH = 64   # hex digits of an HMAC-SHA256
+
+
+class RemoteError(IOError): pass
+
+
+##
+# Entry for key: the signature of key and data, followed by data
+
+def sign(secret, key, data):
+    return hmac.new(secret, key + data, hashlib.sha256).hexdigest() + data
+
+
+##
+# Compare two strings in time independent of where they differ
+# (hmac.compare_digest() only exists from Python 2.7.7)
+
+def _compareDigest(a, b):
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+compareDigest = getattr(hmac, "compare_digest", _compareDigest)
+
+
+##
+# The data of a signed entry for key, or None if the signature doesn't match
+
+def verify(secret, key, entry):
+    mac, data = entry[:MAC_LENGTH], entry[MAC_LENGTH:]
+    if len(mac) == MAC_LENGTH and compareDigest(sign(secret, key, data)[:MAC_LENGTH], mac):
+        return data
+    return None
+
+
+##
+# The shared secret from the 'secret' or 'secret-file' key of remoteConf
+
+def readSecret(remoteConf):
+    if remoteConf.get("secret"):
+        secret = remoteConf["secret"]
+    elif remoteConf.get("secret-file"):
+        fobj = open(os.path.expanduser(remoteConf["secret-file"]), "rb")
+        try:
+            secret = fobj.read().strip()
+        finally:
+            fobj.close()
+    else:
+        raise ValueError("'cache/remote' needs either a 'secret' or a 'secret-file' key")
+    if not secret:
+        raise ValueError("The secret for 'cache/remote' is empty")
+    return secret.encode("utf-8") if isinstance(secret, unicode) else secret
+
+
+##
+# Factory for the remote configured under 'cache/remote'
+
+def createRemote(remoteConf, console):
+    if not remoteConf:
+        return None
+    secret = readSecret(remoteConf)
+    if remoteConf.get("url"):
+        backend = HttpRemote(remoteConf["url"], remoteConf.get("timeout", 5))
+    elif remoteConf.get("path"):
+        backend = DirRemote(remoteConf["path"])
+    else:
+        raise ValueError("'cache/remote' needs either an 'url' or a 'path' key")
+    return RemoteCache(backend, console, secret,
+                       namespaces = remoteConf.get("namespaces", ["compiled", "tree"]),
+                       upload     = remoteConf.get("upload", True))
+
+
+class RemoteCache(object):
+
+    def __init__(self, backend, console, secret, namespaces=("compiled", "tree"), upload=True):
+        self._backend    = backend
+        self._console    = console
+        self._secret     = secret
+        self._namespaces = set(namespaces)
+        self._upload     = upload
+        self._missing    = set(())  # negative cache
+        self._pending    = {}       # {key: data} write-back queue
+        self._enabled    = True
+        self.stats       = {'hits':0, 'misses':0, 'uploads':0}
+
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_pending'] = {}
+        return d
+
+
+    ##
+    # start over for another run in the same process; keys missing before
+    # might have been uploaded in the meantime
+
+    def reset(self, console):
+        self._console = console
+        self._missing = set(())
+
+
+    def handles(self, namespace):
+        return self._enabled and namespace in self._namespaces
+
+
+    def get(self, key):
+        if not self._enabled or key in self._missing:
+            return None
+        if key in self._pending:
+            return self._pending[key]
+        try:
+            data = self._backend.get(key)
+        except (RemoteError, IOError, OSError, socket.error, httplib.HTTPException), e:
+            self._disable(e)
+            return None
+        if data is not None:
+            data = verify(self._secret, key, data)
+            if data is None:
+                self._console.warn("Ignoring shared cache entry with a bad signature: %s" % key)
+        if data is None:
+            self._missing.add(key)
+            self.stats['misses'] += 1
+        else:
+            self.stats['hits'] += 1
+        return data
+
+
+    def put(self, key, data):
+        if not self._enabled or not self._upload:
+            return
+        self._pending[key] = data
+        self._missing.discard(key)
+
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        if not self._enabled:
+            return
+        try:
+            for key, data in pending.iteritems():
+                self._backend.put(key, sign(self._secret, key, data))
+                self.stats['uploads'] += 1
+        except (RemoteError, IOError, OSError, socket.error, httplib.HTTPException), e:
+            self._disable(e)
+
+
+    def _disable(self, e):
+        self._console.warn("Shared cache not usable, continuing without it (%s)" % (e,))
+        self._enabled = False
+        self._pending = {}
+
+
+    def statsString(self):
+        return "%(hits)d hits, %(misses)d misses, %(uploads)d uploads" % self.stats
+
+
+##
+# HTTP backend; keeps a persistent connection
+
+class HttpRemote(object):
+
+    def __init__(self, url, timeout=5):
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError("Unsupported shared cache URL: %s" % url)
+        self._scheme  = parsed.scheme
+        self._netloc  = parsed.netloc
+        self._prefix  = parsed.path.rstrip("/")
+        self._timeout = timeout
+        self._conn    = None
+
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_conn'] = None
+        return d
+
+
+    def _request(self, method, key, body=None):
+        for attempt in (1, 2):  # retry once on a dropped keep-alive connection
+            if self._conn is None:
+                connClass = httplib.HTTPSConnection if self._scheme == "https" else httplib.HTTPConnection
+                self._conn = connClass(self._netloc, timeout=self._timeout)
+            try:
+                headers = {'Content-Type': 'application/octet-stream'} if body is not None else {}
+                self._conn.request(method, "%s/%s" % (self._prefix, key), body, headers)
+                resp = self._conn.getresponse()
+                return resp.status, resp.read()
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                self._conn.close()
+                self._conn = None
+                if attempt == 2:
+                    raise
+
+
+    def get(self, key):
+        status, data = self._request("GET", key)
+        if status == 200:
+            return data
+        elif status == 404:
+            return None
+        raise RemoteError("GET %s returned status %d" % (key, status))
+
+
+    def put(self, key, data):
+        status, _ = self._request("PUT", key, data)
+        if status not in (200, 201, 204):
+            raise RemoteError("PUT %s returned status %d" % (key, status))
+
+
+##
+# Shared directory backend; also used by the HTTP server to hold its entries
+
+class DirRemote(object):
+
+    def __init__(self, path):
+        self._path = path
+
+
+    def _entryPath(self, key):
+        if not KEY_REGEXP.match(key):
+            raise RemoteError("Invalid shared cache key: %r" % key)
+        return os.path.join(self._path, key[:2], key)
+
+
+    def get(self, key):
+        try:
+            fobj = open(self._entryPath(key), "rb")
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            return fobj.read()
+        finally:
+            fobj.close()
+
+
+    def put(self, key, data):
+        entryPath = self._entryPath(key)
+        if os.path.exists(entryPath):
+            return   # content-addressed; nothing to update
+        entryDir = os.path.dirname(entryPath)
+        if not os.path.isdir(entryDir):
+            try:
+                os.makedirs(entryDir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        tmpPath = "%s.%d.tmp" % (entryPath, os.getpid())
+        fobj = open(tmpPath, "wb")
+        try:
+            fobj.write(data)
+        finally:
+            fobj.close()
+        os.rename(tmpPath, entryPath)  # atomic for concurrent readers
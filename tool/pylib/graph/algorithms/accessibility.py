@@ -25,7 +25,8 @@
 """
 Accessibility algorithms.
 
-@sort: accessibility, connected_components, cut_edges, cut_nodes, mutual_accessibility
+@sort: accessibility, connected_components, cut_edges, cut_nodes, mutual_accessibility,
+strongly_connected_components
 """
 
 
@@ -35,20 +36,47 @@ def accessibility(graph):
     """
     Accessibility matrix (transitive closure).
 
+    The graph is condensed to its strongly connected components, and the components
+    reachable from each component are collected as a bitset, walking the condensed
+    (acyclic) graph from its sinks. So all nodes of a component share the work, and
+    each edge is looked at once.
+
     @type  graph: graph
     @param graph: Graph.
 
     @rtype:  dictionary
     @return: Accessibility information for each node.
     """
-    accessibility = {}        # Accessibility matrix
+    components = strongly_connected_components(graph)
+    component_of = {}         # Node -> number of its component
+    for number, component in enumerate(components):
+        for each in component:
+            component_of[each] = number
+
+    # Components come in reverse topological order, so the ones reachable from a
+    # component are already done (or the component itself)
+    reach = []                # Component number -> bitset of reachable components
+    number_of = {}            # Bit of a component -> its number
+    for number, component in enumerate(components):
+        bits = 1 << number
+        number_of[bits] = number
+        for each in component:
+            for other in graph[each]:
+                target = component_of[other]
+                if (target != number):
+                    bits |= reach[target]
+        reach.append(bits)
 
-    # For each node i, mark each node j if that exists a path from i to j.
-    for each in graph:
-        access = {}
-        # Perform DFS to explore all reachable nodes
-        _dfs(graph, access, 1, each)
-        accessibility[each] = access.keys()
+    accessibility = {}        # Accessibility matrix
+    for number, component in enumerate(components):
+        access = []
+        bits = reach[number]
+        while (bits):
+            lowest = bits & -bits
+            access.extend(components[number_of[lowest]])
+            bits ^= lowest
+        for each in component:
+            accessibility[each] = list(access)
     return accessibility
 
 
@@ -65,17 +93,73 @@ def mutual_accessibility(graph):
     @return: Mutual-accessibility information for each node.
     """
     mutual_access = {}
-    access = graph.accessibility()
+    position = dict((each, i) for i, each in enumerate(graph))
 
-    for i in graph:
-        mutual_access[i] = []
-        for j in graph:
-            if (i in access[j] and j in access[i]):
-                mutual_access[i].append(j)
+    for component in strongly_connected_components(graph):
+        component.sort(key=position.get)
+        for each in component:
+            mutual_access[each] = list(component)
 
     return mutual_access
 
 
+def strongly_connected_components(graph):
+    """
+    Strongly connected components (Tarjan's algorithm).
+
+    The search is iterative, so deep graphs don't hit the recursion limit.
+
+    @type  graph: graph
+    @param graph: Graph.
+
+    @rtype:  list
+    @return: List of components (lists of nodes), in reverse topological order: every
+    component comes after the components reachable from it.
+    """
+    index = {}                # Node -> DFS number
+    low = {}                  # Node -> lowest DFS number reachable from the node's subtree
+    stack = []                # Visited nodes not yet assigned to a component
+    on_stack = {}
+    components = []
+
+    for root in graph:
+        if (root in index):
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, iter(graph[root]))]
+        while (work):
+            node, neighbors = work[-1]
+            for each in neighbors:
+                if (each not in index):
+                    index[each] = low[each] = len(index)
+                    stack.append(each)
+                    on_stack[each] = 1
+                    work.append((each, iter(graph[each])))
+                    break
+                elif (each in on_stack and index[each] < low[node]):
+                    low[node] = index[each]
+            else:
+                work.pop()
+                if (work):
+                    parent = work[-1][0]
+                    if (low[node] < low[parent]):
+                        low[parent] = low[node]
+                # node is the root of a component
+                if (low[node] == index[node]):
+                    component = []
+                    while (True):
+                        each = stack.pop()
+                        del on_stack[each]
+                        component.append(each)
+                        if (each == node):
+                            break
+                    components.append(component)
+
+    return components
+
+
 # Connected components
 
 def connected_components(graph):
@@ -121,10 +205,13 @@ def _dfs(graph, visited, count, node):
     @param node: Node to be explored by DFS.
     """
     visited[node] = count
-    # Explore recursively the connected component
-    for each in graph[node]:
-        if (each not in visited):
-            _dfs(graph, visited, count, each)
+    # Explore the connected component (iteratively, so deep graphs don't hit the recursion limit)
+    stack = [node]
+    while (stack):
+        for each in graph[stack.pop()]:
+            if (each not in visited):
+                visited[each] = count
+                stack.append(each)
 
 
 # Cut-Edge and Cut-Vertex identification
@@ -63,21 +63,27 @@ def find_cycle(graph, directed=False):
         path.reverse()
         return path
     
-    def dfs(node):
+    def dfs(root):
         """
-        Depht-first search subfunction.
+        Depht-first search subfunction (iterative, see searching.depth_first_search()).
         """
-        visited[node] = 1
-        # Explore recursively the connected component
-        for each in graph[node]:
-            if (cycle):
-                return
-            if (each not in visited):
-                spanning_tree[each] = node
-                dfs(each)
-            else:
-                if (directed or spanning_tree[node] is not each):
+        visited[root] = 1
+        stack = [(root, iter(graph[root]))]
+        while (stack and not cycle):
+            node, neighbors = stack[-1]
+            # Explore the connected component, descending into the first unvisited neighbor
+            for each in neighbors:
+                if (each not in visited):
+                    spanning_tree[each] = node
+                    visited[each] = 1
+                    stack.append((each, iter(graph[each])))
+                    break
+                elif (directed or spanning_tree[node] is not each):
                     cycle.extend(find_cycle_to_ancestor(node, each))
+                    if (cycle):
+                        break
+            else:
+                stack.pop()
 
     visited = {}              # List for marking visited and non-visited nodes
     spanning_tree = {}        # Spanning tree
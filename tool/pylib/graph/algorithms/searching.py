@@ -52,18 +52,29 @@ def depth_first_search(graph, root=None, filter=filters.null()):
         3. Graph's postordering
     """
 
-    def dfs(node):
+    def dfs(root):
         """
         Depht-first search subfunction.
+
+        Iterative, with a stack of neighbor iterators, so deep graphs don't hit the
+        recursion limit.
         """
-        visited[node] = 1
-        pre.append(node)
-        # Explore recursively the connected component
-        for each in graph[node]:
-            if (each not in visited and filter(each, node)):
-                spanning_tree[each] = node
-                dfs(each)
-        post.append(node)
+        visited[root] = 1
+        pre.append(root)
+        stack = [(root, iter(graph[root]))]
+        while (stack):
+            node, neighbors = stack[-1]
+            # Explore the connected component, descending into the first unvisited neighbor
+            for each in neighbors:
+                if (each not in visited and filter(each, node)):
+                    spanning_tree[each] = node
+                    visited[each] = 1
+                    pre.append(each)
+                    stack.append((each, iter(graph[each])))
+                    break
+            else:
+                stack.pop()
+                post.append(node)
 
     visited = {}            # List for marking visited and non-visited nodes
     spanning_tree = {}      # Spanning tree
@@ -73,9 +73,16 @@ def _dfs(graph, visited, node, pre, post):
     """
     visited[node] = 1
     if (pre): yield node
-    # Explore recursively the connected component
-    for each in graph[node]:
-        if (each not in visited):
-            for other in _dfs(graph, visited, each, pre, post):
-                yield other
-    if (post): yield node
+    # Explore the connected component (iteratively, so deep graphs don't hit the recursion limit)
+    stack = [(node, iter(graph[node]))]
+    while (stack):
+        node, neighbors = stack[-1]
+        for each in neighbors:
+            if (each not in visited):
+                visited[each] = 1
+                if (pre): yield each
+                stack.append((each, iter(graph[each])))
+                break
+        else:
+            stack.pop()
+            if (post): yield node
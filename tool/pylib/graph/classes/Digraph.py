@@ -45,7 +45,8 @@ class digraph (object):
     get_node_attributes, has_edge, has_node, incidents, inverse, neighbors, nodes, order,
     set_edge_label, set_edge_weight, traversal, generate, read, write, accessibility,
     breadth_first_search, cut_edges, cut_nodes, depth_first_search, heuristic_search,
-    minimal_spanning_tree, mutual_accessibility, shortest_path, topological_sorting
+    minimal_spanning_tree, mutual_accessibility, shortest_path, strongly_connected_components,
+    topological_sorting
     """
 
 
@@ -269,7 +270,7 @@ class digraph (object):
         @type  attrs: list
         @param attrs: List of node attributes specified as (attribute, value) tuples.
         """
-        if (v not in self.node_neighbors[u]):
+        if ((u, v) not in self.edge_properties):   # rather than searching u's neighbor list
             self.node_neighbors[u].append(v)
             self.node_incidence[v].append(u)
             self.edge_properties[(u, v)] = [label, wt]
@@ -591,6 +592,16 @@ class digraph (object):
         return accessibility.mutual_accessibility(self)
 
 
+    def strongly_connected_components(self):
+        """
+        Strongly connected components.
+
+        @rtype:  list
+        @return: List of components (lists of nodes), in reverse topological order.
+        """
+        return accessibility.strongly_connected_components(self)
+
+
     def topological_sorting(self):
         """
         Topological sorting.
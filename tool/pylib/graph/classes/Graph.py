@@ -254,7 +254,7 @@ class graph (object):
         @type  attrs: list
         @param attrs: List of node attributes specified as (attribute, value) tuples.
         """
-        if (v not in self.node_neighbors[u] and u not in self.node_neighbors[v]):
+        if ((u, v) not in self.edge_properties):   # rather than searching the neighbor lists
             self.node_neighbors[u].append(v)
             self.node_neighbors[v].append(u)
             self.edge_properties[(u, v)] = [label, wt]
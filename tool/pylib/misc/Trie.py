@@ -30,14 +30,19 @@ class Trie(object):
     def __init__(self, sep="."):
         self._data = {}
         self._sep  = sep
+        self._values = {}  # {name: [value]}, for names added with values
 
-    def add(self, name):
+    ##
+    # Add name, optionally with a value that is kept for it (see valuesBelow())
+    def add(self, name, value=None):
         nameparts = name.split(self._sep)
         p = self._data
         for part in nameparts:
             if part not in p:
                 p[part] = {}
             p = p[part]
+        if value is not None:
+            self._values.setdefault(name, []).append(value)
 
     def data(self):
         return self._data
@@ -58,6 +63,21 @@ class Trie(object):
 
         return longestmatch
 
+    ##
+    # Returns the values of name and of all names below it, i.e. starting with
+    # name and the separator ("" for all values)
+    def valuesBelow(self, name):
+        p = self._data
+        if name:
+            for part in name.split(self._sep):
+                if part not in p:
+                    return []
+                p = p[part]
+        result = list(self._values.get(name, []))
+        for curr in self._traverse(name, p):
+            result.extend(self._values.get(curr, []))
+        return result
+
     def traverse(self):
         return self._traverse(u'', self._data)
 
@@ -20,7 +20,10 @@
 #
 ################################################################################
 
+import os, glob, mmap, struct, zlib, tempfile
 from elementtree import ElementTree
+from misc import json
+from misc.securehash import getHash
 
 def getLocale(calendarElement):
     locale = calendarElement.find("identity/language").attrib["type"]
@@ -173,4 +176,114 @@ def parseCldrFile(filename, outputDirectory=None):
     data.update(extractNumber(tree))
 
     return data
-    
+
+
+# ------------------------------------------------------------------------------
+#   Precompiled locale store
+# ------------------------------------------------------------------------------
+
+##
+# The locale data that parseCldrFile() extracts from all the CLDR files of a
+# directory (e.g. tool/data/cldr/main/*.xml), compiled into a single file next
+# to it (main.dat). Layout:
+#
+#   magic | length of the index | index (JSON) | locale data ...
+#
+# with the index {locale: [offset, length, size and digest of the .xml file]},
+# and the data of each locale as zlib-compressed JSON. The file is memory-
+# mapped, so reading any number of locales takes one open(). A locale whose
+# .xml file differs from the one at compile time is left out (see
+# CldrStore.get()).
+
+STORE_MAGIC = "qxcldr2\n"
+
+def storeFile(xmlDir):
+    return os.path.normpath(xmlDir) + ".dat"
+
+
+def xmlDigest(xmlPath):
+    fobj = open(xmlPath, "rb")
+    try:
+        return getHash(fobj.read())
+    finally:
+        fobj.close()
+
+
+def compileStore(xmlDir, storePath=None):
+    storePath = storePath or storeFile(xmlDir)
+    index = {}
+    blobs = []
+    offset = 0
+    for xmlPath in sorted(glob.glob(os.path.join(xmlDir, "*.xml"))):
+        locale = os.path.splitext(os.path.basename(xmlPath))[0]
+        blob = zlib.compress(json.dumps(parseCldrFile(xmlPath), sort_keys=True), 9)
+        index[locale] = [offset, len(blob), os.path.getsize(xmlPath), xmlDigest(xmlPath)]
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps(index, sort_keys=True, separators=(',', ':'))
+
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(storePath)))
+    try:
+        out = os.fdopen(fd, "wb")
+        out.write(STORE_MAGIC + struct.pack("!I", len(header)) + header)
+        out.write("".join(blobs))
+        out.close()
+        os.chmod(tmpPath, 0644)
+        os.rename(tmpPath, storePath)
+    except:
+        os.unlink(tmpPath)
+        raise
+    return len(index)
+
+
+class CldrStore(object):
+
+    def __init__(self, storePath):
+        self.path  = storePath
+        self.index = {}
+        self._data = None
+        self._base = 0
+        if not os.path.isfile(storePath) or not os.path.getsize(storePath):
+            return
+        fobj = open(storePath, "rb")
+        try:
+            data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fobj.close()
+        if data[:len(STORE_MAGIC)] != STORE_MAGIC:
+            return
+        pos = len(STORE_MAGIC) + 4
+        (length,) = struct.unpack("!I", data[pos - 4:pos])
+        self.index = json.loads(data[pos:pos + length])
+        self._data = data
+        self._base = pos + length
+
+
+    ##
+    # The data of locale, or None if it is not in the store or its .xml file
+    # (at xmlPath) has changed since; the files are compared by size and
+    # digest, as their mtimes depend on the checkout
+    def get(self, locale, xmlPath):
+        entry = self.index.get(locale)
+        if entry is None:
+            return None
+        offset, length, xmlSize, digest = entry
+        try:
+            if os.path.getsize(xmlPath) != xmlSize or xmlDigest(xmlPath) != digest:
+                return None
+        except (IOError, OSError):
+            return None
+        start = self._base + offset
+        return json.loads(zlib.decompress(self._data[start:start + length]))
+
+
+_stores = {}  # {storePath: CldrStore}
+
+##
+# The store for the .xml files in xmlDir (empty if there is none), opened once
+# per process
+def getStore(xmlDir):
+    storePath = storeFile(xmlDir)
+    if storePath not in _stores:
+        _stores[storePath] = CldrStore(storePath)
+    return _stores[storePath]
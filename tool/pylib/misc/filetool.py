@@ -20,9 +20,10 @@
 #
 ################################################################################
 
-import os, codecs, cPickle, sys, re, time, base64
+import os, codecs, cPickle, sys, re, time, base64, shutil, tempfile
 import gzip as sys_gzip
 import textutil
+from securehash import sha_construct
 
 ##
 # directory entry patterns we generally want to ignore
@@ -101,6 +102,79 @@ def save(filePath, content="", encoding="utf-8"):
     outputFile.close()
 
 
+##
+# Writes a file in chunks, so its content never has to be held in memory as a
+# whole. The chunks go to a temporary file in the target directory, which
+# only gets its final name in close(); so the name may depend on the content
+# (see hexdigest()), and the file is never seen half-written.
+#
+# With compress=True, the file is gzip'ed (like gzip()) on close().
+
+class StreamWriter(object):
+
+    def __init__(self, dirname, encoding="utf-8", compress=False):
+        dirname = normalize(dirname)
+        directory(dirname)
+        fd, self._tmpPath = tempfile.mkstemp(prefix=".tmp", dir=dirname)
+        self._file     = os.fdopen(fd, "wb")
+        self._encoding = encoding
+        self._compress = compress
+        self._hash     = sha_construct()
+
+
+    def write(self, content):
+        data = unicode(content).encode(self._encoding)
+        self._hash.update(data)
+        self._file.write(data)
+
+
+    ##
+    # Hash of the content written so far (see securehash.getHash())
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+    def close(self, filePath):
+        filePath = normalize(filePath)
+        self._file.close()
+        try:
+            if self._compress:
+                if not filePath.endswith(".gz"):
+                    filePath = filePath + ".gz"
+                srcPath, self._tmpPath = self._tmpPath, self._tmpPath + ".gz"
+                inputFile  = open(srcPath, "rb")
+                tmpFile    = open(self._tmpPath, "wb")
+                outputFile = sys_gzip.GzipFile(filePath, "wb", 9, tmpFile)  # header names the target file
+                try:
+                    shutil.copyfileobj(inputFile, outputFile)
+                finally:
+                    outputFile.close()
+                    tmpFile.close()  # GzipFile doesn't close a file object passed in
+                    inputFile.close()
+                    os.remove(srcPath)
+            # mkstemp() creates the file accessible to the owner only
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(self._tmpPath, 0666 & ~umask)
+            if os.name == "nt" and os.path.exists(filePath):  # rename doesn't replace on Windows
+                os.remove(filePath)
+            os.rename(self._tmpPath, filePath)
+        except:
+            self.abort()
+            raise
+        return filePath
+
+
+    ##
+    # Drop the file
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmpPath):
+            os.remove(self._tmpPath)
+
+
 def directory(dirname):
     # Normalize
     dirname = normalize(dirname)
@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+import unittest
+import sys, os, time, shutil, tempfile
+
+libDir = os.path.abspath(os.path.join(os.pardir, os.pardir, "pylib"))
+sys.path.append(libDir)
+from generator.runtime.Log import Log
+from generator.runtime.CacheStore import SegmentStore, CacheStoreError, entryName
+from misc import filetool
+
+
+class TestSegmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path    = os.path.join(self.tempDir, "store")
+        self.stores  = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.flush()  # so nothing is left for atexit
+        shutil.rmtree(self.tempDir)
+
+
+    def store(self, **kwargs):
+        store = SegmentStore(self.path, Log(), **kwargs)
+        self.stores.append(store)
+        return store
+
+    ##
+    # Run func(store) in a child process with a store of its own; the child
+    # exits without flushing, unless func does, and is still alive while
+    # wait is True, until the returned pipe is closed.
+    def child(self, func, wait=False):
+        readFd, writeFd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(writeFd)
+                store = SegmentStore(self.path, Log())
+                func(store)
+                store._close_readers()
+                os.close(store._segment_fd)
+                store._segment_fd = None
+                store._dirty = {}  # nothing for atexit
+            finally:
+                if wait:
+                    os.read(readFd, 1)  # until the parent closes the pipe
+                os._exit(0)
+        os.close(readFd)
+        return pid, writeFd
+
+
+    def testStoreFlush(self):
+        store = self.store()
+        store.store("a-1", "one")
+        store.store("b-2", "two")
+        self.failUnlessEqual(store.load("a-1"), "one")
+        self.failIf(os.path.exists(os.path.join(self.path, "index")))  # not before flush()
+        store.flush()
+        other = self.store()
+        self.failUnlessEqual(other.count(), 2)
+        self.failUnlessEqual(other.load("b-2"), "two")
+        self.failUnless(other.mtime("b-2") >= other.mtime("a-1"))
+        self.failUnlessEqual(other.mtime("c-3"), None)
+
+
+    def testSyncInterval(self):
+        store = self.store(**{'sync-interval': 2})
+        store.store("a-1", "one")
+        store.store("b-2", "two")
+        self.failUnlessEqual(self.store().count(), 2)
+        store.store("c-3", "three")
+        self.failUnlessEqual(self.store().count(), 2)  # only merged into the index with the next write
+        store.store("d-4", "four")
+        self.failUnlessEqual(self.store().count(), 4)
+
+
+    def testDelete(self):
+        store = self.store()
+        store.store("a-1", "one")
+        store.store("b-2", "two")
+        store.flush()
+        store.delete("a-1")
+        self.failUnlessRaises(CacheStoreError, store.load, "a-1")
+        store.flush()
+        self.failUnlessEqual(self.store().count(), 1)
+        os.unlink(os.path.join(self.path, "index"))
+        # the tombstone keeps it deleted in a rebuilt index, too
+        self.failUnlessRaises(CacheStoreError, self.store().load, "a-1")
+
+
+    def testLostIndex(self):
+        store = self.store()
+        store.store("a-1", "one")
+        store.store("a-1", "newer")
+        store.store("b-2", "two")
+        store.flush()
+        os.unlink(os.path.join(self.path, "index"))
+        other = self.store()
+        self.failUnlessEqual(other.count(), 2)
+        self.failUnlessEqual(other.load("a-1"), "newer")
+        # an unreadable index is rebuilt just the same
+        open(os.path.join(self.path, "index"), "wb").write("garbage")
+        self.failUnlessEqual(self.store().load("b-2"), "two")
+
+
+    def testChangesOfOtherProcesses(self):
+        store = self.store()
+        store.store("a-1", "one")
+        store.flush()
+        pid, pipe = self.child(lambda other: (other.store("b-2", "two"), other.flush()))
+        os.close(pipe)
+        os.waitpid(pid, 0)
+        # a miss re-reads the index
+        self.failUnlessEqual(store.load("b-2"), "two")
+        # merging keeps the entries of both
+        store.store("c-3", "three")
+        store.flush()
+        self.failUnlessEqual(self.store().count(), 3)
+
+
+    def testCompact(self):
+        store = self.store()
+        for i in range(10):
+            store.store("a-%d" % i, "old" * 1000)
+        store.flush()
+        # a writer that is gone, with a record it never merged into the index
+        deadPid, pipe = self.child(lambda other: (other.store("dead-1", "x"), other.flush(), other.store("dead-2", "y")))
+        os.close(pipe)
+        os.waitpid(deadPid, 0)
+        # a writer that is still running, with a record not in the index yet
+        livePid, livePipe = self.child(lambda other: other.store("live-1", "z"), wait=True)
+        try:
+            while len(store._segments()) < 3:
+                time.sleep(0.01)  # until the live child has created its segment
+            for i in range(10):
+                store.store("a-%d" % i, "new")
+            store.compact(force=True)
+            segments = store._segments()
+            self.failUnlessEqual([s for s in segments if "-%d-" % deadPid in s], [])
+            self.failUnlessEqual(len([s for s in segments if "-%d-" % livePid in s]), 1)
+            other = self.store()
+            self.failUnlessEqual(other.load("a-3"), "new")
+            self.failUnlessEqual(other.load("dead-1"), "x")
+            self.failUnlessEqual(other.load("dead-2"), "y")
+            # its records can still be found when the index gets rebuilt
+            os.unlink(os.path.join(self.path, "index"))
+            self.failUnlessEqual(self.store().load("live-1"), "z")
+        finally:
+            os.close(livePipe)
+            os.waitpid(livePid, 0)
+
+
+    def testIndexLocked(self):
+        store = self.store()
+        store.LOCK_RETRIES = 0
+        store.store("a-1", "one")
+        indexFile = os.path.join(self.path, "index")
+        self.failUnless(filetool.lock(indexFile))  # as another process would
+        self.failUnlessRaises(CacheStoreError, store.flush)
+        store.unlock_all()
+        # the other process' lock is left alone
+        self.failUnless(os.path.exists(filetool.lockFileName(indexFile)))
+        filetool.unlock(indexFile)
+        store.flush()
+        self.failIf(os.path.exists(filetool.lockFileName(indexFile)))
+        self.failUnlessEqual(self.store().count(), 1)
+
+
+    def testKeyLocked(self):
+        store = self.store()
+        store.store("a-1", "one")
+        keyFile = os.path.join(self.path, entryName("a-1"))
+        self.failUnless(filetool.lock(keyFile))  # as another process would
+        # load() for a read-modify-write gives up after some retries
+        self.failUnlessRaises(CacheStoreError, store.load, "a-1", True)
+        store.store("a-1", "two")
+        store.unlock_all()
+        self.failUnless(os.path.exists(filetool.lockFileName(keyFile)))
+        filetool.unlock(keyFile)
+        # uncontended, the lock is held until the write
+        self.failUnlessEqual(store.load("a-1", True), "two")
+        self.failUnless(os.path.exists(filetool.lockFileName(keyFile)))
+        store.store("a-1", "three")
+        self.failIf(os.path.exists(filetool.lockFileName(keyFile)))
+
+
+if __name__ == '__main__':
+    unittest.main()
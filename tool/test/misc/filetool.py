@@ -20,11 +20,12 @@
 ################################################################################
 
 import unittest
-import sys, os, shutil, tempfile
+import sys, os, shutil, tempfile, gzip, struct
 
 libDir = os.path.abspath(os.path.join(os.pardir, os.pardir, "pylib"))
 sys.path.append(libDir)
 from misc import filetool
+from misc.securehash import getHash
 
 class TestWalk(unittest.TestCase):
 
@@ -157,5 +158,81 @@ class TestWalk(unittest.TestCase):
         self.failUnlessEqual(foundFiles, expectedFiles)
 
 
+
+class TestStreamWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.umask = os.umask(022)
+
+    def tearDown(self):
+        os.umask(self.umask)
+        shutil.rmtree(self.tempDir)
+
+
+    def write(self, chunks, compress=False):
+        writer = filetool.StreamWriter(self.tempDir, compress=compress)
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer
+
+
+    def testHashName(self):
+        writer = self.write([u"var a=1;", u"var b=\u00e4;"])
+        content = u"var a=1;var b=\u00e4;".encode("utf-8")
+        self.failUnlessEqual(writer.hexdigest(), getHash(content))
+        # the name can depend on the content, as the file gets it only on close()
+        path = writer.close(os.path.join(self.tempDir, "app-%s.js" % writer.hexdigest()[:8]))
+        self.failUnlessEqual(os.listdir(self.tempDir), ["app-%s.js" % getHash(content)[:8]])
+        self.failUnlessEqual(open(path, "rb").read(), content)
+
+
+    def testReplace(self):
+        path = os.path.join(self.tempDir, "app.js")
+        self.write([u"old"]).close(path)
+        self.write([u"new"]).close(path)
+        self.failUnlessEqual(os.listdir(self.tempDir), ["app.js"])
+        self.failUnlessEqual(open(path, "rb").read(), "new")
+
+
+    def testAbort(self):
+        writer = self.write([u"var a=1;"])
+        self.failUnlessEqual(len(os.listdir(self.tempDir)), 1)  # the temporary file
+        writer.abort()
+        self.failUnlessEqual(os.listdir(self.tempDir), [])
+
+
+    def testFailedClose(self):
+        writer = self.write([u"var a=1;"], compress=True)
+        self.failUnlessRaises(EnvironmentError, writer.close, os.path.join(self.tempDir, "missing", "app.js"))
+        self.failUnlessEqual(os.listdir(self.tempDir), [])
+
+
+    def testGzip(self):
+        writer = self.write([u"var a=1;", u"var b=2;"], compress=True)
+        path = writer.close(os.path.join(self.tempDir, "app.js"))
+        self.failUnlessEqual(path, os.path.join(self.tempDir, "app.js.gz"))
+        self.failUnlessEqual(os.listdir(self.tempDir), ["app.js.gz"])
+        self.failUnlessEqual(gzip.open(path).read(), "var a=1;var b=2;")
+        # the header names the uncompressed file, not the temporary one
+        data = open(path, "rb").read()
+        flags = ord(data[3])
+        self.failUnless(flags & 8)  # FNAME
+        self.failUnlessEqual(data[10:data.index("\0", 10)], "app.js")
+        # a .gz target keeps its name
+        path = self.write([u"x"], compress=True).close(os.path.join(self.tempDir, "other.js.gz"))
+        self.failUnlessEqual(path, os.path.join(self.tempDir, "other.js.gz"))
+
+
+    def testMode(self):
+        # mkstemp() creates files for the owner only; the result follows the umask
+        for compress in (False, True):
+            path = self.write([u"x"], compress).close(os.path.join(self.tempDir, "app%d.js" % compress))
+            self.failUnlessEqual(os.stat(path).st_mode & 0777, 0644)
+        os.umask(077)
+        path = self.write([u"x"]).close(os.path.join(self.tempDir, "private.js"))
+        self.failUnlessEqual(os.stat(path).st_mode & 0777, 0600)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+import unittest
+import sys, os, shutil, tempfile
+
+libDir = os.path.abspath(os.path.join(os.pardir, os.pardir, "pylib"))
+sys.path.append(libDir)
+from generator import Context
+from generator.runtime.Log import Log
+from generator.runtime.Cache import Cache
+from generator.runtime.InterruptRegistry import InterruptRegistry
+from generator.runtime.FileDigests import FileDigests
+from generator.resource.Raster import Raster
+from generator.resource.ImageClipping import ImageClipping
+
+RED, GREEN, BLUE, WHITE = (255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255), (255, 255, 255, 255)
+
+
+class TestCombine(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        Context.console = Log()
+        cache = Cache(os.path.join(self.tempDir, "cache"), console=Context.console,
+                      interruptRegistry=InterruptRegistry())
+        self.clipper  = ImageClipping(Context.console, cache)
+        self.combined = os.path.join(self.tempDir, "combined.png")
+        self.files    = [self.image("a.png", 2, 2, RED), self.image("b.png", 3, 2, GREEN),
+                         self.image("c.png", 1, 2, BLUE)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+
+    def image(self, name, width, height, color):
+        path = os.path.join(self.tempDir, name)
+        raster = Raster(width, height)
+        raster.pixels = bytearray("".join(chr(v) for v in color) * width * height)
+        raster.write(path)
+        return path
+
+    def columns(self, path):
+        raster = Raster.read(path)
+        return [tuple(raster.pixels[x * 4:x * 4 + 4]) for x in range(raster.width)]
+
+    ##
+    # The inputs of a horizontal combination of files, as combineImages() records them
+    def inputs(self, files):
+        result = []
+        for path in files:
+            raster = Raster.read(path)
+            result.append((path, raster.width, raster.height, FileDigests.compute(path)))
+        return ("x1", result)
+
+
+    def testCombine(self):
+        config = self.clipper.combine(self.combined, self.files, True)
+        self.failUnlessEqual([(clip['left'], clip['width']) for clip in config], [(0, 2), (-2, 3), (-5, 1)])
+        self.failUnlessEqual(self.columns(self.combined), [RED] * 2 + [GREEN] * 3 + [BLUE])
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), [])
+
+
+    def testChangedInputs(self):
+        self.clipper.combine(self.combined, self.files, True)
+        self.image("b.png", 3, 2, WHITE)
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), [self.files[1]])
+        # another size changes the layout
+        self.image("c.png", 2, 2, BLUE)
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), None)
+
+
+    def testChangedCombined(self):
+        self.clipper.combine(self.combined, self.files, True)
+        self.image("combined.png", 6, 2, WHITE)
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), None)
+        os.unlink(self.combined)
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), None)
+
+
+    def testRepasteChanged(self):
+        config = self.clipper.combine(self.combined, self.files, True)
+        self.image("b.png", 3, 2, WHITE)
+        self.image("a.png", 2, 2, BLUE)
+        # only the clips of the changed files are painted on the existing image
+        ImageClipping.writeCombined(config, self.combined, "x1", changed=[self.files[1]])
+        self.failUnlessEqual(self.columns(self.combined), [RED] * 2 + [WHITE] * 3 + [BLUE])
+
+
+    def testRecombineChanged(self):
+        self.clipper.combine(self.combined, self.files, True)
+        self.image("b.png", 3, 2, (0, 0, 0, 0))
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), [self.files[1]])
+        config = self.clipper.combine(self.combined, self.files, True)
+        # the same as writing it from scratch
+        fresh = os.path.join(self.tempDir, "fresh.png")
+        ImageClipping.writeCombined(config, fresh, "x1")
+        self.failUnlessEqual(open(self.combined, "rb").read(), open(fresh, "rb").read())
+        self.failUnlessEqual(self.columns(self.combined), [RED] * 2 + [(0, 0, 0, 0)] * 3 + [BLUE])
+        self.failUnlessEqual(self.clipper._changedInputs(self.combined, self.inputs(self.files)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
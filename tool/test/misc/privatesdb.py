@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+import unittest
+import sys, os, shutil, tempfile, random
+import cPickle as pickle
+
+libDir = os.path.abspath(os.path.join(os.pardir, os.pardir, "pylib"))
+sys.path.append(libDir)
+from generator.runtime.PrivatesDb import PrivatesDb
+from misc.util import convert
+
+NAMES = [u"__p%d" % i for i in range(600)]
+
+
+class TestPrivatesDb(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, "privates.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+
+    def testAllocate(self):
+        repl = ["__" + convert(n) for n in range(3)]
+        db = PrivatesDb(self.path)
+        self.failUnlessEqual(db.allocate([u"__a", u"__b"]), {u"__a": repl[0], u"__b": repl[1]})
+        self.failUnlessEqual(db.allocate([u"__b", u"__c"]), {u"__b": repl[1], u"__c": repl[2]})
+        # another instance reads them from the log
+        self.failUnlessEqual(PrivatesDb(self.path).allocate([u"__c", u"__a"]), {u"__c": repl[2], u"__a": repl[0]})
+        self.failUnlessEqual(len(db), 3)
+
+
+    def testRecreated(self):
+        db = PrivatesDb(self.path)
+        db.allocate([u"__a", u"__b"])
+        os.unlink(self.path)  # like cleaning the cache
+        PrivatesDb(self.path).allocate([u"__b"])
+        # the log is read again for a name that isn't known yet
+        self.failUnlessEqual(db.allocate([u"__c", u"__b"]), {u"__b": "__" + convert(0), u"__c": "__" + convert(1)})
+
+
+    ##
+    # Processes allocating overlapping names in different orders, without any
+    # locking, must all end up with the same replacements
+    def testConcurrentAllocate(self):
+        numProcs = 8
+        children = []
+        for num in range(numProcs):
+            resultPath = os.path.join(self.tempDir, "result%d" % num)
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    rand  = random.Random(num)
+                    names = rand.sample(NAMES, 400)
+                    db    = PrivatesDb(self.path)
+                    result = {}
+                    for i in range(0, len(names), 7):  # like the privates of one class after another
+                        result.update(db.allocate(names[i:i + 7]))
+                    pickle.dump(result, open(resultPath, "wb"))
+                finally:
+                    os._exit(0)
+            children.append((pid, resultPath))
+
+        results = []
+        for pid, resultPath in children:
+            os.waitpid(pid, 0)
+            results.append(pickle.load(open(resultPath, "rb")))
+
+        final = PrivatesDb(self.path).allocate(NAMES)
+        self.failUnlessEqual(len(set(final.values())), len(NAMES))  # replacements are unique
+        for result in results:
+            self.failUnlessEqual(len(result), 400)
+            for name, repl in result.items():
+                self.failUnlessEqual(repl, final[name])
+
+
+if __name__ == '__main__':
+    unittest.main()
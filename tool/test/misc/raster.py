@@ -0,0 +1,291 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+import unittest
+import sys, os, shutil, tempfile, struct, zlib, random
+
+libDir = os.path.abspath(os.path.join(os.pardir, os.pardir, "pylib"))
+sys.path.append(libDir)
+from generator.resource.Raster import Raster, RasterError, PNG_SIGNATURE
+from generator.resource.Raster import _pngChunk, _lzwEncode, _lzwDecode
+
+# (x0, y0, dx, dy) of the Adam7 passes
+PASSES = [(0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4),
+          (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2)]
+
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+##
+# Pack the samples of a scanline at depth bits each
+def packSamples(values, depth):
+    if depth == 16:
+        return "".join(struct.pack("!H", v) for v in values)
+    if depth == 8:
+        return "".join(chr(v) for v in values)
+    perByte = 8 // depth
+    result = []
+    for i in range(0, len(values), perByte):
+        byte = 0
+        for j, v in enumerate(values[i:i + perByte]):
+            byte |= v << (8 - depth * (j + 1))
+        result.append(chr(byte))
+    return "".join(result)
+
+
+##
+# Apply PNG filter ftype to a scanline
+def filterRow(ftype, row, prev, bpp):
+    row, prev = bytearray(row), bytearray(prev)
+    result = bytearray(len(row))
+    for i in range(len(row)):
+        a = row[i - bpp] if i >= bpp else 0
+        b = prev[i]
+        c = prev[i - bpp] if i >= bpp else 0
+        if ftype == 0:
+            pred = 0
+        elif ftype == 1:
+            pred = a
+        elif ftype == 2:
+            pred = b
+        elif ftype == 3:
+            pred = (a + b) // 2
+        else:
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+        result[i] = (row[i] - pred) & 0xff
+    return str(result)
+
+
+##
+# A PNG file of the samples [[(channel values) per pixel] per row]; filters
+# gives the filter type of each scanline, in turn
+def pngData(samples, colorType, depth, plte=None, trns=None, interlace=False, filters=(0,)):
+    height, width = len(samples), len(samples[0])
+    bpp = max(1, CHANNELS[colorType] * depth // 8)
+    raw = []
+    count = 0
+    for x0, y0, dx, dy in (PASSES if interlace else [(0, 0, 1, 1)]):
+        rows = [[v for px in samples[y][x0::dx] for v in px] for y in range(y0, height, dy)]
+        if not rows or not rows[0]:
+            continue
+        prev = "\x00" * len(packSamples(rows[0], depth))
+        for row in rows:
+            packed = packSamples(row, depth)
+            ftype = filters[count % len(filters)]
+            raw.append(chr(ftype) + filterRow(ftype, packed, prev, bpp))
+            prev = packed
+            count += 1
+    chunks = [PNG_SIGNATURE,
+              _pngChunk("IHDR", struct.pack("!IIBBBBB", width, height, depth, colorType, 0, 0, int(interlace)))]
+    if plte:
+        chunks.append(_pngChunk("PLTE", plte))
+    if trns:
+        chunks.append(_pngChunk("tRNS", trns))
+    chunks.append(_pngChunk("IDAT", zlib.compress("".join(raw))))
+    chunks.append(_pngChunk("IEND", ""))
+    return "".join(chunks)
+
+
+def sampleImage(width, height, channels, depth):
+    maxv = (1 << depth) - 1
+    return [[tuple(((x * 7 + y * 13 + k * 5) * (257 if depth == 16 else 1) + x) & maxv
+                   for k in range(channels))
+             for x in range(width)] for y in range(height)]
+
+
+class TestRaster(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+
+    def readData(self, data, name="test.png"):
+        path = os.path.join(self.tempDir, name)
+        out = open(path, "wb")
+        out.write(data)
+        out.close()
+        return Raster.read(path)
+
+    def pixel(self, raster, x, y):
+        i = (y * raster.width + x) * 4
+        return tuple(raster.pixels[i:i + 4])
+
+    def makeRaster(self, pixels):
+        raster = Raster(len(pixels[0]), len(pixels))
+        raster.pixels = bytearray("".join("".join(chr(v) for v in px) for row in pixels for px in row))
+        return raster
+
+
+    def checkPng(self, colorType, depth, width=11, height=5, interlace=False, filters=(0,)):
+        samples = sampleImage(width, height, CHANNELS[colorType], depth)
+        maxv = (1 << depth) - 1
+        scale = lambda v: v >> 8 if depth == 16 else v * 255 // maxv
+        plte = None
+        if colorType == 3:
+            plte = "".join(chr(i * 3 % 256) + chr(255 - i) + chr(i * 5 % 256) for i in range(maxv + 1))
+        raster = self.readData(pngData(samples, colorType, depth, plte, interlace=interlace, filters=filters))
+        self.failUnlessEqual((raster.width, raster.height), (width, height))
+        for y in range(height):
+            for x in range(width):
+                s = samples[y][x]
+                if colorType == 0:
+                    expected = (scale(s[0]),) * 3 + (255,)
+                elif colorType == 2:
+                    expected = tuple(scale(v) for v in s) + (255,)
+                elif colorType == 3:
+                    expected = (s[0] * 3 % 256, 255 - s[0], s[0] * 5 % 256, 255)
+                elif colorType == 4:
+                    expected = (scale(s[0]),) * 3 + (scale(s[1]),)
+                else:
+                    expected = tuple(scale(v) for v in s)
+                self.failUnlessEqual(self.pixel(raster, x, y), expected,
+                                     "color type %d, depth %d: pixel %d,%d" % (colorType, depth, x, y))
+
+
+    def testPngColorTypesAndDepths(self):
+        for colorType, depths in [(0, (1, 2, 4, 8, 16)), (2, (8, 16)), (3, (1, 2, 4, 8)),
+                                  (4, (8, 16)), (6, (8, 16))]:
+            for depth in depths:
+                self.checkPng(colorType, depth)
+
+
+    def testPngFilters(self):
+        for colorType, depth in [(2, 8), (6, 16), (0, 1)]:
+            self.checkPng(colorType, depth, height=10, filters=(0, 1, 2, 3, 4))
+
+
+    def testPngInterlaced(self):
+        # sizes that leave some of the Adam7 passes empty, too
+        for width, height in [(1, 1), (3, 2), (9, 10), (17, 8)]:
+            for colorType, depth in [(2, 8), (0, 1), (3, 4), (6, 16)]:
+                self.checkPng(colorType, depth, width, height, interlace=True, filters=(0, 1, 2, 3, 4))
+
+
+    def testPngTransparency(self):
+        # color key for gray and RGB, alpha table for palette images
+        raster = self.readData(pngData([[(0,), (5,), (15,)]], 0, 4, trns=struct.pack("!H", 5)))
+        self.failUnlessEqual([self.pixel(raster, x, 0)[3] for x in range(3)], [255, 0, 255])
+        raster = self.readData(pngData([[(1, 2, 3), (1, 2, 4)]], 2, 8, trns=struct.pack("!HHH", 1, 2, 3)))
+        self.failUnlessEqual([self.pixel(raster, x, 0)[3] for x in range(2)], [0, 255])
+        raster = self.readData(pngData([[(0,), (1,), (2,)]], 3, 8, plte="\x10" * 9, trns="\x00\x80"))
+        self.failUnlessEqual([self.pixel(raster, x, 0)[3] for x in range(3)], [0, 128, 255])
+
+
+    def testPngWrite(self):
+        # few colors: written with a palette; many colors: as RGBA
+        few  = [[(255, 0, 0, 255), (0, 0, 0, 0), (0, 255, 0, 128)], [(0, 0, 0, 0), (1, 2, 3, 255), (255, 0, 0, 255)]]
+        many = [[(x, y, x ^ y, (x * y) & 0xff) for x in range(20)] for y in range(20)]
+        for pixels in (few, many):
+            path = os.path.join(self.tempDir, "out.png")
+            self.makeRaster(pixels).write(path)
+            raster = Raster.read(path)
+            self.failUnlessEqual(str(raster.pixels), str(self.makeRaster(pixels).pixels))
+
+
+    def testCorrupt(self):
+        self.failUnlessRaises(RasterError, self.readData, PNG_SIGNATURE + "garbage")
+        self.failUnlessRaises(RasterError, self.readData, "\xff\xd8\xff\xe0", "test.jpg")
+        self.failUnlessRaises(RasterError, self.makeRaster([[(0, 0, 0, 0)]]).write,
+                              os.path.join(self.tempDir, "out.jpg"))
+
+
+    def testGifTransparency(self):
+        # the usual 1x1 transparent GIF
+        data = ("GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff"
+                "!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;")
+        raster = self.readData(data, "test.gif")
+        self.failUnlessEqual(self.pixel(raster, 0, 0), (0, 0, 0, 0))
+
+        pixels = [[(255, 0, 0, 255), (0, 0, 0, 0)], [(0, 0, 0, 0), (0, 0, 255, 255)]]
+        path = os.path.join(self.tempDir, "out.gif")
+        self.makeRaster(pixels).write(path)
+        self.failUnlessEqual(str(Raster.read(path).pixels), str(self.makeRaster(pixels).pixels))
+
+        semi = self.makeRaster([[(255, 0, 0, 128)]])
+        self.failUnlessRaises(RasterError, semi.write, path)
+
+
+    def testGifInterlaced(self):
+        width, height = 3, 10
+        colors = "".join(chr(i * 20) * 3 for i in range(height)) + "\x00" * 3 * (16 - height)
+        rows = range(0, height, 8) + range(4, height, 8) + range(2, height, 4) + range(1, height, 2)
+        indices = bytearray([y for y in rows for x in range(width)])
+        lzw = _lzwEncode(indices, 4)
+        data = "".join(["GIF89a", struct.pack("<HHBBB", width, height, 0x80 | 3, 0, 0), colors,
+                        struct.pack("<cHHHHBB", ",", 0, 0, width, height, 0x40, 4)]
+                       + [chr(len(lzw[i:i + 255])) + lzw[i:i + 255] for i in range(0, len(lzw), 255)]
+                       + ["\x00;"])
+        raster = self.readData(data, "test.gif")
+        for y in range(height):
+            self.failUnlessEqual(self.pixel(raster, 1, y), (y * 20,) * 3 + (255,))
+
+
+    def testLzwCodeSizeBoundaries(self):
+        rand = random.Random(42)
+        for minCodeSize in (2, 4, 8):
+            # every length up to where the code size has grown a few times
+            for length in range(1, 300):
+                indices = bytearray(rand.randrange(1 << minCodeSize) for i in range(length))
+                self.failUnlessEqual(_lzwDecode(_lzwEncode(indices, minCodeSize), minCodeSize), str(indices))
+            # past 4096 codes, where the table is cleared
+            indices = bytearray(rand.randrange(1 << minCodeSize) for i in range(30000))
+            self.failUnlessEqual(_lzwDecode(_lzwEncode(indices, minCodeSize), minCodeSize), str(indices))
+            # runs, where codes are used right after being added to the table
+            indices = bytearray([1] * 10000)
+            self.failUnlessEqual(_lzwDecode(_lzwEncode(indices, minCodeSize), minCodeSize), str(indices))
+
+
+    def testCrop(self):
+        raster = self.makeRaster([[(x, y, 0, 255) for x in range(4)] for y in range(3)])
+        part = raster.crop(2, 2, 1, 1)
+        self.failUnlessEqual((part.width, part.height), (2, 2))
+        self.failUnlessEqual([self.pixel(part, x, y)[:2] for y in range(2) for x in range(2)],
+                             [(1, 1), (2, 1), (1, 2), (2, 2)])
+        # 0 means all of it, and regions are clipped to the image
+        self.failUnlessEqual(str(raster.crop(0, 0, 0, 0).pixels), str(raster.pixels))
+        part = raster.crop(10, 10, 3, 1)
+        self.failUnlessEqual((part.width, part.height), (1, 2))
+        self.failUnlessEqual(self.pixel(part, 0, 0)[:2], (3, 1))
+        part = raster.crop(2, 1, -1, -1)
+        self.failUnlessEqual(self.pixel(part, 0, 0)[:2], (0, 0))
+        part = raster.crop(2, 2, 5, 5)
+        self.failUnlessEqual((part.width, part.height, len(part.pixels)), (0, 0, 0))
+
+
+    def testPaste(self):
+        red = (255, 0, 0, 255)
+        canvas = Raster(4, 4)
+        canvas.paste(self.makeRaster([[red] * 3] * 3), 2, 2)
+        painted = [(x, y) for y in range(4) for x in range(4) if self.pixel(canvas, x, y) == red]
+        self.failUnlessEqual(painted, [(2, 2), (3, 2), (2, 3), (3, 3)])
+        before = str(canvas.pixels)
+        canvas.paste(self.makeRaster([[red]]), 4, 0)
+        canvas.paste(self.makeRaster([[red]]), 0, 4)
+        self.failUnlessEqual(str(canvas.pixels), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+################################################################################
+#
+#  qooxdoo - the new era of web development
+#
+#  http://qooxdoo.org
+#
+#  Copyright:
+#    2006-2011 1&1 Internet AG, Germany, http://www.1und1.de
+#
+#  License:
+#    LGPL: http://www.gnu.org/licenses/lgpl.html
+#    EPL: http://www.eclipse.org/org/documents/epl-v10.php
+#    See the LICENSE file in the project's top-level directory for details.
+#
+#  Authors:
+#    * Thomas Herchenroeder (thron7)
+#
+################################################################################
+
+import unittest
+import sys, os, re, shutil, tempfile
+
+libDir = os.path.abspath(os.path.join(os.pardir, os.pardir, "pylib"))
+sys.path.append(libDir)
+from generator.resource.Snapshot import Snapshot
+
+IGNORE = re.compile(r"^\.svn$")
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.root    = os.path.join(self.tempDir, "root")
+        self.target  = os.path.join(self.tempDir, "target")
+        os.mkdir(self.root)
+        os.mkdir(self.target)
+        self.touch(self.target, "foo.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+
+    def touch(self, *parts):
+        path = os.path.join(*parts)
+        open(path, "w").close()
+        return path
+
+
+    def testAddChangeRemove(self):
+        self.touch(self.root, "a.js")
+        snapshot = Snapshot(self.root, IGNORE)
+        self.failUnlessEqual(snapshot.update().added, [os.path.join(self.root, "a.js")])
+        self.failIf(snapshot.update())
+        open(os.path.join(self.root, "a.js"), "w").write("changed")
+        self.failUnlessEqual(snapshot.update().changed, [os.path.join(self.root, "a.js")])
+        os.unlink(os.path.join(self.root, "a.js"))
+        self.failUnlessEqual(snapshot.update().removed, [os.path.join(self.root, "a.js")])
+
+
+    def testTwoLinksSameTarget(self):
+        os.symlink(self.target, os.path.join(self.root, "link1"))
+        os.symlink(self.target, os.path.join(self.root, "link2"))
+        snapshot = Snapshot(self.root, IGNORE)
+        self.failUnlessEqual(sorted(snapshot.update().added),
+                             [os.path.join(self.root, "link1", "foo.txt"),
+                              os.path.join(self.root, "link2", "foo.txt")])
+        self.failUnlessEqual(len(list(snapshot)), 2)
+
+
+    def testSymlinkCycle(self):
+        os.symlink(self.target, os.path.join(self.root, "link"))
+        os.symlink(self.root, os.path.join(self.target, "back"))    # link/back -> root
+        os.symlink(self.target, os.path.join(self.target, "self"))  # link/self -> link
+        snapshot = Snapshot(self.root, IGNORE)
+        self.failUnlessEqual(snapshot.update().added, [os.path.join(self.root, "link", "foo.txt")])
+
+
+if __name__ == '__main__':
+    unittest.main()